@@ -0,0 +1,672 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import time
+import uuid
+
+from HMDriverClient.client import TestRunner, backoff_delays, parse_reply
+from HMDriverClient.element import ElementBy, ElementOperate
+from HMDriverClient.exception import *
+from HMDriverClient.hdcstd import HDC, decode_screen_cap, screen_cap_command
+from HMDriverClient.protocol import CODECS, ENCODINGS, FRAME_HEADER, FRAME_HEADER_SIZE, MAX_FRAME_SIZE, \
+    UPGRADE_HINT, check_hello_header, hello_encoding, hello_frame, pack_frame
+from HMDriverClient.selector import compile_selector
+from HMDriverClient.window import WindowFilter
+
+
+async def read_frame(reader: asyncio.StreamReader) -> bytes:
+    """
+    read one length-prefixed frame from an asyncio stream
+    :return: payload of the frame
+    """
+    header = await reader.readexactly(FRAME_HEADER_SIZE)
+    size = FRAME_HEADER.unpack(header)[0]
+    if size > MAX_FRAME_SIZE:
+        raise SocketError(f"frame too large: {size} bytes")
+    return await reader.readexactly(size)
+
+
+async def read_hello(reader: asyncio.StreamReader) -> str:
+    """
+    read the hello reply
+    :return: encoding chosen by the device
+    :raise ProtocolVersionError: the device runner does not speak this protocol
+    """
+    header = await reader.readexactly(FRAME_HEADER_SIZE)
+    check_hello_header(header)
+    return hello_encoding(await reader.readexactly(FRAME_HEADER.unpack(header)[0]))
+
+
+class AsyncClient(TestRunner):
+    """
+    asyncio version of Client: one stream connection per device, replies are routed to waiters by uuid,
+    so one event loop can drive many devices without a thread each
+    """
+    socket_buffer_size = 65536
+    find_timeout_s = 20
+    hello_timeout_s = 5
+    encodings = ENCODINGS
+    redial_timeout_s = 2
+
+    def __init__(self, serial, local_port=None, host="127.0.0.1"):
+        super(AsyncClient, self).__init__(serial, local_port)
+        self.host = host
+        self.reader = None
+        self.writer = None
+        self._pending = {}
+        self._dumps, self._loads = CODECS["json"]
+        self._read_task = None
+        self._reconnect_lock = None
+        self.last_dial_error = None
+
+    async def start(self, timeout=30):
+        """
+        start the test runner, forward the port and connect
+        """
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.start_test_runner)
+        await self.connect_socket(timeout)
+
+    async def stop(self):
+        await self.close()
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, self.stop_test_runner)
+        finally:
+            self.release_port()
+
+    async def _try_dial(self, timeout):
+        """
+        open_connection with exponential backoff until connected or timeout
+        :return: True if connected
+        """
+        loop = asyncio.get_event_loop()
+        st = time.time()
+        for delay in backoff_delays():
+            try:
+                await asyncio.wait_for(self.open_connection(), self.hello_timeout_s)
+                return True
+            except ProtocolVersionError:
+                raise
+            except Exception as e:
+                logging.debug(f"dial failed: {e}")
+                self.last_dial_error = e
+                if isinstance(e, ConnectionRefusedError):
+                    await loop.run_in_executor(None, self.forward_port)
+                if time.time() - st + delay > timeout:
+                    return False
+                await asyncio.sleep(delay)
+
+    async def connect_socket(self, timeout=30):
+        logging.info("start socket client init")
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.forward_port)
+        if not await self._try_dial(timeout):
+            if isinstance(self.last_dial_error, asyncio.TimeoutError):
+                # 连接已建立但hello一直没有回复，设备端的runner不认识帧格式的hello
+                raise ProtocolVersionError(f"no hello reply within {self.hello_timeout_s} seconds, {UPGRADE_HINT}")
+            raise Exception(f"socket client init timeout after {timeout} seconds!")
+
+    async def open_connection(self):
+        """
+        connect to the socket server on host:local_port, without touching hdc
+        """
+        reader, writer = await asyncio.open_connection(self.host, self.local_port, limit=self.socket_buffer_size)
+        try:
+            writer.write(hello_frame(self.encodings))
+            encoding = await asyncio.wait_for(read_hello(reader), self.hello_timeout_s)
+        except BaseException:
+            writer.close()
+            raise
+        logging.info(f"socket client init ok, encoding: {encoding}")
+        self._dumps, self._loads = CODECS[encoding]
+        self.reader, self.writer = reader, writer
+        self._read_task = asyncio.ensure_future(self._read_loop(reader, writer))
+
+    async def _read_loop(self, reader, writer):
+        try:
+            while True:
+                re_dict = self._loads(await read_frame(reader))
+                future = self._pending.pop(re_dict.get("uuid", ""), None)
+                if future is None:
+                    logging.warning(f"drop reply without waiter: {re_dict.get('uuid', '')}")
+                    continue
+                if not future.done():
+                    future.set_result(re_dict)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logging.exception(e)
+        if self.writer is writer:
+            self.reader, self.writer = None, None
+        writer.close()
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(SocketError("connection lost"))
+
+    async def close(self):
+        if self._read_task:
+            self._read_task.cancel()
+            try:
+                await self._read_task
+            except asyncio.CancelledError:
+                pass
+            self._read_task = None
+
+    async def reconnect_socket(self):
+        """
+        same tiers as Client.reconnect_socket: redial, re-forward, then restart the runner
+        """
+        if self._reconnect_lock is None:
+            self._reconnect_lock = asyncio.Lock()
+        async with self._reconnect_lock:
+            # 其他协程已经重连成功
+            if self.writer is not None:
+                return
+            loop = asyncio.get_event_loop()
+            if await self._try_dial(self.redial_timeout_s):
+                return
+            await loop.run_in_executor(None, self.refresh_forward)
+            if await self._try_dial(self.redial_timeout_s):
+                return
+            alive = await loop.run_in_executor(None, self.runner_alive)
+            if alive and await self._try_dial(self.hello_timeout_s):
+                return
+            logging.warning("test runner is not responding, restart it, element handles are lost")
+            await loop.run_in_executor(None, self.stop_test_runner)
+            await loop.run_in_executor(None, self.start_test_runner)
+            await self.connect_socket()
+
+    def _total_timeout(self, msg_data):
+        time_s = float(msg_data.get("time_s", 0))
+        timeout_s = float(msg_data.get("timeout_s", 0))
+        return self.find_timeout_s + timeout_s + time_s
+
+    async def _request_once(self, msg_data):
+        if self.writer is None:
+            raise SocketError("not connected")
+        data_dict = dict(msg_data)
+        tmp_uuid = str(uuid.uuid1()).replace("-", "")
+        data_dict["uuid"] = tmp_uuid
+        logging.debug("data_dict: %s", data_dict)
+        future = asyncio.get_event_loop().create_future()
+        self._pending[tmp_uuid] = future
+        total_s = self._total_timeout(msg_data)
+        try:
+            self.writer.write(pack_frame(self._dumps(data_dict)))
+            await self.writer.drain()
+            re_dict = await asyncio.wait_for(future, total_s)
+        except asyncio.TimeoutError:
+            raise ElementFoundTimeout(f"wait for {total_s} seconds")
+        except (OSError, ConnectionError) as e:
+            raise SocketError(f"send failed: {e}")
+        finally:
+            self._pending.pop(tmp_uuid, None)
+        return parse_reply(re_dict)
+
+    async def request(self, msg_data):
+        re_dict = None
+        for rr in range(2):
+            try:
+                re_dict = await self._request_once(msg_data)
+            except SocketError as se:
+                logging.exception(se)
+                await self.reconnect_socket()
+                continue
+            break
+        return re_dict
+
+
+class AsyncElement(object):
+    def __init__(self, client: AsyncClient, euid: str, property):
+        self._client = client
+        self.euid = euid
+        self._property = property
+
+    def __repr__(self):
+        return f'<AsyncElement(euid={self.euid}, id={self._property.get("id")}, ' \
+               f'text={self._property.get("text")}, type={self._property.get("type")}, ' \
+               f'bounds={self._property.get("bounds")})>'
+
+    @property
+    def properties(self):
+        """
+        查找时返回的控件属性
+        """
+        return self._property
+
+    async def get_properties(self, fields=None):
+        """
+        从设备获取控件属性，只执行fields中属性对应的getter
+        :param fields: 属性列表(ElementAttribute)，为None时获取全部属性
+        :return: 属性字典
+        """
+        data = {"action": "get", "property": 'info', "euid": self.euid}
+        if fields:
+            data["fields"] = list(fields)
+        resp = await self._client.request(data)
+        return self.update_properties(resp["data"])
+
+    async def refresh(self, fields=None):
+        """
+        从设备重新获取控件属性，同get_properties
+        """
+        return await self.get_properties(fields)
+
+    def update_properties(self, property: dict):
+        """
+        合并新获取的属性到缓存中
+        """
+        self._property.update(property)
+        return property
+
+    async def get(self, attribute):
+        """
+        获取控件属性，已获取过的属性直接返回
+        :param attribute: ElementAttribute类型
+        """
+        if not self._property:
+            await self.refresh()
+        if attribute not in self._property:
+            data = {"action": "get", "property": attribute, "euid": self.euid}
+            self._property[attribute] = (await self._client.request(data))["data"]
+        return self._property[attribute]
+
+    async def release(self):
+        """
+        释放设备端的控件句柄
+        """
+        await self._client.request({"action": "release", "euids": [self.euid]})
+
+    async def _operate(self, operate, param: dict = None):
+        data = {
+            "action": "operate",
+            "operate": operate,
+            "euid": self.euid,
+            **(param or {})
+        }
+        return (await self._client.request(data))["data"]
+
+    async def tap(self):
+        return await self._operate(ElementOperate.click)
+
+    async def click(self):
+        return await self.tap()
+
+    async def double_click(self):
+        return await self._operate(ElementOperate.doubleClick)
+
+    async def long_click(self):
+        return await self._operate(ElementOperate.longClick)
+
+    async def input(self, text):
+        return await self._operate(ElementOperate.input, {"text": text})
+
+    async def clear(self):
+        return await self._operate(ElementOperate.clear)
+
+    async def scrollToTop(self, speed=1.0):
+        return await self._operate(ElementOperate.scrollToTop, {"param": speed})
+
+    async def scrollToBottom(self, speed=1.0):
+        return await self._operate(ElementOperate.scrollToBottom, {"param": speed})
+
+    async def dragTo(self, ele):
+        return await self._operate(ElementOperate.dragTo, {"param": ele.euid})
+
+    async def pinchOut(self, scale=1.0):
+        return await self._operate(ElementOperate.pinchOut, {"param": scale})
+
+    async def pinchIn(self, scale=1.0):
+        return await self._operate(ElementOperate.pinchIn, {"param": scale})
+
+    async def scrollSearch(self, by: ElementBy, data: str):
+        try:
+            data = {
+                "action": "operate",
+                "operate": ElementOperate.scrollSearch,
+                "euid": self.euid,
+                "param": {"by": by, "data": data}
+            }
+            if by == ElementBy.selector:
+                data["param"]["query"] = compile_selector(data["param"]["data"]).query
+            resp = await self._client.request(data)
+            return AsyncElement(self._client, resp["euid"], resp["property"])
+        except Exception as e:
+            logging.error(f"find element Error! {e}")
+            return None
+
+
+class AsyncUiWindow(object):
+    def __init__(self, client: AsyncClient, wuid: str, property):
+        self._client = client
+        self.wuid = wuid
+        self._property = property
+
+    def __repr__(self):
+        return f'<AsyncUiWindow(wuid={self.wuid}, title={self._property.get("title")}, ' \
+               f'bundleName={self._property.get("bundleName")}, bounds={self._property.get("bounds")})>'
+
+    @property
+    def properties(self):
+        """
+        查找时返回的窗口属性
+        """
+        return self._property
+
+    async def get(self, attribute):
+        """
+        获取窗口属性，已获取过的属性直接返回
+        :param attribute: WindowAttribute类型
+        """
+        if attribute not in self._property:
+            data = {
+                "action": "window",
+                "operate": "get",
+                "property": attribute,
+                "wuid": self.wuid
+            }
+            self._property[attribute] = (await self._client.request(data))["data"]
+        return self._property[attribute]
+
+    async def release(self):
+        """
+        释放设备端的窗口句柄
+        """
+        await self._client.request({"action": "release", "wuids": [self.wuid]})
+
+    async def _operate(self, operate, param: dict = None):
+        data = {
+            "action": "window",
+            "operate": "action",
+            "func": operate,
+            "wuid": self.wuid,
+            **(param or {})
+        }
+        await self._client.request(data)
+
+    async def focus(self):
+        await self._operate("focus")
+
+    async def moveTo(self, x: int, y: int):
+        await self._operate("moveTo", {'x': x, 'y': y})
+
+    async def maximize(self):
+        await self._operate("maximize")
+
+    async def minimize(self):
+        await self._operate("minimize")
+
+    async def resume(self):
+        await self._operate("resume")
+
+    async def close(self):
+        await self._operate("close")
+
+
+class AsyncHMDriver(object):
+    """
+    HMDriver的asyncio版本，接口与HMDriver一致，需要await调用
+    示例:
+    async def main():
+        async with AsyncHMDriver("127.0.0.1:5555") as hdriver:
+            ele = await hdriver.find_element_by_text("设置")
+            await ele.click()
+    """
+
+    def __init__(self, device_id: str, app_bundle: str = "", app_ability: str = "", local_port: int = None):
+        self.device_id = device_id
+        self.app_bundle = app_bundle
+        self.app_ability = app_ability
+        self.hdc = HDC(self.device_id)
+        self.client = AsyncClient(self.device_id, local_port=local_port)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
+
+    async def start(self):
+        """
+        安装并启动UiTestAPP，建立连接
+        """
+        from HMDriverClient.hmdriver import install_test_haps
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, install_test_haps, self.hdc)
+        await self.client.start()
+
+    async def stop(self):
+        await self.client.stop()
+
+    async def req(self, msg_data):
+        try:
+            return await self.client.request(msg_data)
+        except Exception as e:
+            logging.error(f"request Error! {e}")
+            return None
+
+    async def find_element(self, by: str, data: str, params=None, timeout_s: int = 10, fields=None):
+        """
+        查找控件
+        :param by: ElementBy类型
+        :param data: 对应by的取值
+        :param params: 查找控件的其他限定条件，以字典形式传入{ElementBy.text: ""}
+        :param timeout_s: 查找控件超时时间，单位秒
+        :param fields: 需要返回的控件属性列表(ElementAttribute)，为None时返回全部属性
+        :return: 控件对象，如果查找失败返回None
+        """
+        try:
+            msg_data = {
+                "action": "find",
+                "by": by,
+                "data": data,
+                "timeout_s": timeout_s,
+                "params": params
+            }
+            if fields:
+                msg_data["fields"] = list(fields)
+            if by == ElementBy.selector:
+                msg_data["query"] = compile_selector(data).query
+            resp = await self.req(msg_data)
+            return AsyncElement(self.client, resp["euid"], resp["property"])
+        except Exception as e:
+            logging.error(f"find element Error! {e}")
+            return None
+
+    async def find_element_by_id(self, id: str, params=None, timeout_s: int = 10, fields=None):
+        return await self.find_element(ElementBy.id, id, params, timeout_s, fields)
+
+    async def find_element_by_text(self, text: str, params=None, timeout_s: int = 10, fields=None):
+        return await self.find_element(ElementBy.text, text, params, timeout_s, fields)
+
+    async def find_element_by_desc(self, desc: str, params=None, timeout_s: int = 10, fields=None):
+        return await self.find_element(ElementBy.description, desc, params, timeout_s, fields)
+
+    async def find_element_by_type(self, typename: str, params=None, timeout_s: int = 10, fields=None):
+        return await self.find_element(ElementBy.type, typename, params, timeout_s, fields)
+
+    async def find_element_by_selector(self, selector: str, timeout_s: int = 10, fields=None):
+        return await self.find_element(ElementBy.selector, selector, None, timeout_s, fields)
+
+    async def find_elements(self, by: str, data: str, params=None, timeout_s=20, fields=None):
+        """
+        查找多个控件, 与find_element一样,只是该函数返回控件对象列表
+        :return: 控件对象列表，如果查找失败返回None
+        """
+        try:
+            msg_data = {
+                "action": "finds",
+                "by": by,
+                "data": data,
+                "timeout_s": timeout_s,
+                "params": params
+            }
+            if fields:
+                msg_data["fields"] = list(fields)
+            if by == ElementBy.selector:
+                msg_data["query"] = compile_selector(data).query
+            resp = await self.req(msg_data)
+            ele_list = resp["data"] if resp else []
+            if not ele_list:
+                return None
+            return [AsyncElement(self.client, ele["euid"], ele["property"]) for ele in ele_list]
+        except Exception as e:
+            logging.error(f"find elements Error! {e}")
+            return None
+
+    async def find_elements_by_id(self, id: str, params=None, timeout_s: int = 10, fields=None):
+        return await self.find_elements(ElementBy.id, id, params, timeout_s, fields)
+
+    async def find_elements_by_text(self, text: str, params=None, timeout_s: int = 10, fields=None):
+        return await self.find_elements(ElementBy.text, text, params, timeout_s, fields)
+
+    async def find_elements_by_desc(self, desc: str, params=None, timeout_s: int = 10, fields=None):
+        return await self.find_elements(ElementBy.description, desc, params, timeout_s, fields)
+
+    async def find_elements_by_type(self, typename: str, params=None, timeout_s: int = 10, fields=None):
+        return await self.find_elements(ElementBy.type, typename, params, timeout_s, fields)
+
+    async def find_elements_by_selector(self, selector: str, timeout_s: int = 10, fields=None):
+        return await self.find_elements(ElementBy.selector, selector, None, timeout_s, fields)
+
+    async def get_properties(self, elements, fields=None):
+        """
+        一次请求批量获取多个控件的属性
+        :param elements: 控件对象列表
+        :param fields: 需要获取的属性列表(ElementAttribute)，为None时获取全部属性
+        :return: 属性字典列表，与elements顺序一致，获取失败的控件对应None
+        """
+        msg_data = {"action": "gets", "euids": [ele.euid for ele in elements]}
+        if fields:
+            msg_data["fields"] = list(fields)
+        resp = await self.req(msg_data)
+        if not resp:
+            return [None] * len(elements)
+        ret = []
+        for ele, item in zip(elements, resp["data"]):
+            if "property" not in item:
+                logging.error(f"get properties Error! {item.get('error')}")
+                ret.append(None)
+                continue
+            ele.update_properties(item["property"])
+            ret.append(item["property"])
+        return ret
+
+    async def find_window(self, filters, fields=None):
+        """
+        查找窗口，返回窗口对象
+        :param filters: 查找窗口的限定条件，以字典形式传入, 可用条件参考 WindowFilter
+        :param fields: 需要返回的窗口属性列表(WindowAttribute)，为None时返回全部属性
+        :return: 窗口对象，如果查找失败返回None
+        """
+        try:
+            data = {
+                "action": "window",
+                "operate": "find",
+                "filter": filters
+            }
+            if fields:
+                data["fields"] = list(fields)
+            resp = await self.req(data)
+            return AsyncUiWindow(self.client, resp["euid"], resp["property"])
+        except Exception as e:
+            logging.error(f"find window Error! {e}")
+            return None
+
+    async def find_window_by_title(self, title: str):
+        return await self.find_window({WindowFilter.title: title})
+
+    async def find_window_by_bundlename(self, bundleName: str):
+        return await self.find_window({WindowFilter.bundleName: bundleName})
+
+    async def find_window_by_focused(self):
+        return await self.find_window({WindowFilter.focused: True})
+
+    async def _click(self, action, x, y):
+        resp = await self.req({"action": action, "x": x, "y": y})
+        return True if resp else False
+
+    async def click(self, x, y):
+        return await self._click("click", x, y)
+
+    async def double_click(self, x, y):
+        return await self._click("doubleClick", x, y)
+
+    async def long_click(self, x, y):
+        return await self._click("longClick", x, y)
+
+    async def _swipe(self, action, startx, starty, endx, endy, time_s):
+        # 滑动速率，范围：200-40000，不在范围内设为默认值为600，单位：像素点/秒
+        speed = int(max(abs(startx - endx), abs(starty - endy)) / time_s)
+        speed = 600 if speed < 200 else (600 if speed > 40000 else speed)
+        data = {
+            "action": action,
+            "startx": int(startx),
+            "starty": int(starty),
+            "endx": int(endx),
+            "endy": int(endy),
+            "speed": speed,
+            "time_s": time_s
+        }
+        resp = await self.req(data)
+        return True if resp else False
+
+    async def swipe(self, startx, starty, endx, endy, time_s=1):
+        return await self._swipe("swipe", startx, starty, endx, endy, time_s)
+
+    async def drag(self, startx, starty, endx, endy, time_s=1):
+        return await self._swipe("drag", startx, starty, endx, endy, time_s)
+
+    async def fling(self, direction, speed=600):
+        speed = 600 if speed < 200 else (600 if speed > 40000 else speed)
+        resp = await self.req({"action": "fling", "direction": direction, "speed": speed})
+        return True if resp else False
+
+    async def home(self):
+        resp = await self.req({"action": "home"})
+        return True if resp else False
+
+    async def back(self):
+        resp = await self.req({"action": "back"})
+        return True if resp else False
+
+    async def press_key(self, key_code: int, key2: int = 0, key3: int = 0):
+        resp = await self.req({"action": "keyEvent", "key": key_code, "key1": key2, "key2": key3})
+        return True if resp else False
+
+    async def set_rotation(self, rotation):
+        resp = await self.req({"action": "setRotation", "rotation": rotation})
+        return True if resp else False
+
+    async def get_rotation(self):
+        resp = await self.req({"action": "getRotation"})
+        return resp["data"] if resp else False
+
+    async def wake_up(self):
+        resp = await self.req({"action": "wakeup"})
+        return True if resp else False
+
+    async def get_screen_size(self):
+        resp = (await self.req({"action": "screenSize"}))["data"]
+        return {"width": resp["x"], "height": resp["y"]}
+
+    async def get_current_bundle(self):
+        return (await self.req({"action": "currentBundle"}))["data"]
+
+    async def get_screenshot_png(self, local_path=None):
+        """
+        截图，图片数据直接读到内存，不经过临时文件
+        :param local_path: 不为空则保存到该路径并返回路径，为空则返回截图的二进制数据
+        """
+        proc = await asyncio.create_subprocess_exec("hdc", "-t", self.device_id, "shell", screen_cap_command(),
+                                                    stdout=asyncio.subprocess.PIPE)
+        out, _ = await proc.communicate()
+        png_bytes = decode_screen_cap(out)
+        if local_path:
+            with open(local_path, "wb") as ff:
+                ff.write(png_bytes)
+            return local_path
+        return png_bytes
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+from HMDriverClient.element import Element, ElementBy, ElementOperate
+from HMDriverClient.exception import *
+from HMDriverClient.selector import compile_selector
+
+
+# 设备端执行后调用commonWaitIdle的action，waitForIdle(2000, 5000)最多等待IDLE_WAIT_S秒
+IDLE_WAIT_S = 5
+_IDLE_ACTIONS = {"operate", "click", "doubleClick", "longClick", "swipe", "drag", "fling", "home", "back",
+                 "keyEvent", "setRotation", "getRotation", "gesture"}
+
+
+class StepRef(object):
+    """
+    reference to the result of an earlier batch step, resolved on the device when the step runs
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def __repr__(self):
+        return f"<StepRef(index={self.index})>"
+
+    def __getitem__(self, field):
+        """
+        :param field: path in the step result, keys and list indexes separated by '.', e.g. 'data.0.euid'
+        """
+        return {"$ref": self.index, "field": str(field)}
+
+    @property
+    def euid(self):
+        return self["euid"]
+
+    def element(self, index):
+        """
+        euid of the index-th element found by a find_elements step
+        """
+        return self[f"data.{index}.euid"]
+
+
+def _euid(element):
+    if isinstance(element, StepRef):
+        return element.euid
+    if isinstance(element, Element):
+        return element.euid
+    return element
+
+
+class Batch(object):
+    """
+    收集一组操作，一次请求发送到设备端按顺序执行，后面的步骤可以引用前面步骤的结果
+    示例:
+    with hdriver.batch() as batch:
+        user = batch.find_element_by_id("user_name", timeout_s=5)
+        batch.input_text(user, "test")
+        pwd = batch.find_element_by_id("password")
+        batch.input_text(pwd, "123456")
+        batch.click_element(batch.find_element_by_text("登录"))
+    results = batch.results
+    """
+
+    def __init__(self, driver=None, stop_on_error=True):
+        """
+        :param driver: 执行批量操作的HMDriver，为None时只能用to_message构造请求
+        :param stop_on_error: 某一步失败时是否停止执行后面的步骤
+        """
+        self.driver = driver
+        self.stop_on_error = stop_on_error
+        self.steps = []
+        self.results = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None and self.steps and self.results is None:
+            self.run()
+
+    def __len__(self):
+        return len(self.steps)
+
+    def add(self, msg_data: dict) -> StepRef:
+        """
+        添加一个步骤，msg_data与单独请求时的格式相同，参数值可以是StepRef引用
+        :return: 该步骤结果的引用
+        """
+        if msg_data.get("action") == "batch":
+            raise HDriverError("batch can not be nested")
+        self.steps.append(dict(msg_data))
+        return StepRef(len(self.steps) - 1)
+
+    def to_message(self) -> dict:
+        # 客户端按所有步骤的等待时间之和计算超时，改变界面的步骤加上设备端等待界面空闲的时间
+        timeout_s = sum(float(step.get("timeout_s", 0)) + float(step.get("time_s", 0)) +
+                        (IDLE_WAIT_S if step.get("action") in _IDLE_ACTIONS else 0) for step in self.steps)
+        return {"action": "batch", "steps": self.steps, "stop_on_error": self.stop_on_error, "timeout_s": timeout_s}
+
+    def run(self):
+        """
+        发送到设备端执行
+        :return: 每个步骤的结果列表，查找控件的步骤为Element，失败的步骤为异常对象，未执行的步骤为None
+        """
+        self.results = self.driver.run_batch(self)
+        return self.results
+
+    def find_element(self, by: str, data, params=None, timeout_s: int = 0, fields=None) -> StepRef:
+        msg_data = {"action": "find", "by": by, "data": data, "timeout_s": timeout_s, "params": params}
+        if fields:
+            msg_data["fields"] = list(fields)
+        if by == ElementBy.selector:
+            msg_data["query"] = compile_selector(data).query
+        return self.add(msg_data)
+
+    def find_element_by_id(self, id: str, params=None, timeout_s: int = 0, fields=None) -> StepRef:
+        return self.find_element(ElementBy.id, id, params, timeout_s, fields)
+
+    def find_element_by_text(self, text: str, params=None, timeout_s: int = 0, fields=None) -> StepRef:
+        return self.find_element(ElementBy.text, text, params, timeout_s, fields)
+
+    def find_element_by_type(self, type: str, params=None, timeout_s: int = 0, fields=None) -> StepRef:
+        return self.find_element(ElementBy.type, type, params, timeout_s, fields)
+
+    def find_element_by_description(self, description: str, params=None, timeout_s: int = 0,
+                                    fields=None) -> StepRef:
+        return self.find_element(ElementBy.description, description, params, timeout_s, fields)
+
+    def find_element_by_selector(self, selector: str, timeout_s: int = 0, fields=None) -> StepRef:
+        return self.find_element(ElementBy.selector, selector, None, timeout_s, fields)
+
+    def find_elements(self, by: str, data, params=None, timeout_s: int = 0, fields=None) -> StepRef:
+        msg_data = {"action": "finds", "by": by, "data": data, "timeout_s": timeout_s, "params": params}
+        if fields:
+            msg_data["fields"] = list(fields)
+        if by == ElementBy.selector:
+            msg_data["query"] = compile_selector(data).query
+        return self.add(msg_data)
+
+    def operate(self, element, operate: str, param: dict = None) -> StepRef:
+        """
+        :param element: StepRef、Element或euid
+        """
+        return self.add({"action": "operate", "operate": operate, "euid": _euid(element), **(param or {})})
+
+    def click_element(self, element) -> StepRef:
+        return self.operate(element, ElementOperate.click)
+
+    def double_click_element(self, element) -> StepRef:
+        return self.operate(element, ElementOperate.doubleClick)
+
+    def long_click_element(self, element) -> StepRef:
+        return self.operate(element, ElementOperate.longClick)
+
+    def input_text(self, element, text: str) -> StepRef:
+        return self.operate(element, ElementOperate.input, {"text": text})
+
+    def clear_text(self, element) -> StepRef:
+        return self.operate(element, ElementOperate.clear)
+
+    def get_property(self, element, property: str) -> StepRef:
+        return self.add({"action": "get", "property": property, "euid": _euid(element)})
+
+    def click(self, x, y) -> StepRef:
+        return self.add({"action": "click", "x": x, "y": y})
+
+    def double_click(self, x, y) -> StepRef:
+        return self.add({"action": "doubleClick", "x": x, "y": y})
+
+    def long_click(self, x, y) -> StepRef:
+        return self.add({"action": "longClick", "x": x, "y": y})
+
+    def _swipe(self, action, startx, starty, endx, endy, time_s):
+        # 滑动速率与HMDriver.swipe相同，范围：200-40000，不在范围内设为600
+        speed = int(max(abs(startx - endx), abs(starty - endy)) / time_s)
+        speed = 600 if speed < 200 else (600 if speed > 40000 else speed)
+        return self.add({"action": action, "startx": int(startx), "starty": int(starty), "endx": int(endx),
+                         "endy": int(endy), "speed": speed, "time_s": time_s})
+
+    def swipe(self, startx, starty, endx, endy, time_s=1) -> StepRef:
+        return self._swipe("swipe", startx, starty, endx, endy, time_s)
+
+    def drag(self, startx, starty, endx, endy, time_s=1) -> StepRef:
+        return self._swipe("drag", startx, starty, endx, endy, time_s)
+
+    def gesture(self, gesture) -> StepRef:
+        """
+        :param gesture: Gesture对象，见HMDriver.gesture
+        """
+        return self.add(gesture.to_message())
+
+    def home(self) -> StepRef:
+        return self.add({"action": "home"})
+
+    def back(self) -> StepRef:
+        return self.add({"action": "back"})
+
+    def press_key(self, key_code: int, key2: int = 0, key3: int = 0) -> StepRef:
+        return self.add({"action": "keyEvent", "key": key_code, "key1": key2, "key2": key3})
+
+    def sleep(self, time_s: float) -> StepRef:
+        """
+        在设备端等待time_s秒
+        """
+        return self.add({"action": "sleep", "time_s": time_s})
@@ -2,17 +2,26 @@
 import json
 import logging
 import os
+import random
 import socket
 import struct
+import threading
 import time
 import uuid
+import weakref
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 
 from HMDriverClient.hdcstd import HDC
 from HMDriverClient.exception import *
+from HMDriverClient.dispatcher import Dispatcher
+from HMDriverClient.events import EventBus
+from HMDriverClient.metrics import LatencyHistogram
+from HMDriverClient.protocol import ENCODINGS, UPGRADE_HINT, FrameReader, decode_reply, hello_frame, read_hello
+from HMDriverClient.tracing import RequestTrace
 
 
 def json_to_dict(data):
-    # 递归转dict
+    # 递归转dict，旧版本回复的解析方式，现在由protocol.decode_reply代替
     try:
         for key, value in data.items():
             try:
@@ -32,40 +41,152 @@ def json_to_dict(data):
     return data
 
 
-class Client(object):
+# 进程内所有客户端共享的已分配本地端口，避免多台设备转发到同一个端口，客户端关闭时释放
+_used_ports = set()
+_used_ports_lock = threading.Lock()
+# 自动分配的本地端口范围，低于各系统的临时端口范围，不会被出站连接占用
+LOCAL_PORT_RANGE = (20000, 32000)
+
+
+def port_is_free(port) -> bool:
+    """
+    probe a local port with bind(), a port forwarded by hdc for another process fails here
+    """
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        probe.bind(("127.0.0.1", port))
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+def allocate_port(port_range=LOCAL_PORT_RANGE, attempts=200) -> int:
+    """
+    reserve a random free local port for this process, release it with release_port
+    :raise HDriverError: no free port found
+    """
+    for _ in range(attempts):
+        port = random.randrange(*port_range)
+        with _used_ports_lock:
+            if port in _used_ports or not port_is_free(port):
+                continue
+            _used_ports.add(port)
+            return port
+    raise HDriverError(f"no free local port in {port_range}")
+
+
+def release_port(port):
+    with _used_ports_lock:
+        _used_ports.discard(port)
+
+
+def backoff_delays(initial_ms=20, max_ms=1000):
+    """
+    exponential backoff with jitter
+    :return: generator of delays in seconds, doubling from initial_ms up to max_ms
+    """
+    delay_ms = initial_ms
+    while True:
+        yield delay_ms * random.uniform(0.5, 1.0) / 1000
+        delay_ms = min(delay_ms * 2, max_ms)
+
+
+def weak_callback(method):
+    """
+    wrap a bound method without keeping its object alive, calls after the object is gone are ignored.
+    background threads hold callbacks this way so Client.__del__ can still run
+    """
+    ref = weakref.WeakMethod(method)
+
+    def callback(*args):
+        target = ref()
+        if target is not None:
+            return target(*args)
+
+    return callback
+
+
+def _heartbeat_loop(client_ref, stop, interval_s):
+    # 只在每次心跳时临时持有client，client被回收后线程退出
+    while not stop.wait(interval_s):
+        client = client_ref()
+        if client is None:
+            return
+        try:
+            client.ping()
+            client.heartbeat_failures = 0
+        except Exception as e:
+            client.heartbeat_failures += 1
+            logging.debug(f"heartbeat failed: {e}")
+        del client
+
+
+# 会改变界面的请求，发送后本地缓存的控件定位结果失效，设备端在点击、滑动、返回等操作后也会清空控件句柄
+UI_CHANGING_ACTIONS = {"click", "doubleClick", "longClick", "swipe", "drag", "fling", "home", "back", "keyEvent",
+                       "setRotation", "app", "batch", "gesture", "monkey"}
+UI_CHANGING_OPERATES = {"click", "doubleClick", "longClick", "input", "clear", "scrollToTop", "scrollToBottom",
+                        "dragTo", "pinchOut", "pinchIn", "scrollSearch"}
+
+# 会改变控件树的推送事件，toast和焦点变化不影响已定位的控件，不使定位缓存失效
+UI_CHANGING_EVENTS = {"windowChange", "dialogShow"}
+
+
+def changes_ui(msg_data) -> bool:
+    action = msg_data.get("action")
+    if action == "operate":
+        return msg_data.get("operate") in UI_CHANGING_OPERATES
+    if action == "window":
+        return msg_data.get("operate") == "action"
+    return action in UI_CHANGING_ACTIONS
+
+
+def parse_reply(re_dict):
+    """
+    convert a raw reply into the result dict, raising the matching error for 'ret': 'error'
+    """
+    re_dict = decode_reply(re_dict)
+    logging.debug("re_dict: %s", re_dict)
+    del re_dict["uuid"]
+    if re_dict.get("ret") == "error":
+        error_desc = re_dict.get("description", "")
+        if error_desc.startswith("no ele"):
+            raise ElementNotFoundError(error_desc)
+        else:
+            raise HDriverError(error_desc)
+    return re_dict
+
+
+class TestRunner(object):
+    """
+    manage the on-device test runner and the port forwarding to its socket server
+    """
     test_app_file = "entry-ohosTest-signed.hap"
     test_app_bundle = "com.harmony.uitest"
-    socket_buffer_size = 1024
-    find_timeout_s = 20
 
-    def __init__(self, serial, local_port=29100):
+    def __init__(self, serial, local_port=None):
         self.serial = serial
         self.hdc = HDC(serial)
-        self.__used_ports = []
         self.server_port = 29100
-        self.local_port = local_port
-        self.start_test_runner()
-        self.socket = self.connect_socket()
-
-    def __del__(self):
-        self.stop_test_runner()
-
-    def __call__(self, *args, **kwargs):
-        return self.request(kwargs)
+        # 未指定时自动分配空闲端口，同一主机上的多台设备互不冲突
+        self._port_reserved = local_port is None
+        self.local_port = self.get_random_port() if local_port is None else local_port
 
     def get_random_port(self):
         """
         get a random port on host machine to establish connection
         :return: a port number
         """
-        temp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        temp_sock.bind(("", 0))
-        port = temp_sock.getsockname()[1]
-        temp_sock.close()
-        if port in self.__used_ports:
-            return self.get_random_port()
-        self.__used_ports.append(port)
-        return port
+        return allocate_port()
+
+    def release_port(self):
+        """
+        return an automatically allocated local port to the pool, after its forwarding was removed
+        """
+        if getattr(self, "_port_reserved", False):
+            self._port_reserved = False
+            release_port(self.local_port)
 
     def stop_test_runner(self):
         logging.info("stop test runner")
@@ -75,9 +196,19 @@ class Client(object):
         out = self.hdc.run_cmd(cmd)
         logging.info(out)
 
+    @property
+    def runner_key(self):
+        return f"ActsAbilityTest#uiTestProcess{self.server_port}"
+
+    def runner_alive(self):
+        """
+        check if the test runner process is running on the device
+        """
+        return self.hdc.get_pid(self.runner_key) != -1
+
     def start_test_runner(self):
 
-        key_word = f"ActsAbilityTest#uiTestProcess{self.server_port}"
+        key_word = self.runner_key
         pid = self.hdc.get_pid(key_word)
         if pid != -1:
             logging.info(f"{key_word} is running, pid is {pid}")
@@ -92,88 +223,319 @@ class Client(object):
               f"-s class ActsAbilityTest#uiTestProcess{self.server_port} -s timeout 86400000"
         self.hdc.shell(cmd, is_wait=False)
 
-    def connect_socket(self, timeout=30):
-        logging.info("start socket client init")
+    def forward_port(self):
+        # fport由本机的hdc server执行，不能走设备shell会话，每条命令都会启动一次hdc进程，
+        # fport ls只用于排查问题，DEBUG日志时才执行
+        out = self.hdc.run_cmd(f"fport tcp:{self.local_port} tcp:{self.server_port}")
+        logging.info(out)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(self.hdc.run_cmd("fport ls"))
+
+    def refresh_forward(self):
+        """
+        remove and re-create the port forwarding, the test runner keeps running
+        """
+        self.hdc.run_cmd(f"fport rm tcp:{self.local_port} tcp:{self.server_port}")
+        self.forward_port()
+
+
+class Client(TestRunner):
+    socket_buffer_size = 65536
+    find_timeout_s = 20
+    hello_timeout_s = 5
+    # hello握手时提供的消息编码，按优先级排列，设为["json"]可关闭msgpack
+    encodings = ENCODINGS
+    # 重连时前两级（重新连接、重建端口转发）各自的最长尝试时间
+    redial_timeout_s = 2
+    heartbeat_timeout_s = 2
+    # 待释放的句柄达到该数量时，随下一个请求一起发送release
+    release_batch_size = 64
+
+    def __init__(self, serial, local_port=None):
+        self.closed = False
+        super(Client, self).__init__(serial, local_port)
+        self.reader = None
+        self.dispatcher = None
+        self._reconnect_lock = threading.Lock()
+        # __del__可能在持有锁时由gc触发，使用可重入锁
+        self._release_lock = threading.RLock()
+        self._release_euids = []
+        self._release_wuids = []
+        # 请求追踪，为None时不记录，可设置为tracing.Tracer或任何有record(trace)方法的对象
+        self.tracer = None
+        self.rtt = LatencyHistogram()
+        self.last_seen = None
+        self.heartbeat_failures = 0
+        # 界面变化计数，每次发送会改变界面的请求或调用ui_changed时加1
+        self.ui_generation = 0
+        # 设备端推送的事件，subscribe_events之后才会推送，重连后自动重新订阅
+        self.events = EventBus()
+        self.event_types = None
+        self.event_interval_ms = 100
+        self._heartbeat_stop = threading.Event()
+        self._heartbeat_thread = None
+        self.socket = None
+        self.last_dial_error = None
+        self.start_test_runner()
+        self.connect_socket()
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """
+        stop the heartbeat, close the connection and stop the test runner, safe to call more than once
+        """
+        if getattr(self, "closed", True):
+            return
+        self.closed = True
+        self.stop_heartbeat()
+        if self.dispatcher:
+            self._send_releases(self.dispatcher)
+            self.dispatcher.close()
+        try:
+            self.stop_test_runner()
+        finally:
+            self.release_port()
+
+    def __call__(self, *args, **kwargs):
+        return self.request(kwargs)
+
+    def _dial(self):
+        """
+        open a socket to the forwarded port and complete the hello handshake
+        :return: (socket, FrameReader, negotiated encoding)
+        """
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            l_onoff = 1
+            l_linger = 0
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', l_onoff, l_linger))
+            s.settimeout(self.hello_timeout_s)
+            s.connect(("127.0.0.1", self.local_port))
+            s.sendall(hello_frame(self.encodings))
+            reader = FrameReader(s, self.socket_buffer_size)
+            encoding = read_hello(reader)
+        except BaseException:
+            s.close()
+            raise
+        logging.info(f"socket client init ok, encoding: {encoding}")
+        return s, reader, encoding
+
+    def _try_dial(self, timeout):
+        """
+        dial with exponential backoff until connected or timeout
+        :return: True if connected
+        """
         st = time.time()
-        while time.time() - st < timeout:
+        for delay in backoff_delays():
             try:
-                cmd_list = [f"fport tcp:{self.local_port} tcp:{self.server_port}", "fport ls"]
-                for cmd in cmd_list:
-                    out = self.hdc.run_cmd(cmd)
-                    logging.info(out)
-
-                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                l_onoff = 1
-                l_linger = 0
-                s.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', l_onoff, l_linger))
-                s.connect(("127.0.0.1", self.local_port))
-                s.send(b"hello")
-                hello_msg = s.recv(self.socket_buffer_size)
-                logging.info(f"socket client init ok. got hello message: {hello_msg}")
-                return s
+                s, reader, encoding = self._dial()
+            except ProtocolVersionError:
+                raise
             except Exception as e:
-                logging.exception(e)
-                time.sleep(1)
-        raise Exception(f"socket client init timeout after {timeout} seconds!")
+                logging.debug(f"dial failed: {e}")
+                self.last_dial_error = e
+                if isinstance(e, ConnectionRefusedError):
+                    # 本地没有监听，端口转发已经不存在
+                    self.forward_port()
+                if time.time() - st + delay > timeout:
+                    return False
+                time.sleep(delay)
+                continue
+            self.socket = s
+            self.reader = reader
+            self.dispatcher = Dispatcher(s, reader, encoding, weak_callback(self._on_event))
+            if self.event_types is not None:
+                # 订阅属于连接，新连接上重新订阅，不等待回复
+                self.submit(self._subscribe_message())
+            return True
+
+    def connect_socket(self, timeout=30):
+        logging.info("start socket client init")
+        self.forward_port()
+        if not self._try_dial(timeout):
+            if isinstance(self.last_dial_error, socket.timeout):
+                # 连接已建立但hello一直没有回复，设备端的runner不认识帧格式的hello
+                raise ProtocolVersionError(f"no hello reply within {self.hello_timeout_s} seconds, {UPGRADE_HINT}")
+            raise Exception(f"socket client init timeout after {timeout} seconds!")
+        return self.socket
 
     def reconnect_socket(self):
-        self.stop_test_runner()
-        self.start_test_runner()
-        self.socket = self.connect_socket()
+        """
+        recover the connection in tiers: redial, then re-create the port forwarding,
+        and restart the test runner only when it no longer answers the hello handshake.
+        the first two tiers keep every element handle on the device valid
+        """
+        with self._reconnect_lock:
+            # 其他线程已经重连成功
+            if self.dispatcher and not self.dispatcher.closed:
+                return
+            st = time.time()
+            if self._try_dial(self.redial_timeout_s):
+                logging.info(f"reconnected by redial after {time.time() - st:.3f}s")
+                return
+            self.refresh_forward()
+            if self._try_dial(self.redial_timeout_s):
+                logging.info(f"reconnected by re-forwarding after {time.time() - st:.3f}s")
+                return
+            # runner进程还在时再给一次握手机会，仍然失败说明runner已无响应
+            if self.runner_alive() and self._try_dial(self.hello_timeout_s):
+                logging.info(f"reconnected to the running test runner after {time.time() - st:.3f}s")
+                return
+            logging.warning("test runner is not responding, restart it, element handles are lost")
+            # 重启后旧句柄都已失效，不再发送释放请求
+            self._take_releases()
+            self.stop_test_runner()
+            self.start_test_runner()
+            self.ui_changed()
+            self.connect_socket()
+
+    def ui_changed(self):
+        """
+        signal that the UI may have changed, invalidating cached locator results
+        """
+        self.ui_generation += 1
+
+    def _on_event(self, msg):
+        # 窗口切换和弹窗同时使定位缓存失效
+        if msg.get("event") in UI_CHANGING_EVENTS:
+            self.ui_changed()
+        self.events.publish(msg)
 
-    def socket_send(self, msg_dict: dict):
+    def _subscribe_message(self):
+        return {"action": "subscribe", "events": list(self.event_types), "interval_ms": self.event_interval_ms}
+
+    def subscribe_events(self, types, interval_ms=100):
+        """
+        ask the device to push UI change events on this connection
+        :param types: event types (events.UiEventType)
+        :param interval_ms: how often the device checks the focused window's bundle and bounds,
+            its title, mode and the focused component are read on a change or about once a second
+        :return: the subscribed types
+        """
+        self.event_types = list(types)
+        self.event_interval_ms = interval_ms
+        return self.request(self._subscribe_message())["data"]
+
+    def unsubscribe_events(self):
+        self.event_types = None
+        self.request({"action": "unsubscribe"})
+
+    def socket_send(self, msg_dict: dict, trace=None) -> Future:
         for retry in range(3):
             try:
-                self.socket.send(json.dumps(msg_dict).encode("utf8"))
-                break
-            except Exception as e:
+                return self.dispatcher.submit(msg_dict, trace)
+            except SocketError as e:
                 logging.exception(e)
                 self.reconnect_socket()
+        raise SocketError("socket send failed after 3 retries")
+
+    def _total_timeout(self, msg_data):
+        time_s = float(msg_data.get("time_s", 0))
+        timeout_s = float(msg_data.get("timeout_s", 0))
+        return self.find_timeout_s + timeout_s + time_s
+
+    def release_later(self, euid=None, wuid=None):
+        """
+        queue an element or window handle to be released on the device,
+        queued handles are sent in one release message once release_batch_size is reached
+        """
+        # 关闭之后runner已停止，句柄随之失效，不再排队
+        if self.closed:
+            return
+        with self._release_lock:
+            if euid:
+                self._release_euids.append(euid)
+            if wuid:
+                self._release_wuids.append(wuid)
+
+    def _take_releases(self):
+        with self._release_lock:
+            euids, self._release_euids = self._release_euids, []
+            wuids, self._release_wuids = self._release_wuids, []
+        return euids, wuids
+
+    def flush_releases(self):
+        """
+        send all queued handle releases without waiting for the reply
+        """
+        euids, wuids = self._take_releases()
+        if euids or wuids:
+            self.submit({"action": "release", "euids": euids, "wuids": wuids})
+
+    def _send_releases(self, dispatcher):
+        """
+        best-effort flush on an open dispatcher while closing, never reconnects
+        """
+        euids, wuids = self._take_releases()
+        if (euids or wuids) and not dispatcher.closed:
+            try:
+                dispatcher.submit({"action": "release", "euids": euids, "wuids": wuids,
+                                   "uuid": str(uuid.uuid1()).replace("-", "")})
+            except SocketError:
+                pass
+
+    def submit(self, msg_data) -> Future:
+        """
+        send a request without waiting for its reply, many requests can be in flight at once
+        :param msg_data: message dict, not modified
+        :return: future, result() returns the same as request() or raises its errors
+        """
+        if len(self._release_euids) + len(self._release_wuids) >= self.release_batch_size:
+            self.flush_releases()
+        if changes_ui(msg_data):
+            self.ui_changed()
+        tracer = self.tracer
+        trace = RequestTrace(msg_data.get("action", "")) if tracer is not None else None
+        data_dict = dict(msg_data)
+        data_dict["uuid"] = str(uuid.uuid1()).replace("-", "")
+        logging.debug("data_dict: %s", data_dict)
+        reply = Future()
+        # 回调登记在dispatcher的等待表里，不持有client，请求未完成时client也可以被回收
+        client_ref = weakref.ref(self)
+
+        def on_reply(raw):
+            client = client_ref()
+            if raw.exception() is None and client is not None:
+                client.last_seen = time.time()
+            try:
+                reply.set_result(parse_reply(raw.result()))
+            except Exception as e:
+                if trace is not None:
+                    trace.error = str(e)
+                reply.set_exception(e)
+            if trace is not None:
+                trace.t_done = time.perf_counter()
+                tracer.record(trace)
+
+        if trace is not None:
+            trace.uuid = data_dict["uuid"]
+        self.socket_send(data_dict, trace).add_done_callback(on_reply)
+        reply.uuid = data_dict["uuid"]
+        return reply
+
+    def wait(self, future: Future, msg_data):
+        """
+        wait for the reply of a submitted request
+        :param future: returned by submit
+        :param msg_data: the submitted message, used to compute the timeout
+        :return: reply dict
+        """
+        total_s = self._total_timeout(msg_data)
+        try:
+            return future.result(total_s)
+        except FutureTimeoutError:
+            self.dispatcher.cancel(future.uuid)
+            raise ElementFoundTimeout(f"wait for {total_s} seconds")
 
     def request(self, msg_data):
         start_time = time.time()
-        logging.info(f"#### start request")
+        logging.debug("#### start request")
         re_dict = None
         for rr in range(2):
-            tmp_uuid = str(uuid.uuid1()).replace("-", "")
             try:
-                data_dict = msg_data
-                data_dict["uuid"] = tmp_uuid
-                logging.info(f"data_dict: {data_dict}")
-                self.socket_send(data_dict)
-                st = time.time()
-                time_s = float(msg_data.get("time_s", 0))
-                timeout_s = float(msg_data.get("timeout_s", 0))
-                total_s = self.find_timeout_s + timeout_s + time_s
-                while time.time() - st < total_s:
-                    try:
-                        re_bytes = self.socket.recv(self.socket_buffer_size)
-                        logging.info(f"recv: {re_bytes}")
-                    except Exception as e:
-                        if e.__str__() == 'Resource temporarily unavailable':
-                            time.sleep(0.1)
-                        else:
-                            logging.exception(e)
-                            raise SocketError()
-                    else:
-                        re_str = re_bytes.decode("utf8")
-                        if len(re_str) > 0:
-                            re_dict = json.loads(re_str)
-                            re_dict = json_to_dict(re_dict)
-                            if tmp_uuid == re_dict.get("uuid", ""):
-                                break
-                else:
-                    err_desc = f"wait for {total_s} seconds"
-                    raise ElementFoundTimeout(err_desc)
-
-                logging.info(f"re_dict: {re_dict}")
-                del re_dict["uuid"]
-                if re_dict.get("ret") == "error":
-                    error_desc = re_dict.get("description", "")
-                    if error_desc.startswith("no ele"):
-                        raise ElementNotFoundError(error_desc)
-                    else:
-                        raise HDriverError(error_desc)
+                re_dict = self.wait(self.submit(msg_data), msg_data)
             except SocketError as se:
                 logging.exception(se)
                 self.reconnect_socket()
@@ -187,11 +549,56 @@ class Client(object):
                 raise he
             except Exception as e:
                 logging.exception(e)
-            else:
-                pass
-            finally:
-                pass
             break
-        used_time = time.time() - start_time
-        logging.info(f"#### end request,after {used_time}s")
+        logging.debug("#### end request,after %ss", time.time() - start_time)
         return re_dict
+
+    def ping(self, timeout=None):
+        """
+        round trip a ping answered by the socket server without touching UiTest
+        :return: rtt in seconds, recorded into self.rtt
+        """
+        timeout = self.heartbeat_timeout_s if timeout is None else timeout
+        st = time.perf_counter()
+        future = self.submit({"action": "ping"})
+        try:
+            future.result(timeout)
+        except FutureTimeoutError:
+            self.dispatcher.cancel(future.uuid)
+            raise ElementFoundTimeout(f"ping timeout after {timeout} seconds")
+        rtt = time.perf_counter() - st
+        self.rtt.record(rtt)
+        return rtt
+
+    def start_heartbeat(self, interval_s=1.0):
+        """
+        ping in a background thread every interval_s seconds
+        """
+        if self._heartbeat_thread is not None:
+            return
+        self._heartbeat_stop.clear()
+        self._heartbeat_thread = threading.Thread(target=_heartbeat_loop,
+                                                  args=(weakref.ref(self), self._heartbeat_stop, interval_s),
+                                                  name=f"hdriver-heartbeat-{self.serial}", daemon=True)
+        self._heartbeat_thread.start()
+
+    def stop_heartbeat(self):
+        self._heartbeat_stop.set()
+        thread, self._heartbeat_thread = self._heartbeat_thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def request_many(self, msg_list):
+        """
+        send all requests before waiting for any reply, replies are matched by uuid
+        :param msg_list: list of message dicts
+        :return: list of reply dicts in the same order, an exception object in place of a failed reply
+        """
+        futures = [self.submit(msg_data) for msg_data in msg_list]
+        results = []
+        for future, msg_data in zip(futures, msg_list):
+            try:
+                results.append(self.wait(future, msg_data))
+            except Exception as e:
+                results.append(e)
+        return results
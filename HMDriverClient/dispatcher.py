@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+from HMDriverClient.exception import *
+from HMDriverClient.protocol import CODECS, pack_frame
+
+
+class Dispatcher(object):
+    """
+    owns a connected socket. requests from any thread are written under a send lock,
+    and a reader thread routes every reply to the future waiting on its uuid,
+    so many requests can be in flight on one connection.
+    frames without uuid that carry an 'event' key are pushed events and go to on_event.
+    """
+
+    def __init__(self, sock, reader, encoding="json", on_event=None):
+        self.sock = sock
+        self.reader = reader
+        self.encoding = encoding
+        self._dumps, self._loads = CODECS[encoding]
+        self.on_event = on_event
+        self.closed = False
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self.sock.settimeout(None)
+        self._thread = threading.Thread(target=self._read_loop, name="hdriver-dispatcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, msg_dict: dict, trace=None) -> Future:
+        """
+        send a message without waiting for the reply
+        :param msg_dict: message including 'uuid'
+        :param trace: optional RequestTrace, its send and receive timestamps are filled in
+        :return: future resolved with the decoded reply dict
+        """
+        future = Future()
+        future.trace = trace
+        msg_uuid = msg_dict["uuid"]
+        payload = pack_frame(self._dumps(msg_dict))
+        if trace is not None:
+            trace.t_serialized = time.perf_counter()
+        with self._lock:
+            if self.closed:
+                raise SocketError("dispatcher is closed")
+            self._pending[msg_uuid] = future
+        try:
+            with self._send_lock:
+                self.sock.sendall(payload)
+            if trace is not None:
+                t_sent = time.perf_counter()
+                # 回复可能在记录发送时间之前就已被读线程处理，此时保留读线程记录的时间
+                with self._lock:
+                    if trace.t_sent is None:
+                        trace.t_sent = t_sent
+        except OSError as e:
+            self._pending.pop(msg_uuid, None)
+            self.close()
+            raise SocketError(f"send failed: {e}")
+        return future
+
+    def cancel(self, msg_uuid: str):
+        """
+        forget a request whose caller stopped waiting, its reply is dropped when it arrives
+        """
+        self._pending.pop(msg_uuid, None)
+
+    @property
+    def pending_count(self):
+        return len(self._pending)
+
+    def _read_loop(self):
+        try:
+            while True:
+                frame = self.reader.read_frame()
+                t_received = time.perf_counter()
+                re_dict = self._loads(frame)
+                if "event" in re_dict and "uuid" not in re_dict:
+                    if self.on_event is not None:
+                        self.on_event(re_dict)
+                    continue
+                with self._lock:
+                    future = self._pending.pop(re_dict.get("uuid", ""), None)
+                    if future is not None and future.trace is not None:
+                        self._stamp_reply(future.trace, t_received)
+                if future is None:
+                    logging.warning(f"drop reply without waiter: {re_dict.get('uuid', '')}")
+                    continue
+                if not future.done():
+                    future.set_result(re_dict)
+        except Exception as e:
+            if not self.closed:
+                logging.exception(e)
+        self.close()
+
+    def _stamp_reply(self, trace, t_received):
+        """
+        fill the receive timestamps of a trace, called with self._lock held so t_sent is either recorded already
+        or never overwritten by the sender
+        """
+        t_handoff = time.perf_counter()
+        frame_start = self.reader.frame_start
+        if trace.t_sent is None:
+            # 发送线程还没来得及记录发送时间，回复已经到达
+            trace.t_sent = min(frame_start, t_handoff)
+        if frame_start < trace.t_sent:
+            # 帧在记录发送时间之前就已读入缓冲区，等待阶段以交给读线程的时间结束
+            frame_start = t_handoff
+        trace.t_first_byte = frame_start
+        trace.t_received = max(t_received, frame_start)
+        trace.t_decoded = max(t_handoff, trace.t_received)
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            pending, self._pending = self._pending, {}
+        try:
+            self.sock.shutdown(2)
+        except OSError:
+            pass
+        self.sock.close()
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(SocketError("connection lost"))
@@ -25,6 +25,8 @@ class ElementBy:
     checkable = "checkable"
     isBefore = "isBefore"
     isAfter = "isAfter"
+    # 选择器语法，见selector.py
+    selector = "selector"
 
 
 class ElementAttribute:
@@ -85,11 +87,37 @@ class Element(object):
         self._client = client
         self.euid = euid
         self._property = property
+        self._released = False
+
+    def __del__(self):
+        self.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def release(self):
+        """
+        释放设备端的控件句柄，释放请求会批量发送，释放后不能再操作该控件
+        示例:
+        with hdriver.find_element_by_id("btn_sign") as ele:
+            ele.click()
+        """
+        # __init__未完成或解释器退出时__del__也会调用，属性可能不存在
+        if getattr(self, "_released", True):
+            return
+        self._released = True
+        try:
+            self._client.release_later(euid=self.euid)
+        except Exception:
+            pass
 
     def __repr__(self):
-        return f'<Element(euid={self.euid}, id={self._property["id"]}, ' \
-               f'text={self._property["text"]}, type={self._property["type"]}, ' \
-               f'bounds={self._property["bounds"]}, bounds_center={self._property["boundsCenter"]})>'
+        return f'<Element(euid={self.euid}, id={self._property.get("id")}, ' \
+               f'text={self._property.get("text")}, type={self._property.get("type")}, ' \
+               f'bounds={self._property.get("bounds")}, bounds_center={self._property.get("boundsCenter")})>'
 
     def __get(self, attribute):
         self._property = self.properties
@@ -104,6 +132,26 @@ class Element(object):
             self._property = self._client.request({"action": "get", "property": 'info', "euid": self.euid})["data"]
         return self._property
 
+    def get_properties(self, fields=None):
+        """
+        从设备获取控件属性，只执行fields中属性对应的getter
+        :param fields: 属性列表(ElementAttribute)，为None时获取全部属性
+        :return: 属性字典
+        """
+        data = {"action": "get", "property": 'info', "euid": self.euid}
+        if fields:
+            data["fields"] = list(fields)
+        return self.update_properties(self._client.request(data)["data"])
+
+    def update_properties(self, property: dict):
+        """
+        合并新获取的属性到缓存中
+        """
+        if self._property is None:
+            self._property = {}
+        self._property.update(property)
+        return property
+
     @property
     def id(self):
         return self.__get(ElementAttribute.id)
@@ -210,6 +258,10 @@ class Element(object):
                 "euid": self.euid,
                 "param": {"by": by, "data": data}
             }
+            if by == ElementBy.selector:
+                # selector依赖element，在这里导入避免循环导入
+                from HMDriverClient.selector import compile_selector
+                data["param"]["query"] = compile_selector(data["param"]["data"]).query
             resp = self._client.request(data)
             return Element(self._client, resp["euid"], resp["property"])
         except Exception as e:
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+from collections import deque
+
+
+class UiEventType:
+    # 焦点窗口切换到另一个应用或窗口，或焦点窗口的标题、模式、位置变化，data为current、previous窗口状态
+    # 应用和位置的变化在下一次轮询时推送，只有标题、模式变化时最多延迟约1秒
+    windowChange = "windowChange"
+    # 焦点窗口内获得焦点的控件变化，data为current、previous控件的id、text、type、bounds，最多延迟约1秒
+    focusChange = "focusChange"
+    # 控件变化，UiTest的UIEventObserver上报的toast和弹窗
+    toastShow = "toastShow"
+    dialogShow = "dialogShow"
+
+    all = (windowChange, focusChange, toastShow, dialogShow)
+
+
+class UiEvent(object):
+    """
+    an event pushed by the device without a request
+    """
+    __slots__ = ("seq", "type", "timestamp", "received", "data")
+
+    def __init__(self, seq, type, timestamp, data):
+        self.seq = seq
+        self.type = type
+        # 设备端时间戳，毫秒
+        self.timestamp = timestamp
+        self.received = time.time()
+        self.data = data
+
+    def __repr__(self):
+        return f"<UiEvent(seq={self.seq}, type={self.type}, data={self.data})>"
+
+    def get(self, key, default=None):
+        return self.data.get(key, default) if isinstance(self.data, dict) else default
+
+
+class EventBus(object):
+    """
+    receives pushed events on the dispatcher thread, keeps the latest ones,
+    calls subscribed callbacks and wakes up waiters
+    """
+
+    def __init__(self, capacity=256):
+        self.history = deque(maxlen=capacity)
+        self.seq = 0
+        self._cond = threading.Condition()
+        self._handlers = {}
+        self._next_token = 0
+
+    def subscribe(self, callback, types=None):
+        """
+        :param callback: called with the UiEvent on the dispatcher thread, keep it short
+        :param types: event types to receive, None for all
+        :return: token for unsubscribe
+        """
+        with self._cond:
+            self._next_token += 1
+            self._handlers[self._next_token] = (callback, set(types) if types else None)
+            return self._next_token
+
+    def unsubscribe(self, token):
+        with self._cond:
+            self._handlers.pop(token, None)
+
+    def publish(self, msg: dict):
+        """
+        :param msg: decoded event frame {"event": type, "timestamp": ms, "data": {...}}
+        """
+        with self._cond:
+            self.seq += 1
+            event = UiEvent(self.seq, msg.get("event"), msg.get("timestamp"), msg.get("data"))
+            self.history.append(event)
+            handlers = list(self._handlers.values())
+            self._cond.notify_all()
+        for callback, types in handlers:
+            if types is None or event.type in types:
+                try:
+                    callback(event)
+                except Exception as e:
+                    logging.exception(e)
+        return event
+
+    def _match(self, after_seq, types, predicate):
+        for event in self.history:
+            if event.seq > after_seq and (types is None or event.type in types) \
+                    and (predicate is None or predicate(event)):
+                return event
+        return None
+
+    def wait_for(self, types=None, predicate=None, timeout=10.0, since=None):
+        """
+        :param types: event types to wait for, None for any
+        :param predicate: optional filter called with the UiEvent
+        :param since: only events with seq greater than this, defaults to the current seq.
+            read bus.seq before triggering an action so an event arriving before the wait is not missed
+        :return: the first matching UiEvent, None on timeout
+        """
+        types = set(types) if types else None
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            after_seq = self.seq if since is None else since
+            while True:
+                event = self._match(after_seq, types, predicate)
+                if event is not None:
+                    return event
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
@@ -18,3 +18,11 @@ class SocketError(Exception):
 
 class HDCException(Exception):
     pass
+
+
+class SelectorSyntaxError(HDriverError):
+    pass
+
+
+class ProtocolVersionError(HDriverError):
+    pass
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+import math
+
+from HMDriverClient.exception import *
+
+# PointerMatrix的限制：手指数1-10，每根手指的步数1-1000
+MAX_FINGERS = 10
+MAX_STEPS = 1000
+
+
+def path_length(points) -> float:
+    return sum(math.hypot(x1 - x0, y1 - y0) for (x0, y0), (x1, y1) in zip(points, points[1:]))
+
+
+def resample(points, steps):
+    """
+    把折线按长度均匀取steps个点，首尾点保留
+    """
+    points = [(float(x), float(y)) for x, y in points]
+    if steps <= 1 or len(points) == 1:
+        return points[:1] * max(steps, 1)
+    total = path_length(points)
+    if total == 0:
+        return points[:1] * steps
+    result = []
+    index, walked = 0, 0.0
+    for step in range(steps):
+        target = total * step / (steps - 1)
+        while index < len(points) - 2 and walked + math.hypot(points[index + 1][0] - points[index][0],
+                                                              points[index + 1][1] - points[index][1]) < target:
+            walked += math.hypot(points[index + 1][0] - points[index][0], points[index + 1][1] - points[index][1])
+            index += 1
+        (x0, y0), (x1, y1) = points[index], points[index + 1]
+        segment = math.hypot(x1 - x0, y1 - y0)
+        ratio = min(max((target - walked) / segment, 0.0), 1.0) if segment else 0.0
+        result.append((x0 + (x1 - x0) * ratio, y0 + (y1 - y0) * ratio))
+    return result
+
+
+class Gesture(object):
+    """
+    手势编译器：多指、多段路径编译为一次请求，设备端每段用一个PointerMatrix注入，段之间的等待也在设备端完成
+    示例:
+    # 曲线滑动、双指缩放、快速连续点击，只有一次往返
+    hdriver.gesture() \\
+        .curve((200, 1500), (900, 1000), (300, 400), time_s=0.4) \\
+        .pinch((540, 1200), 400, 100) \\
+        .tap(540, 1200, count=3, interval_s=0.05) \\
+        .perform()
+    """
+
+    def __init__(self, driver=None):
+        """
+        :param driver: 执行手势的HMDriver，为None时只能用to_message构造请求
+        """
+        self.driver = driver
+        self.segments = []
+        self._pause_ms = 0
+        # 所有段的等待和注入时间之和，用于计算请求超时
+        self.time_s = 0.0
+
+    def __len__(self):
+        return len(self.segments)
+
+    def add(self, paths, time_s=0.5):
+        """
+        添加一段多指手势，所有手指同时按下、同时抬起
+        :param paths: 每根手指一条路径，路径为[(x, y), ...]，较短的路径在最后一点停留
+        :param time_s: 这段手势的持续时间，换算为注入速度
+        """
+        if not 1 <= len(paths) <= MAX_FINGERS:
+            raise HDriverError(f"gesture needs 1-{MAX_FINGERS} fingers, got {len(paths)}")
+        if any(len(path) == 0 for path in paths):
+            raise HDriverError("gesture path is empty")
+        steps = max(len(path) for path in paths)
+        if steps > MAX_STEPS:
+            raise HDriverError(f"gesture path has {steps} points, at most {MAX_STEPS}")
+        fingers = []
+        for path in paths:
+            path = list(path) + [path[-1]] * (steps - len(path))
+            fingers.append([int(round(value)) for point in path for value in point])
+        # 注入速率，范围：200-40000，单位：像素点/秒
+        length = max(path_length(path) for path in paths)
+        speed = min(max(int(length / time_s) if time_s > 0 else 40000, 200), 40000)
+        self.segments.append({"fingers": fingers, "speed": speed, "pause_ms": self._pause_ms})
+        self.time_s += self._pause_ms / 1000 + length / speed
+        self._pause_ms = 0
+        return self
+
+    def pause(self, time_s):
+        """
+        下一段手势开始之前在设备端等待time_s秒
+        """
+        self._pause_ms += int(time_s * 1000)
+        return self
+
+    def tap(self, x, y, count=1, interval_s=0.1):
+        """
+        点击count次，两次点击之间间隔interval_s秒
+        """
+        for index in range(count):
+            if index:
+                self.pause(interval_s)
+            self.add([[(x, y)]], time_s=0)
+        return self
+
+    def swipe(self, *points, time_s=0.5, steps=20):
+        """
+        单指沿折线滑动，points为依次经过的点
+        """
+        if len(points) < 2:
+            raise HDriverError("swipe needs at least 2 points")
+        return self.add([resample(points, steps)], time_s)
+
+    def curve(self, start, control, end, time_s=0.5, steps=50):
+        """
+        单指沿二次贝塞尔曲线滑动
+        :param control: 控制点，曲线向它弯曲
+        """
+        path = []
+        for step in range(steps):
+            t = step / (steps - 1) if steps > 1 else 1.0
+            path.append(((1 - t) ** 2 * start[0] + 2 * (1 - t) * t * control[0] + t * t * end[0],
+                         (1 - t) ** 2 * start[1] + 2 * (1 - t) * t * control[1] + t * t * end[1]))
+        return self.add([path], time_s)
+
+    def pinch(self, center, start_distance, end_distance, angle=0, time_s=0.5, steps=20):
+        """
+        双指缩放，两指关于center对称，距离从start_distance变为end_distance，end大于start为放大
+        :param angle: 两指连线与水平方向的夹角，单位度
+        """
+        radians = math.radians(angle)
+        dx, dy = math.cos(radians), math.sin(radians)
+        first, second = [], []
+        for step in range(steps):
+            t = step / (steps - 1) if steps > 1 else 1.0
+            half = (start_distance + (end_distance - start_distance) * t) / 2
+            first.append((center[0] - dx * half, center[1] - dy * half))
+            second.append((center[0] + dx * half, center[1] + dy * half))
+        return self.add([first, second], time_s)
+
+    def rotate(self, center, radius, degrees, fingers=2, start_angle=0, time_s=0.5, steps=30):
+        """
+        多指绕center旋转，手指在半径radius的圆上均匀分布
+        :param degrees: 旋转角度，正数为顺时针（屏幕坐标系y轴向下）
+        """
+        paths = []
+        for finger in range(fingers):
+            base = math.radians(start_angle + 360.0 * finger / fingers)
+            path = []
+            for step in range(steps):
+                t = step / (steps - 1) if steps > 1 else 1.0
+                theta = base + math.radians(degrees) * t
+                path.append((center[0] + radius * math.cos(theta), center[1] + radius * math.sin(theta)))
+            paths.append(path)
+        return self.add(paths, time_s)
+
+    def to_message(self) -> dict:
+        if not self.segments:
+            raise HDriverError("gesture is empty")
+        return {"action": "gesture", "segments": self.segments, "time_s": round(self.time_s, 3)}
+
+    def perform(self):
+        """
+        发送到设备端执行
+        :return: 成功返回True，否则返回False
+        """
+        return self.driver.perform_gesture(self)
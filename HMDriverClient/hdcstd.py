@@ -1,22 +1,221 @@
 # -*- coding: utf-8 -*-
 
+import atexit
+import base64
+import binascii
 import logging
 import os
+import queue
 import re
+import shlex
 import subprocess
+import threading
+import time
 import traceback
+import uuid
 from HMDriverClient.exception import *
 
 
+class HdcShell(object):
+    """
+    long-lived 'hdc -t serial shell' process. each command is written to its stdin between
+    two sentinel echoes and the output is read back up to the closing sentinel,
+    so a device shell command costs one round trip on an open channel instead of a fork of hdc
+    """
+    begin_mark = "__HDRIVER_BEGIN_"
+    end_mark = "__HDRIVER_END_"
+
+    def __init__(self, serial):
+        self.serial = serial
+        self.proc = None
+        self._lines = None
+        self._lock = threading.Lock()
+
+    def command(self) -> list:
+        return ["hdc", "-t", self.serial, "shell"]
+
+    def _start(self):
+        self.proc = subprocess.Popen(self.command(), stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0)
+        self._lines = queue.Queue()
+        threading.Thread(target=self._read_loop, args=(self.proc, self._lines),
+                         name=f"hdc-shell-{self.serial}", daemon=True).start()
+
+    @staticmethod
+    def _read_loop(proc, lines):
+        for line in iter(proc.stdout.readline, b""):
+            lines.put(line.decode("utf8", "ignore").rstrip("\r\n"))
+        lines.put(None)
+
+    def is_alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def run(self, cmd: str, timeout=60) -> str:
+        """
+        run a command in the device shell
+        :param cmd: shell command line, may contain pipes and quotes
+        :param timeout: seconds to wait for the command to finish
+        :return: output of the command
+        """
+        with self._lock:
+            if not self.is_alive():
+                self._start()
+            token = uuid.uuid4().hex
+            # 标记中间加""，回显的命令行与实际输出的标记不同
+            line = f'echo {self.begin_mark}""{token}; {{ {cmd}\n}} </dev/null; echo {self.end_mark}""{token}\n'
+            try:
+                self.proc.stdin.write(line.encode("utf8"))
+                self.proc.stdin.flush()
+                return self._read_output(token, timeout)
+            except (OSError, queue.Empty, HDCException) as e:
+                # 输出已无法对齐，关闭后下次重新建立
+                self.close()
+                raise HDCException(f"hdc shell session failed: {cmd}, {e}")
+
+    def _read_output(self, token, timeout):
+        begin, end = self.begin_mark + token, self.end_mark + token
+        out_lines = []
+        started = False
+        # timeout限制整条命令，而不是每一行
+        deadline = time.monotonic() + timeout
+        while True:
+            line = self._lines.get(timeout=max(deadline - time.monotonic(), 0))
+            if line is None:
+                raise HDCException("hdc shell exited")
+            if not started:
+                started = begin in line
+                continue
+            if end in line:
+                tail = line[:line.index(end)]
+                if tail:
+                    out_lines.append(tail)
+                break
+            out_lines.append(line)
+        return "".join(f"{ll}\n" for ll in out_lines)
+
+    def close(self):
+        if self.proc is not None:
+            try:
+                self.proc.kill()
+                self.proc.wait(1)
+            except Exception:
+                pass
+        self.proc = None
+
+
+_shell_sessions = {}
+_shell_sessions_lock = threading.Lock()
+
+
+def get_shell_session(serial) -> HdcShell:
+    """
+    get the shared shell session of a device, created on first use
+    """
+    with _shell_sessions_lock:
+        session = _shell_sessions.get(serial)
+        if session is None:
+            session = _shell_sessions[serial] = HdcShell(serial)
+        return session
+
+
+@atexit.register
+def _close_shell_sessions():
+    for session in list(_shell_sessions.values()):
+        session.close()
+
+
+def screen_cap_command() -> str:
+    """
+    device shell command printing a screenshot as base64, the remote file name is unique
+    so parallel captures never clobber each other
+    """
+    remote_path = f"/data/local/tmp/hdriver_{uuid.uuid4().hex}.png"
+    return f"uitest screenCap -p {remote_path} >/dev/null && base64 {remote_path}; rm -f {remote_path}"
+
+
+def decode_screen_cap(out) -> bytes:
+    """
+    decode the output of screen_cap_command into png bytes
+    """
+    try:
+        png_bytes = base64.b64decode(out)
+    except (binascii.Error, ValueError):
+        png_bytes = b""
+    if not png_bytes.startswith(b"\x89PNG"):
+        raise HDCException(f"screen shot failed! {out[:200]}")
+    return png_bytes
+
+
+def split_cmd(cmd: str) -> list:
+    """
+    split an hdc command line into arguments. on Windows backslashes in paths are kept
+    and only the quotes around an argument are removed
+    """
+    if os.name != "nt":
+        return shlex.split(cmd)
+    args = []
+    for arg in shlex.split(cmd, posix=False):
+        if len(arg) >= 2 and arg[0] == arg[-1] and arg[0] in "\"'":
+            arg = arg[1:-1]
+        args.append(arg)
+    return args
+
+
+def list_targets():
+    """
+    serials of all connected devices from hdc list targets
+    """
+    out = subprocess.run(["hdc", "list", "targets"], stdout=subprocess.PIPE).stdout.decode()
+    return [line.strip() for line in out.splitlines() if line.strip() and "[Empty]" not in line]
+
+
+def dump_layout_command() -> str:
+    """
+    device shell command printing the component tree json of uitest dumpLayout
+    """
+    remote_path = f"/data/local/tmp/hdriver_{uuid.uuid4().hex}.json"
+    return f"uitest dumpLayout -p {remote_path} >/dev/null && cat {remote_path}; rm -f {remote_path}"
+
+
 class HDC(object):
+    # 设备shell命令是否走常驻的hdc shell会话，为False时每条命令单独启动hdc进程
+    use_shell_session = True
+
     def __init__(self, serial):
         self.serial = serial
         self.cmd_prefix = ['hdc', "-t", serial]
 
+    def _shell_session_run(self, device_cmd):
+        """
+        run a device shell command on the shared session
+        :return: output, or None when the session is unavailable
+        """
+        if not self.use_shell_session:
+            return None
+        try:
+            return get_shell_session(self.serial).run(device_cmd)
+        except Exception as e:
+            logging.warning(f"hdc shell session unavailable, fallback to hdc process: {e}")
+            return None
+
     def run_cmd(self, cmd):
-        cmd = f"hdc -t {self.serial} {cmd}"
-        out = os.popen(cmd).read()
-        return out
+        """
+        run an hdc command line, device shell commands go through the shared shell session.
+        fport, install and file commands are executed by the local hdc server, not the device shell,
+        so they still start an hdc process each time
+        :return: output of the command
+        """
+        try:
+            args = split_cmd(cmd)
+        except ValueError:
+            return os.popen(f"hdc -t {self.serial} {cmd}").read()
+        if len(args) > 1 and args[0] == "shell":
+            out = self._shell_session_run(" ".join(args[1:]))
+            if out is not None:
+                return out
+        # 不经过本地shell，直接启动hdc
+        proc = subprocess.run(self.cmd_prefix + args, stdout=subprocess.PIPE)
+        return proc.stdout.decode("utf8", "ignore")
 
     def shell(self, params, is_wait=True):
         """
@@ -32,17 +231,47 @@ class HDC(object):
             logging.error(msg)
             raise HDCException(msg)
 
-        args = self.cmd_prefix
-        args += params
+        args = self.cmd_prefix + params
         logging.debug(f'=====run command:{args}')
         if is_wait:
+            out = None
+            if len(params) > 1 and params[0] == "shell":
+                out = self._shell_session_run(" ".join(params[1:]))
+            if out is not None:
+                logging.debug(f'return:{out}')
+                return out.strip()
             r = subprocess.check_output(args).strip()
             if not isinstance(r, str):
                 r = r.decode()
             logging.debug(f'return:{r}')
             return r
         else:
-            return subprocess.Popen(args, shell=True)
+            return subprocess.Popen(args)
+
+    def screen_cap(self) -> bytes:
+        """
+        capture the screen into memory, the png is streamed back through the shell channel
+        :return: png bytes
+        """
+        cmd = screen_cap_command()
+        out = self._shell_session_run(cmd)
+        if out is None:
+            out = subprocess.run(self.cmd_prefix + ["shell", cmd], stdout=subprocess.PIPE).stdout
+        return decode_screen_cap(out)
+
+    def dump_layout(self) -> str:
+        """
+        dump the component tree of the current screen, streamed back through the shell channel
+        :return: layout json text
+        """
+        cmd = dump_layout_command()
+        out = self._shell_session_run(cmd)
+        if out is None:
+            out = subprocess.run(self.cmd_prefix + ["shell", cmd], stdout=subprocess.PIPE).stdout.decode()
+        out = out.strip()
+        if not out.startswith("{"):
+            raise HDCException(f"dump layout failed! {out[:200]}")
+        return out
 
     def is_online(self):
         """
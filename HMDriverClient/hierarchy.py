@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+import json
+import re
+from collections import defaultdict
+
+from HMDriverClient.element import ElementAttribute, ElementBy, MatchPattern
+
+_BOUNDS_PATTERN = re.compile(r"\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]")
+
+# ElementBy中的布尔条件对应的ElementAttribute
+_BOOL_BY = {
+    ElementBy.clickable: ElementAttribute.isClickable,
+    ElementBy.longClickable: ElementAttribute.isLongClickable,
+    ElementBy.scrollable: ElementAttribute.isScrollable,
+    ElementBy.enabled: ElementAttribute.isEnabled,
+    ElementBy.focused: ElementAttribute.isFocused,
+    ElementBy.selected: ElementAttribute.isSelected,
+    ElementBy.checked: ElementAttribute.isChecked,
+    ElementBy.checkable: ElementAttribute.isCheckable,
+}
+
+# 建立哈希索引的字符串属性
+_INDEXED_BY = (ElementBy.id, ElementBy.text, ElementBy.type, ElementBy.description)
+
+
+def parse_bounds(bounds: str):
+    """
+    parse dumpLayout bounds '[left,top][right,bottom]' into the dict format of Element.bounds
+    """
+    m = _BOUNDS_PATTERN.match(bounds or "")
+    if not m:
+        return {"left": 0, "top": 0, "right": 0, "bottom": 0}
+    left, top, right, bottom = (int(v) for v in m.groups())
+    return {"left": left, "top": top, "right": right, "bottom": bottom}
+
+
+def _to_bool(value):
+    if isinstance(value, str):
+        return value.lower() == "true"
+    return bool(value)
+
+
+def _match_text(value: str, data: str, pattern: int):
+    if pattern == MatchPattern.CONTAINS:
+        return data in value
+    if pattern == MatchPattern.STARTS_WITH:
+        return value.startswith(data)
+    if pattern == MatchPattern.ENDS_WITH:
+        return value.endswith(data)
+    return value == data
+
+
+class Node(object):
+    """
+    one component of a hierarchy snapshot, properties uses the same keys as Element.properties
+    """
+    __slots__ = ("index", "depth", "parent", "children", "properties")
+
+    def __init__(self, index, depth, parent, properties):
+        self.index = index
+        self.depth = depth
+        self.parent = parent
+        self.children = []
+        self.properties = properties
+
+    def __repr__(self):
+        return f'<Node(index={self.index}, id={self.id}, text={self.text}, type={self.type}, bounds={self.bounds})>'
+
+    @property
+    def id(self):
+        return self.properties[ElementAttribute.id]
+
+    @property
+    def text(self):
+        return self.properties[ElementAttribute.text]
+
+    @property
+    def type(self):
+        return self.properties[ElementAttribute.type]
+
+    @property
+    def description(self):
+        return self.properties[ElementAttribute.description]
+
+    @property
+    def bounds(self):
+        return self.properties[ElementAttribute.bounds]
+
+    @property
+    def bounds_center(self):
+        return self.properties[ElementAttribute.boundsCenter]
+
+    @property
+    def center(self):
+        """
+        中心点坐标(x, y)，可直接用于hdriver.click(*node.center)
+        """
+        center = self.properties[ElementAttribute.boundsCenter]
+        return center["x"], center["y"]
+
+
+class Hierarchy(object):
+    """
+    snapshot of the whole component tree with hash indexes on id/text/type/description
+    and a grid index on bounds. queries run locally without any device round trip.
+    """
+
+    def __init__(self, root: dict, grid_size=200):
+        self.nodes = []
+        self.grid_size = grid_size
+        self._index = {by: defaultdict(list) for by in _INDEXED_BY}
+        self._grid = defaultdict(list)
+        self.root = self._build(root, 0, None) if root else None
+
+    @classmethod
+    def from_json(cls, text, grid_size=200):
+        return cls(json.loads(text), grid_size)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def _build(self, data: dict, depth, parent):
+        # 迭代构建，避免层级过深时递归溢出，nodes为先序遍历顺序
+        root = None
+        stack = [(data, depth, parent)]
+        while stack:
+            item, item_depth, item_parent = stack.pop()
+            node = Node(len(self.nodes), item_depth, item_parent, self._properties(item.get("attributes", {})))
+            self.nodes.append(node)
+            if item_parent is None:
+                root = node
+            else:
+                item_parent.children.append(node)
+            self._add_to_index(node)
+            for child in reversed(item.get("children", [])):
+                stack.append((child, item_depth + 1, node))
+        return root
+
+    @staticmethod
+    def _properties(attributes: dict):
+        bounds = parse_bounds(attributes.get("bounds", ""))
+        return {
+            ElementAttribute.id: attributes.get("id") or attributes.get("key", ""),
+            ElementAttribute.text: attributes.get("text", ""),
+            ElementAttribute.type: attributes.get("type", ""),
+            ElementAttribute.description: attributes.get("description", ""),
+            ElementAttribute.bounds: bounds,
+            ElementAttribute.boundsCenter: {"x": (bounds["left"] + bounds["right"]) // 2,
+                                            "y": (bounds["top"] + bounds["bottom"]) // 2},
+            ElementAttribute.isClickable: _to_bool(attributes.get("clickable", False)),
+            ElementAttribute.isLongClickable: _to_bool(attributes.get("longClickable", False)),
+            ElementAttribute.isScrollable: _to_bool(attributes.get("scrollable", False)),
+            ElementAttribute.isEnabled: _to_bool(attributes.get("enabled", False)),
+            ElementAttribute.isFocused: _to_bool(attributes.get("focused", False)),
+            ElementAttribute.isSelected: _to_bool(attributes.get("selected", False)),
+            ElementAttribute.isChecked: _to_bool(attributes.get("checked", False)),
+            ElementAttribute.isCheckable: _to_bool(attributes.get("checkable", False)),
+        }
+
+    def _cells(self, bounds):
+        size = self.grid_size
+        for gx in range(max(bounds["left"], 0) // size, max(bounds["right"] - 1, 0) // size + 1):
+            for gy in range(max(bounds["top"], 0) // size, max(bounds["bottom"] - 1, 0) // size + 1):
+                yield gx, gy
+
+    def _add_to_index(self, node: Node):
+        # 空字符串也建索引，find_all(ElementBy.id, "")返回id为空的控件
+        for by in _INDEXED_BY:
+            self._index[by][node.properties[by]].append(node)
+        bounds = node.bounds
+        if bounds["right"] > bounds["left"] and bounds["bottom"] > bounds["top"]:
+            for cell in self._cells(bounds):
+                self._grid[cell].append(node)
+
+    def _candidates(self, by, data, pattern):
+        if by in self._index:
+            if pattern == MatchPattern.EQUALS:
+                return self._index[by].get(data, [])
+            return [node for value, nodes in self._index[by].items()
+                    if _match_text(value, data, pattern) for node in nodes]
+        return self.nodes
+
+    def _match(self, node: Node, by, data, pattern=MatchPattern.EQUALS):
+        if by in _INDEXED_BY:
+            return _match_text(node.properties[by], data, pattern)
+        if by in _BOOL_BY:
+            return node.properties[_BOOL_BY[by]] == _to_bool(data)
+        if by in (ElementBy.isBefore, ElementBy.isAfter):
+            others = self.find_all(data["by"], data["data"], data.get("params"))
+            if not others:
+                return False
+            if by == ElementBy.isBefore:
+                return node.index < others[-1].index
+            return node.index > others[0].index
+        raise ValueError(f"unknown by: {by}")
+
+    def find_all(self, by: str, data, params=None, pattern=MatchPattern.EQUALS):
+        """
+        查找所有匹配的控件，条件与find_element相同
+        :param by: ElementBy类型
+        :param data: 对应by的取值
+        :param params: 其他限定条件，以字典形式传入{ElementBy.type: ElementType.Button}
+        :param pattern: by为字符串属性时的匹配方式，MatchPattern
+        :return: Node列表，按控件树先序遍历顺序
+        """
+        result = [node for node in self._candidates(by, data, pattern) if by in self._index or
+                  self._match(node, by, data, pattern)]
+        for key, value in (params or {}).items():
+            result = [node for node in result if self._match(node, key, value)]
+        return result
+
+    def find(self, by: str, data, params=None, pattern=MatchPattern.EQUALS):
+        """
+        查找第一个匹配的控件
+        :return: Node，未找到返回None
+        """
+        result = self.find_all(by, data, params, pattern)
+        return result[0] if result else None
+
+    def at(self, x, y):
+        """
+        包含坐标点(x, y)的所有控件
+        :return: Node列表，按层级由浅到深
+        """
+        nodes = self._grid.get((int(x) // self.grid_size, int(y) // self.grid_size), [])
+        result = [node for node in nodes if node.bounds["left"] <= x < node.bounds["right"] and
+                  node.bounds["top"] <= y < node.bounds["bottom"]]
+        return sorted(result, key=lambda node: node.depth)
+
+    def within(self, bounds):
+        """
+        完全位于区域内的所有控件
+        :param bounds: 区域，Element.bounds格式的字典或(left, top, right, bottom)
+        :return: Node列表，按先序遍历顺序
+        """
+        if not isinstance(bounds, dict):
+            bounds = dict(zip(("left", "top", "right", "bottom"), bounds))
+        found = {}
+        for cell in self._cells(bounds):
+            for node in self._grid.get(cell, []):
+                nb = node.bounds
+                if nb["left"] >= bounds["left"] and nb["top"] >= bounds["top"] and \
+                        nb["right"] <= bounds["right"] and nb["bottom"] <= bounds["bottom"]:
+                    found[node.index] = node
+        return [found[index] for index in sorted(found)]
@@ -1,8 +1,22 @@
 # -*- coding: utf-8 -*-
+import base64
+import hashlib
+
 from HMDriverClient.element import *
 from HMDriverClient.client import *
 from HMDriverClient.hdcstd import *
 from HMDriverClient.window import *
+from HMDriverClient.stream import ScreenStream
+from HMDriverClient.hierarchy import Hierarchy
+from HMDriverClient.tracing import Tracer
+from HMDriverClient.batch import Batch
+from HMDriverClient.gesture import Gesture
+from HMDriverClient.monkey import Monkey, MonkeyReport
+from HMDriverClient.selector import compile_selector
+from HMDriverClient.locator import LocatorCache
+from HMDriverClient.events import UiEvent, UiEventType
+from HMDriverClient.vision import ImageMatcher, ImageMatch, as_region
+from HMDriverClient.protocol import PROTOCOL_VERSION, hap_protocol
 
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s %(filename)s[line:%(lineno)d] %(levelname)s %(message)s',
@@ -29,34 +43,113 @@ class DisplayRotation:
     ROTATION_270 = 3
 
 
+# 设备上记录已安装UiTestAPP指纹的文件
+HAP_MARKER_PATH = "/data/local/tmp/hdriver_hap.sha256"
+# (路径, 修改时间, 大小) -> sha256，同一进程内多次创建driver时不重复计算
+_hap_digest_cache = {}
+
+
+def hap_digest(hap_list) -> str:
+    """
+    计算hap文件的组合指纹
+    :param hap_list: hap文件路径列表
+    """
+    sha = hashlib.sha256()
+    for hap in hap_list:
+        st = os.stat(hap)
+        key = (hap, st.st_mtime_ns, st.st_size)
+        digest = _hap_digest_cache.get(key)
+        if digest is None:
+            file_sha = hashlib.sha256()
+            with open(hap, "rb") as ff:
+                for chunk in iter(lambda: ff.read(1024 * 1024), b""):
+                    file_sha.update(chunk)
+            digest = _hap_digest_cache[key] = file_sha.hexdigest()
+        sha.update(digest.encode())
+    return sha.hexdigest()
+
+
+def installed_update_time(hdc: HDC, bundle: str = TestRunner.test_app_bundle):
+    """
+    通过bm dump获取应用的安装时间
+    :return: updateTime字符串，未安装返回None
+    """
+    out = hdc.run_cmd(f"shell bm dump -n {bundle}")
+    if f'"{bundle}"' not in out and f'"bundleName": "{bundle}"' not in out:
+        return None
+    m = re.search(r'"updateTime"\s*:\s*(\d+)', out)
+    return m.group(1) if m else "0"
+
+
+def install_test_haps(hdc: HDC, force=False, hap_dir=None):
+    """
+    安装UiTestAPP到设备，设备上已安装相同的hap时跳过
+    设备上的标记文件记录hap指纹和安装时间，应用被卸载或被其他方式重装后会重新安装
+    :param hdc: 设备的HDC对象
+    :param force: 为True时总是重新安装
+    :param hap_dir: hap所在目录，默认为包内的hap目录
+    :raise ProtocolVersionError: 包内的runner hap编译时的协议版本低于PROTOCOL_VERSION，安装后也无法连接
+    """
+    # 默认为当前文件所在路径下的hap目录
+    hap_dir = hap_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), "hap")
+    runner_hap = os.path.join(hap_dir, "entry-ohosTest-unsigned.hap")
+    hap_list = [os.path.join(hap_dir, "entry-default-unsigned.hap"), runner_hap]
+    hap_list = [hap for hap in hap_list if os.path.exists(hap)]
+    if not hap_list:
+        return
+    version = hap_protocol(runner_hap) if os.path.exists(runner_hap) else 0
+    if version < PROTOCOL_VERSION:
+        raise ProtocolVersionError(f"bundled {os.path.basename(runner_hap)} speaks protocol {version}, this client "
+                                   f"needs {PROTOCOL_VERSION}, rebuild the haps with `python UiTestAPP/build_haps.py`")
+    digest = hap_digest(hap_list)
+    if not force:
+        update_time = installed_update_time(hdc)
+        marker = hdc.run_cmd(f"shell cat {HAP_MARKER_PATH}").strip()
+        if update_time is not None and marker == f"{digest} {update_time}":
+            logging.info("UiTestAPP is up to date, skip install")
+            return
+    installed = True
+    for hap in hap_list:
+        ret = hdc.install_app(hap)
+        logging.info(f"install {hap}: {ret}")
+        installed = installed and ret
+    if installed:
+        hdc.run_cmd(f'shell "echo {digest} {installed_update_time(hdc)} > {HAP_MARKER_PATH}"')
+    else:
+        hdc.run_cmd(f"shell rm -f {HAP_MARKER_PATH}")
+
+
 class HMDriver(HDC):
 
-    def __init__(self, device_id: str, app_bundle: str = "", app_ability: str = ""):
+    def __init__(self, device_id: str, app_bundle: str = "", app_ability: str = "", local_port: int = None,
+                 heartbeat_interval_s: float = 1.0):
         super(HMDriver, self).__init__(device_id)
         self.device_id = device_id
         self.app_bundle = app_bundle
         self.app_ability = app_ability
         self.hdc = HDC(self.device_id)
+        self.screen_stream = None
+        self.locator_cache = None
+        # 截图解码结果按帧缓存，多个模板匹配同一屏幕时只解码一次
+        self.image_matcher = ImageMatcher()
         self.__setup()
-        self.client = Client(self.device_id, local_port=29100)
+        # local_port为空时自动分配，多台设备可在同一主机上并行
+        self.client = Client(self.device_id, local_port=local_port)
+        # 后台心跳，记录往返时延，heartbeat_interval_s为0时不启动
+        if heartbeat_interval_s:
+            self.client.start_heartbeat(heartbeat_interval_s)
 
     def __del__(self):
         self.stop()
 
     def __setup(self):
-        # 当前文件所在路径
-        dirname, filename = os.path.split(os.path.abspath(__file__))
-        hap_list = [
-            os.path.join(dirname, "hap", "entry-default-unsigned.hap"),
-            os.path.join(dirname, "hap", "entry-ohosTest-unsigned.hap"),
-        ]
-        for hap in hap_list:
-            if os.path.exists(hap):
-                logging.info(f"install {hap}: {self.hdc.install_app(hap)}")
+        install_test_haps(self.hdc)
 
     def stop(self):
+        self.stop_screen_stream()
         if self.client:
-            self.client.stop_test_runner()
+            # 停止心跳、关闭连接和读取线程、停止runner
+            self.client.close()
             self.client = None
 
     def req(self, msg_data):
@@ -67,13 +160,72 @@ class HMDriver(HDC):
             logging.error(f"{traceback.format_exc()}")
             return None
 
-    def find_element(self, by: str, data: str, params=None, timeout_s: int = 10):
+    def req_many(self, msg_list):
+        """
+        并发发送多个请求，在同一个连接上等待所有结果，请求之间不互相排队
+        :param msg_list: 请求列表
+        :return: 结果列表，与请求顺序一致，失败的请求对应None
+        示例:
+        # 同时获取屏幕尺寸和当前应用
+        size, bundle = hdriver.req_many([{"action": "screenSize"}, {"action": "currentBundle"}])
+        """
+        resp_list = []
+        for resp in self.client.request_many(msg_list):
+            if isinstance(resp, Exception):
+                logging.error(f"request Error! {resp}")
+                resp = None
+            resp_list.append(resp)
+        return resp_list
+
+    def batch(self, stop_on_error=True) -> Batch:
+        """
+        批量操作，所有步骤一次请求发送到设备端按顺序执行，只有一次往返
+        :param stop_on_error: 某一步失败时是否停止执行后面的步骤
+        :return: Batch对象，with语句结束时自动执行，也可以调用run()
+        示例:
+        with hdriver.batch() as batch:
+            user = batch.find_element_by_id("user_name", timeout_s=5)
+            batch.input_text(user, "test")
+            batch.click_element(batch.find_element_by_text("登录"))
+        user_element, _, _, _ = batch.results
+        """
+        return Batch(self, stop_on_error)
+
+    def run_batch(self, batch: Batch):
+        """
+        执行批量操作
+        :return: 每个步骤的结果列表，查找控件的步骤为Element，finds步骤为Element列表，其他步骤为data，
+            失败的步骤为异常对象，未执行的步骤为None
+        """
+        resp = self.client.request(batch.to_message())
+        step_results = resp["data"] if resp else []
+        results = []
+        for index, step in enumerate(batch.steps):
+            if index >= len(step_results):
+                results.append(None)
+                continue
+            result = decode_reply(step_results[index])
+            if result.get("ret") == "error":
+                error_desc = result.get("description", "")
+                results.append(ElementNotFoundError(error_desc) if error_desc.startswith("no ele")
+                               else HDriverError(error_desc))
+            elif "euid" in result:
+                results.append(Element(self.client, result["euid"], result["property"]))
+            elif step["action"] == "finds":
+                results.append([Element(self.client, item["euid"], item["property"]) for item in result["data"]])
+            else:
+                results.append(result.get("data"))
+        return results
+
+    def find_element(self, by: str, data: str, params=None, timeout_s: int = 10, fields=None):
         """
         查找控件
         :param by: ElementBy类型
         :param data: 对应by的取值
         :param params: 查找控件的其他限定条件，以字典形式传入{ElementBy.text: ""}
         :param timeout_s: 查找控件超时时间，单位秒
+        :param fields: 需要返回的控件属性列表(ElementAttribute)，为None时返回全部属性，
+            只取需要的属性可以减少设备端的耗时
         :return: 控件对象，如果查找失败返回None
         示例:
         # 查找id为"btn_sign"且类型为Button的控件
@@ -82,71 +234,101 @@ class HMDriver(HDC):
         # 查找id为"btn_sign"且类型为Button，并且text为"设置"的控件
         element = hdriver.find_element(ElementBy.id, "btn_sign", params={ElementBy.type: ElementType.Button, ElementBy.text: "设置"})
         """
+        cache = self.locator_cache
+        if cache is not None:
+            cache_key = cache.key(by, data, params, fields)
+            element = cache.lookup(cache_key)
+            if element is not None:
+                return element
+            generation = cache.generation()
         try:
             msg_data = {
                 "action": "find",
                 "by": by,
                 "data": data,
-                "timeout_s": str(timeout_s),
+                "timeout_s": timeout_s,
                 "params": params
             }
+            if fields:
+                msg_data["fields"] = list(fields)
+            if by == ElementBy.selector:
+                msg_data["query"] = compile_selector(data).query
             resp = self.req(msg_data)
-            return Element(self.client, resp["euid"], resp["property"])
+            element = Element(self.client, resp["euid"], resp["property"])
         except Exception as e:
             logging.error(f"find element Error! {e}")
             return None
+        if cache is not None:
+            cache.store(cache_key, element, generation)
+        return element
 
-    def find_element_by_id(self, id: str, params=None, timeout_s: int = 10):
+    def find_element_by_id(self, id: str, params=None, timeout_s: int = 10, fields=None):
         """
         通过id查找控件
         :param id: 控件id
         :param params: 查找控件的其他限定条件，以字典形式传入
             比如: {"text": "设置"},查找控件id为{id},并且text为"设置"的控件
         :param timeout_s: 查找控件超时时间，单位秒
+        :param fields: 需要返回的控件属性列表(ElementAttribute)，为None时返回全部属性
         :return: 控件对象，如果查找失败返回None
         """
-        return self.find_element(ElementBy.id, id, params, timeout_s)
+        return self.find_element(ElementBy.id, id, params, timeout_s, fields)
 
-    def find_element_by_text(self, text: str, params=None, timeout_s: int = 10):
+    def find_element_by_text(self, text: str, params=None, timeout_s: int = 10, fields=None):
         """
         通过text查找控件
         :param text: 控件text
         :param params: 查找控件的其他限定条件，以字典形式传入
             比如: {"id": "btn_sign"},查找控件text为{text}，并且id为"btn_sign"的控件
         :param timeout_s: 查找控件超时时间，单位秒
+        :param fields: 需要返回的控件属性列表(ElementAttribute)，为None时返回全部属性
         :return: 控件对象，如果查找失败返回None
         """
-        return self.find_element(ElementBy.text, text, params, timeout_s)
+        return self.find_element(ElementBy.text, text, params, timeout_s, fields)
 
-    def find_element_by_desc(self, desc: str, params=None, timeout_s: int = 10):
+    def find_element_by_desc(self, desc: str, params=None, timeout_s: int = 10, fields=None):
         """
         通过description查找控件
         :param desc: 控件description
         :param params: 查找控件的其他限定条件，以字典形式传入
             比如: {"id": "btn_sign"},查找控件description为{desc}，并且id为"btn_sign"的控件
         :param timeout_s: 查找控件超时时间，单位秒
+        :param fields: 需要返回的控件属性列表(ElementAttribute)，为None时返回全部属性
         :return: 控件对象，如果查找失败返回None
         """
-        return self.find_element(ElementBy.description, desc, params, timeout_s)
+        return self.find_element(ElementBy.description, desc, params, timeout_s, fields)
 
-    def find_element_by_type(self, typename: str, params=None, timeout_s: int = 10):
+    def find_element_by_type(self, typename: str, params=None, timeout_s: int = 10, fields=None):
         """
         通过type查找控件
         :param typename: 控件type
         :param params: 查找控件的其他限定条件，以字典形式传入
             比如: {"id": "btn_sign"},查找控件type为{typename}，并且id为"btn_sign"的控件
         :param timeout_s: 查找控件超时时间，单位秒
+        :param fields: 需要返回的控件属性列表(ElementAttribute)，为None时返回全部属性
         :return: 控件对象，如果查找失败返回None
         """
-        return self.find_element(ElementBy.type, typename, params, timeout_s)
+        return self.find_element(ElementBy.type, typename, params, timeout_s, fields)
 
-    def find_elements(self, by: str, data: str, params=None, timeout_s=20):
+    def find_element_by_selector(self, selector: str, timeout_s: int = 10, fields=None):
+        """
+        通过选择器查找控件，复合条件在一次查询中完成，语法见selector.py
+        选择器在客户端解析校验后缓存，设备端按编译后的条件依次构造On
+        :param selector: 选择器，例如 'Button[text^="确定"][enabled]:after(Text[text="用户名"])'
+        :param timeout_s: 查找控件超时时间，单位秒
+        :param fields: 需要返回的控件属性列表(ElementAttribute)，为None时返回全部属性
+        :return: 控件对象，如果查找失败或选择器有语法错误返回None
+        """
+        return self.find_element(ElementBy.selector, selector, None, timeout_s, fields)
+
+    def find_elements(self, by: str, data: str, params=None, timeout_s=20, fields=None):
         """
         查找多个控件, 与find_element一样,只是该函数返回控件对象列表
         :param by: ElementBy类型
         :param data: 对应by的取值
         :param params: 查找控件的其他限定条件，以字典形式传入{ElementBy.text: ""}
         :param timeout_s: 查找控件超时时间，单位秒
+        :param fields: 需要返回的控件属性列表(ElementAttribute)，为None时返回全部属性
         :return: 控件对象列表，如果查找失败返回None
         """
         try:
@@ -154,19 +336,16 @@ class HMDriver(HDC):
                 "action": "finds",
                 "by": by,
                 "data": data,
-                **params
+                "timeout_s": timeout_s,
+                "params": params
             }
-            st = time.perf_counter()
-            ele_list = []
-            while time.perf_counter() - st < timeout_s:
-                try:
-                    resp = self.req(msg_data)
-                    ele_list = resp["data"]
-                    if len(ele_list) > 0:
-                        break
-                except Exception as e:
-                    logging.warning(f"find elements Error! {e}, retry again")
-                time.sleep(1)
+            if fields:
+                msg_data["fields"] = list(fields)
+            if by == ElementBy.selector:
+                msg_data["query"] = compile_selector(data).query
+            # 设备端等待控件出现，一次请求完成
+            resp = self.req(msg_data)
+            ele_list = resp["data"] if resp else []
             if not ele_list:
                 return None
             return [Element(self.client, ele["euid"], ele["property"]) for ele in ele_list]
@@ -174,55 +353,67 @@ class HMDriver(HDC):
             logging.error(f"find elements Error! {e}")
             return None
 
-    def find_elements_by_id(self, id: str, params=None, timeout_s: int = 10):
+    def find_elements_by_id(self, id: str, params=None, timeout_s: int = 10, fields=None):
         """
         通过id查找控件
         :param id: 控件id
         :param params: 查找控件的其他限定条件，以字典形式传入
             比如: {"text": "设置"},查找控件id为{id},并且text为"设置"的控件
         :param timeout_s: 查找控件超时时间，单位秒
+        :param fields: 需要返回的控件属性列表(ElementAttribute)，为None时返回全部属性
         :return: 控件对象列表，如果查找失败返回None
         """
-        return self.find_elements(ElementBy.id, id, params, timeout_s)
+        return self.find_elements(ElementBy.id, id, params, timeout_s, fields)
 
-    def find_elements_by_text(self, text: str, params=None, timeout_s: int = 10):
+    def find_elements_by_text(self, text: str, params=None, timeout_s: int = 10, fields=None):
         """
         通过text查找控件
         :param text: 控件text
         :param params: 查找控件的其他限定条件，以字典形式传入
             比如: {"id": "btn_sign"},查找控件text为{text}，并且id为"btn_sign"的控件
         :param timeout_s: 查找控件超时时间，单位秒
+        :param fields: 需要返回的控件属性列表(ElementAttribute)，为None时返回全部属性
         :return: 控件对象列表，如果查找失败返回None
         """
-        return self.find_elements(ElementBy.text, text, params, timeout_s)
+        return self.find_elements(ElementBy.text, text, params, timeout_s, fields)
 
-    def find_elements_by_desc(self, desc: str, params=None, timeout_s: int = 10):
+    def find_elements_by_desc(self, desc: str, params=None, timeout_s: int = 10, fields=None):
         """
         通过description查找控件
         :param desc: 控件description
         :param params: 查找控件的其他限定条件，以字典形式传入
             比如: {"id": "btn_sign"},查找控件description为{desc}，并且id为"btn_sign"的控件
         :param timeout_s: 查找控件超时时间，单位秒
+        :param fields: 需要返回的控件属性列表(ElementAttribute)，为None时返回全部属性
         :return: 控件对象列表，如果查找失败返回None
         """
-        return self.find_elements(ElementBy.description, desc, params, timeout_s)
+        return self.find_elements(ElementBy.description, desc, params, timeout_s, fields)
 
-    def find_elements_by_type(self, typename: str, params=None, timeout_s: int = 10):
+    def find_elements_by_type(self, typename: str, params=None, timeout_s: int = 10, fields=None):
         """
         通过type查找控件
         :param typename: 控件type
         :param params: 查找控件的其他限定条件，以字典形式传入
             比如: {"id": "btn_sign"},查找控件type为{typename}，并且id为"btn_sign"的控件
         :param timeout_s: 查找控件超时时间，单位秒
+        :param fields: 需要返回的控件属性列表(ElementAttribute)，为None时返回全部属性
         :return: 控件对象列表，如果查找失败返回None
         """
-        return self.find_elements(ElementBy.type, typename, params, timeout_s)
+        return self.find_elements(ElementBy.type, typename, params, timeout_s, fields)
 
-    def find_window(self, filters):
+    def find_elements_by_selector(self, selector: str, timeout_s: int = 10, fields=None):
+        """
+        通过选择器查找多个控件，语法见selector.py
+        :return: 控件对象列表，如果查找失败返回None
+        """
+        return self.find_elements(ElementBy.selector, selector, None, timeout_s, fields)
+
+    def find_window(self, filters, fields=None):
         """
         查找窗口，返回窗口对象
         :param filters: 查找窗口的限定条件，以字典形式传入, 可用条件参考 WindowFilter
             比如: {"title": "登录"},查找窗口标题为"登录"的窗口
+        :param fields: 需要返回的窗口属性列表(WindowAttribute)，为None时返回全部属性
         :return: 窗口对象，如果查找失败返回None
         """
         try:
@@ -231,12 +422,205 @@ class HMDriver(HDC):
                 "operate": "find",
                 "filter": filters
             }
+            if fields:
+                data["fields"] = list(fields)
             resp = self.req(data)
             return UiWindow(self.client, resp["euid"], resp["property"])
         except Exception as e:
             logging.error(f"find window Error! {e}")
             return None
 
+    def get_properties(self, elements, fields=None):
+        """
+        一次请求批量获取多个控件的属性
+        :param elements: 控件对象列表
+        :param fields: 需要获取的属性列表(ElementAttribute)，为None时获取全部属性
+        :return: 属性字典列表，与elements顺序一致，获取失败的控件对应None
+        示例:
+        # 获取列表中所有控件的bounds
+        items = hdriver.find_elements_by_type(ElementType.ListItem, fields=[ElementAttribute.bounds])
+        bounds_list = hdriver.get_properties(items, [ElementAttribute.bounds])
+        """
+        msg_data = {"action": "gets", "euids": [ele.euid for ele in elements]}
+        if fields:
+            msg_data["fields"] = list(fields)
+        resp = self.req(msg_data)
+        if not resp:
+            return [None] * len(elements)
+        ret = []
+        for ele, item in zip(elements, resp["data"]):
+            if "property" not in item:
+                logging.error(f"get properties Error! {item.get('error')}")
+                ret.append(None)
+                continue
+            ele.update_properties(item["property"])
+            ret.append(item["property"])
+        return ret
+
+    def release_elements(self, elements):
+        """
+        立即释放设备端的控件句柄
+        :param elements: 控件对象列表
+        """
+        for ele in elements:
+            ele.release()
+        self.client.flush_releases()
+
+    def handle_stats(self):
+        """
+        获取设备端句柄统计，用于确认长时间运行时句柄数量没有持续增长
+        :return: {"elements": {"live": 当前句柄数, "created": 创建数, "released": 释放数,
+                               "evicted": 淘汰数, "cleared": 操作后清空数, "maxSize": 上限, "ttlMs": 过期时间},
+                  "windows": {...}}
+        """
+        resp = self.req({"action": "handleStats"})
+        return resp["data"] if resp else None
+
+    def health(self):
+        """
+        设备连接健康状况，不发送请求，数据来自后台心跳
+        :return: {"alive": 心跳是否正常, "last_seen": 最近一次收到回复的时间戳,
+                  "rtt_p50_ms": 心跳往返时延中位数, "rtt_p99_ms": 99分位时延, "rtt_max_ms": 最大时延,
+                  "samples": 心跳次数, "heartbeat_failures": 连续失败次数, "pending": 等待回复的请求数}
+        """
+        client = self.client
+        rtt = client.rtt.summary()
+        return {
+            "alive": client.dispatcher is not None and not client.dispatcher.closed and client.heartbeat_failures == 0,
+            "last_seen": client.last_seen,
+            "rtt_p50_ms": rtt["p50_ms"],
+            "rtt_p99_ms": rtt["p99_ms"],
+            "rtt_max_ms": rtt["max_ms"],
+            "samples": rtt["count"],
+            "heartbeat_failures": client.heartbeat_failures,
+            "pending": client.dispatcher.pending_count if client.dispatcher else 0,
+        }
+
+    def start_tracing(self, capacity=10000) -> Tracer:
+        """
+        开始记录每个请求各阶段的耗时：serialize、send、wait、receive、deserialize、decode
+        :param capacity: 保留最近的请求数
+        :return: Tracer对象
+        示例:
+        tracer = hdriver.start_tracing()
+        hdriver.find_element_by_text("设置")
+        tracer.export_chrome_trace("trace.json")  # chrome://tracing 或 Perfetto 打开
+        print(tracer.prometheus())               # 按action统计的计数和耗时
+        """
+        self.client.tracer = Tracer(capacity)
+        return self.client.tracer
+
+    def stop_tracing(self):
+        tracer, self.client.tracer = self.client.tracer, None
+        return tracer
+
+    def set_handle_policy(self, max_handles: int = None, ttl_s: float = None):
+        """
+        设置设备端控件句柄的数量上限和未使用过期时间，超出的句柄按最久未使用淘汰
+        :param max_handles: 控件句柄数量上限
+        :param ttl_s: 句柄未使用的过期时间，单位秒，0表示不过期
+        """
+        data = {"action": "handleConfig"}
+        if max_handles is not None:
+            data["max_handles"] = max_handles
+        if ttl_s is not None:
+            data["ttl_s"] = ttl_s
+        resp = self.req(data)
+        return True if resp else False
+
+    def enable_locator_cache(self, trust_s: float = 0.0, max_size: int = 256) -> LocatorCache:
+        """
+        缓存find_element的结果，同一定位条件再次查找时复用之前的控件
+        点击、滑动、返回、回到桌面、按键、启动应用等改变界面的操作之后缓存失效；
+        其他情况下用只获取bounds的请求确认控件仍然存在且位置未变，失败时重新查找
+        :param trust_s: 确认后的这段时间内直接返回缓存的控件，不访问设备，0表示每次都确认
+        :param max_size: 最多缓存的定位条件数，超出时淘汰最久未使用的
+        :return: LocatorCache对象，stats()返回命中统计
+        示例:
+        hdriver.enable_locator_cache()
+        hdriver.find_element_by_id("btn_setting")   # 完整查找
+        hdriver.find_element_by_id("btn_setting")   # 只确认bounds
+        hdriver.back()                               # 缓存失效
+        """
+        self.locator_cache = LocatorCache(self.client, trust_s=trust_s, max_size=max_size)
+        return self.locator_cache
+
+    def disable_locator_cache(self):
+        self.locator_cache = None
+
+    def invalidate_locators(self):
+        """
+        界面发生了客户端无法感知的变化时（例如应用自己跳转页面）手动使缓存失效
+        """
+        self.client.ui_changed()
+
+    def _ensure_events(self, types=None):
+        """
+        确保设备端已推送types中的事件，已订阅的类型保留
+        """
+        types = set(types or UiEventType.all)
+        subscribed = set(self.client.event_types or [])
+        if not types <= subscribed:
+            self.client.subscribe_events(sorted(subscribed | types))
+
+    def on_event(self, callback, types=None):
+        """
+        注册界面变化事件回调，设备端主动推送，不需要轮询
+        :param callback: 参数为UiEvent，在接收线程中调用，不要在回调中发送请求或长时间阻塞
+        :param types: 事件类型列表(UiEventType)，为None时接收全部类型
+        :return: token，用于off_event
+        示例:
+        hdriver.on_event(lambda event: print(event.type, event.data), [UiEventType.toastShow])
+        """
+        token = self.client.events.subscribe(callback, types)
+        self._ensure_events(types)
+        return token
+
+    def off_event(self, token):
+        self.client.events.unsubscribe(token)
+
+    def wait_for_event(self, types=None, predicate=None, timeout: float = 10, since: int = None):
+        """
+        等待设备端推送的事件
+        :param types: 事件类型列表(UiEventType)，为None时等待任意事件
+        :param predicate: 过滤函数，参数为UiEvent
+        :param timeout: 超时时间，单位秒
+        :param since: 只匹配序号大于since的事件，在触发操作之前读取hdriver.client.events.seq传入，
+            避免事件在开始等待之前到达而错过，为None时只等待之后的事件
+        :return: UiEvent，超时返回None
+        示例:
+        seq = hdriver.client.events.seq
+        ele.click()
+        event = hdriver.wait_for_event([UiEventType.windowChange], since=seq)
+        """
+        self._ensure_events(types)
+        return self.client.events.wait_for(types, predicate, timeout, since)
+
+    def wait_for_bundle(self, bundle: str, timeout: float = 10):
+        """
+        等待焦点窗口切换到bundle应用
+        :return: 成功返回True，超时返回False
+        """
+        self._ensure_events([UiEventType.windowChange])
+        since = self.client.events.seq
+        if self.get_current_bundle() == bundle:
+            return True
+
+        def is_bundle(event: UiEvent):
+            return ((event.get("current") or {}).get("bundleName")) == bundle
+
+        return self.wait_for_event([UiEventType.windowChange], is_bundle, timeout, since) is not None
+
+    def start_app(self, package, ability):
+        super(HMDriver, self).start_app(package, ability)
+        if self.client:
+            self.client.ui_changed()
+
+    def stop_app(self, package):
+        super(HMDriver, self).stop_app(package)
+        if self.client:
+            self.client.ui_changed()
+
     def find_window_by_title(self, title: str):
         """
         通过title查找窗口，返回窗口对象
@@ -267,7 +651,7 @@ class HMDriver(HDC):
         :param y: 纵坐标
         :return: 点击成功返回True，否则返回False
         """
-        resp = self.req({"action": "click", "x": str(x), "y": str(y)})
+        resp = self.req({"action": "click", "x": x, "y": y})
         return True if resp else False
 
     def double_click(self, x, y):
@@ -277,7 +661,7 @@ class HMDriver(HDC):
         :param y: 纵坐标
         :return: 点击成功返回True，否则返回False
         """
-        resp = self.req({"action": "doubleClick", "x": str(x), "y": str(y)})
+        resp = self.req({"action": "doubleClick", "x": x, "y": y})
         return True if resp else False
 
     def long_click(self, x, y):
@@ -287,7 +671,7 @@ class HMDriver(HDC):
         :param y: 纵坐标
         :return: 点击成功返回True，否则返回False
         """
-        resp = self.req({"action": "longClick", "x": str(x), "y": str(y)})
+        resp = self.req({"action": "longClick", "x": x, "y": y})
         return True if resp else False
 
     def swipe(self, startx, starty, endx, endy, time_s=1):
@@ -305,12 +689,12 @@ class HMDriver(HDC):
         speed = 600 if speed < 200 else (600 if speed > 40000 else speed)
         data = {
             "action": "swipe",
-            "startx": str(int(startx)),
-            "starty": str(int(starty)),
-            "endx": str(int(endx)),
-            "endy": str(int(endy)),
-            "speed": str(speed),
-            "time_s": str(time_s)
+            "startx": int(startx),
+            "starty": int(starty),
+            "endx": int(endx),
+            "endy": int(endy),
+            "speed": speed,
+            "time_s": time_s
         }
         resp = self.req(data)
         return True if resp else False
@@ -330,12 +714,12 @@ class HMDriver(HDC):
         speed = 600 if speed < 200 else (600 if speed > 40000 else speed)
         data = {
             "action": "drag",
-            "startx": str(int(startx)),
-            "starty": str(int(starty)),
-            "endx": str(int(endx)),
-            "endy": str(int(endy)),
-            "speed": str(speed),
-            "time_s": str(time_s)
+            "startx": int(startx),
+            "starty": int(starty),
+            "endx": int(endx),
+            "endy": int(endy),
+            "speed": speed,
+            "time_s": time_s
         }
         resp = self.req(data)
         return True if resp else False
@@ -357,6 +741,36 @@ class HMDriver(HDC):
         resp = self.req(data)
         return True if resp else False
 
+    def gesture(self) -> Gesture:
+        """
+        构造多指、多段路径手势，perform()时一次请求发送到设备端，用PointerMatrix注入
+        示例:
+        # 双指放大后沿曲线滑动
+        hdriver.gesture().pinch((540, 1200), 200, 600).curve((200, 1500), (900, 1000), (300, 400)).perform()
+        """
+        return Gesture(self)
+
+    def perform_gesture(self, gesture: Gesture):
+        """
+        执行手势
+        :param gesture: Gesture对象
+        :return: 成功返回True，否则返回False
+        """
+        resp = self.req(gesture.to_message())
+        return True if resp else False
+
+    def monkey(self, duration_s, seed=None, weights=None, bundle_whitelist=None, **kwargs) -> MonkeyReport:
+        """
+        随机压力测试，随机事件按批次一次请求发送到设备端连续注入
+        :param duration_s: 运行时长，单位秒
+        :param seed: 随机种子，相同的seed生成相同的事件序列，为None时随机生成
+        :param weights: 事件类型到权重的字典，如{"click": 60, "swipe": 30, "back": 10}
+        :param bundle_whitelist: 允许停留的应用包名，默认app_bundle，离开时重新拉起应用
+        :param kwargs: 其他参数见Monkey，如batch_size、throttle_ms、region、log_path
+        :return: MonkeyReport，包含每秒事件数、崩溃日志和每批事件的seed
+        """
+        return Monkey(self, seed, weights, bundle_whitelist, **kwargs).run(duration_s)
+
     def fling_left(self):
         """
         快速向左滑动屏幕
@@ -458,35 +872,133 @@ class HMDriver(HDC):
     def get_current_bundle(self):
         return self.req({"action": "currentBundle"})["data"]
 
-    def _get_screenshot_file(self, local_path=None):
-        remote_path = "/data/local/tmp/aa.png"
-        cap_cmd = f'hdc -t {self.device_id} shell "rm -rf {remote_path};sync;uitest screenCap -p {remote_path};sync"'
-        cap_ret = os.popen(cap_cmd).read().strip()
-        if not cap_ret.startswith("ScreenCap saved to"):
-            raise Exception(f"screen shot failed! {cap_ret}")
-        if not local_path:
-            local_path = "aa.png"
-        cmd = f"hdc -t {self.device_id} file recv {remote_path} {local_path}"
-        # logging.info(f"recv: {cmd}")
-        os.popen(cmd).read()
-        st = time.time()
-        while time.time() - st < 5 and not os.path.exists(local_path):
-            time.sleep(0.1)
-        os.sync()
-        # 远程删除
-        cmd = f"hdc -t {self.device_id} shell rm -rf {remote_path}"
-        os.popen(cmd).read()
-        return local_path
-
-    def get_screenshot_png(self, local_path=None):
-        png_path = self._get_screenshot_file(local_path)
-        if not local_path:
-            with open(png_path, "rb") as ff:
-                png_bytes = ff.read()
-            # 本地删除
-            os.remove(png_path)
-            return png_bytes
-        return png_path
+    def get_screenshot_png(self, local_path=None, region=None):
+        """
+        截图，图片数据直接读到内存，不经过临时文件
+        :param local_path: 不为空则保存到该路径并返回路径，为空则返回截图的二进制数据
+        :param region: 只截取该区域，(left, top, right, bottom)或Element.bounds，由设备端截取，图片更小
+        """
+        png_bytes = self.screen_cap() if region is None else self.capture_region(region)
+        if local_path:
+            with open(local_path, "wb") as ff:
+                ff.write(png_bytes)
+            return local_path
+        return png_bytes
+
+    def capture_region(self, region) -> bytes:
+        """
+        由设备端截取屏幕区域，msgpack连接直接传输二进制，json连接使用base64
+        :param region: (left, top, right, bottom)或Element.bounds
+        :return: png数据
+        """
+        left, top, right, bottom = as_region(region)
+        binary = self.client.dispatcher is not None and self.client.dispatcher.encoding == "msgpack"
+        resp = self.req({"action": "screenCapture", "rect": {"left": left, "top": top, "right": right, "bottom": bottom},
+                         "binary": binary})
+        if not resp:
+            raise HDriverError(f"screen capture failed: {region}")
+        data = resp["data"]
+        return data if isinstance(data, bytes) else base64.b64decode(data)
+
+    def find_image(self, template, threshold: float = 0.9, region=None, screenshot=None):
+        """
+        在屏幕截图中查找模板图片，用于XComponent、Canvas等find_element找不到控件的界面，需要安装numpy和Pillow
+        截图与点击使用相同的屏幕坐标；后台截图已启动时使用最新一帧，不再单独截图
+        :param template: 模板图片，文件路径、png/jpg二进制数据、PIL图片或numpy数组
+        :param threshold: 归一化互相关的最低得分，0~1
+        :param region: 只在该区域内查找，(left, top, right, bottom)或bounds字典
+        :param screenshot: 截图png数据，为None时获取当前屏幕，与后台截图一样必须是全屏截图
+        :return: ImageMatch对象，center为中心坐标，bounds为匹配区域，score为得分；找不到返回None
+        示例:
+        match = hdriver.find_image("start_button.png", threshold=0.85)
+        if match:
+            hdriver.click(*match.center)
+        """
+        region = as_region(region)
+        offset_x, offset_y = 0, 0
+        if screenshot is None:
+            frame = self.screen_stream.latest() if self.screen_stream else None
+            stream_region = self.screen_stream.region if frame is not None else None
+            if stream_region is not None:
+                # 后台截图只截取了一部分屏幕，完全包含查找区域时才使用，坐标换算到截取区域内
+                if region is None or not (stream_region[0] <= region[0] and stream_region[1] <= region[1]
+                                          and region[2] <= stream_region[2] and region[3] <= stream_region[3]):
+                    frame = None
+                else:
+                    offset_x, offset_y = stream_region[:2]
+                    region = (region[0] - offset_x, region[1] - offset_y, region[2] - offset_x, region[3] - offset_y)
+            screenshot = bytes(frame.data) if frame is not None else self.get_screenshot_png()
+        match = self.image_matcher.find(screenshot, template, threshold, region)
+        if match is None or not (offset_x or offset_y):
+            return match
+        bounds = match.bounds
+        return ImageMatch(match.score, bounds["left"] + offset_x, bounds["top"] + offset_y,
+                          bounds["right"] - bounds["left"], bounds["bottom"] - bounds["top"])
+
+    def dump_hierarchy(self) -> Hierarchy:
+        """
+        一次获取当前界面的完整控件树，之后的查询在本地完成，不再访问设备
+        :return: Hierarchy对象
+        示例:
+        tree = hdriver.dump_hierarchy()
+        node = tree.find(ElementBy.text, "确定", {ElementBy.type: ElementType.Button})
+        buttons = tree.find_all(ElementBy.type, ElementType.Button)
+        nodes = tree.at(500, 800)            # 包含该坐标的控件，由浅到深
+        hdriver.click(*node.center)
+        """
+        return Hierarchy.from_json(self.dump_layout())
+
+    def start_screen_stream(self, fps=2.0, capacity=8, region=None):
+        """
+        后台持续截图，最近capacity帧保存在预分配的环形缓冲区中，缓冲区满时丢弃最旧的帧
+        全屏截图使用独立的hdc shell通道，不阻塞控件操作
+        :param fps: 截图帧率
+        :param capacity: 缓存的帧数
+        :param region: 只截取该区域，(left, top, right, bottom)或Element.bounds，由设备端截取
+        :return: ScreenStream对象
+        示例:
+        stream = hdriver.start_screen_stream(fps=5)
+        frame = stream.latest()              # frame.data为memoryview，不拷贝
+        stream.wait_until_stable(stable_s=1) # 等待屏幕1秒内不再变化
+        hdriver.stop_screen_stream()
+        """
+        self.stop_screen_stream()
+        capture = None
+        if region is not None:
+            region = as_region(region)
+            capture = lambda: self.capture_region(region)
+        self.screen_stream = ScreenStream(self.device_id, fps=fps, capacity=capacity, capture=capture,
+                                          region=region).start()
+        return self.screen_stream
+
+    def screen_changed_since(self, frame_id, region=None, tile_size=32, tolerance=8.0):
+        """
+        比较后台截图的最新一帧与frame_id帧，按缩小后的区块比较，不需要完整解码比较
+        :param frame_id: 之前的帧号，Frame.frame_id
+        :param region: 只比较该区域，(left, top, right, bottom)或Element.bounds
+        :param tile_size: 区块边长，单位像素
+        :param tolerance: 区块内灰度差小于该值视为未变化，0~255
+        :return: 变化的区块bounds列表，未变化返回空列表，frame_id帧已被覆盖时返回None
+        示例:
+        stream = hdriver.start_screen_stream(fps=5)
+        frame_id = stream.latest().frame_id
+        ...
+        if hdriver.screen_changed_since(frame_id, region=card.bounds):
+            ...
+        # 等待加载动画停止
+        stream.wait_until_stable(stable_s=1, region=spinner.bounds)
+        """
+        if self.screen_stream is None:
+            raise HDriverError("screen stream is not started, call start_screen_stream first")
+        return self.screen_stream.screen_changed_since(frame_id, region, tile_size, tolerance)
+
+    def stop_screen_stream(self):
+        """
+        停止后台截图
+        """
+        if self.screen_stream:
+            self.screen_stream.stop()
+            self.screen_stream = None
 
 
 if __name__ == "__main__":
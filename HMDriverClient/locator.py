@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from HMDriverClient.element import ElementAttribute
+
+
+class LocatorEntry(object):
+    __slots__ = ("element", "generation", "validated_at", "bounds")
+
+    def __init__(self, element, generation, validated_at, bounds):
+        self.element = element
+        self.generation = generation
+        self.validated_at = validated_at
+        self.bounds = bounds
+
+
+class LocatorCache(object):
+    """
+    maps locators (by, data, params, fields) to the elements found for them.
+    an entry is dropped as soon as client.ui_generation changes (click, back, home, swipe, start_app ...),
+    otherwise it is revalidated with a bounds-only get, or trusted without a round trip for trust_s seconds
+    after the last validation
+    """
+
+    def __init__(self, client, trust_s=0.0, max_size=256):
+        self.client = client
+        self.trust_s = trust_s
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.stale = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(by, data, params=None, fields=None):
+        params_key = tuple(sorted((str(kk), repr(vv)) for kk, vv in params.items())) if params else ()
+        return by, repr(data), params_key, tuple(fields) if fields else ()
+
+    def generation(self):
+        return self.client.ui_generation
+
+    def _drop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        self.stale += 1
+
+    def lookup(self, key):
+        """
+        :return: the cached element if it is still valid, otherwise None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.generation != self.client.ui_generation or entry.element._released:
+            self._drop(key)
+            return None
+        if time.monotonic() - entry.validated_at <= self.trust_s:
+            self.hits += 1
+            return entry.element
+        try:
+            bounds = entry.element.get_properties([ElementAttribute.bounds]).get(ElementAttribute.bounds)
+        except Exception as e:
+            # 句柄已释放或过期，控件不存在
+            logging.debug("locator revalidation failed: %s", e)
+            bounds = None
+        # 位置变化时重新查找，同一定位条件可能已经对应另一个控件
+        if bounds is None or bounds != entry.bounds or entry.generation != self.client.ui_generation:
+            self._drop(key)
+            return None
+        entry.validated_at = time.monotonic()
+        self.revalidated += 1
+        return entry.element
+
+    def store(self, key, element, generation):
+        """
+        :param generation: client.ui_generation read before the find request was sent
+        """
+        if element is None or generation != self.client.ui_generation:
+            return
+        bounds = (element._property or {}).get(ElementAttribute.bounds)
+        if bounds is None:
+            try:
+                bounds = element.get_properties([ElementAttribute.bounds]).get(ElementAttribute.bounds)
+            except Exception:
+                return
+        with self._lock:
+            self._entries[key] = LocatorEntry(element, generation, time.monotonic(), bounds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {"size": len(self._entries), "hits": self.hits, "revalidated": self.revalidated,
+                "misses": self.misses, "stale": self.stale}
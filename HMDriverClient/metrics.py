@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import threading
+
+
+class LatencyHistogram(object):
+    """
+    HDR-style log-linear histogram of latencies in microseconds.
+    values below 2 * 2**sub_bucket_bits are exact, larger values keep sub_bucket_bits of precision
+    (about 0.8% with the default of 7), recording and percentile queries cost O(1) and O(buckets)
+    """
+
+    def __init__(self, max_value_s=60.0, sub_bucket_bits=7):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.max_value_us = int(max_value_s * 1000000)
+        self._counts = [0] * (self._index(self.max_value_us) + 1)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total_us = 0
+        self.min_us = None
+        self.max_us = None
+
+    def _index(self, value_us):
+        if value_us < 2 * self.sub_bucket_count:
+            return value_us
+        shift = value_us.bit_length() - self.sub_bucket_bits - 1
+        return shift * self.sub_bucket_count + (value_us >> shift)
+
+    def _value(self, index):
+        """
+        middle of the value range of a bucket
+        """
+        if index < 2 * self.sub_bucket_count:
+            return index
+        shift = index // self.sub_bucket_count - 1
+        mantissa = index - shift * self.sub_bucket_count
+        return (mantissa << shift) + (1 << shift) // 2
+
+    def record(self, seconds):
+        value_us = min(max(int(seconds * 1000000), 0), self.max_value_us)
+        with self._lock:
+            self._counts[self._index(value_us)] += 1
+            self.count += 1
+            self.total_us += value_us
+            self.min_us = value_us if self.min_us is None else min(self.min_us, value_us)
+            self.max_us = value_us if self.max_us is None else max(self.max_us, value_us)
+
+    def percentile(self, percent):
+        """
+        :param percent: 0~100
+        :return: latency in seconds, None if nothing was recorded
+        """
+        with self._lock:
+            if self.count == 0:
+                return None
+            target = max(1, int(round(self.count * percent / 100.0)))
+            seen = 0
+            for index, count in enumerate(self._counts):
+                seen += count
+                if seen >= target:
+                    return min(max(self._value(index), self.min_us), self.max_us) / 1000000
+        return self.max_us / 1000000
+
+    def mean(self):
+        with self._lock:
+            return self.total_us / self.count / 1000000 if self.count else None
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * len(self._counts)
+            self.count = 0
+            self.total_us = 0
+            self.min_us = None
+            self.max_us = None
+
+    def summary(self):
+        """
+        :return: dict of count and p50/p90/p99/max in milliseconds
+        """
+        ms = lambda value: None if value is None else round(value * 1000, 3)
+        return {
+            "count": self.count,
+            "p50_ms": ms(self.percentile(50)),
+            "p90_ms": ms(self.percentile(90)),
+            "p99_ms": ms(self.percentile(99)),
+            "max_ms": ms(None if self.max_us is None else self.max_us / 1000000),
+        }
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import random
+import re
+import time
+
+from HMDriverClient.exception import *
+from HMDriverClient.vision import as_region
+
+# 设备端崩溃日志目录，cppcrash、jscrash、appfreeze日志的文件名中包含应用包名
+FAULTLOG_DIR = "/data/log/faultlog/faultlogger/"
+FAULTLOG_PATTERN = re.compile(r"^(cppcrash|jscrash|appfreeze|sysfreeze)-")
+
+
+class MonkeyEvent:
+    click = "click"
+    doubleClick = "doubleClick"
+    longClick = "longClick"
+    swipe = "swipe"
+    back = "back"
+    home = "home"
+
+
+# 事件在设备端的紧凑编码：[类型, 参数...]
+_CODES = {MonkeyEvent.click: "c", MonkeyEvent.doubleClick: "d", MonkeyEvent.longClick: "l",
+          MonkeyEvent.swipe: "s", MonkeyEvent.back: "b", MonkeyEvent.home: "h"}
+
+# 还没有设备端实测耗时时，每个事件的预估注入时间，单位秒
+EVENT_ESTIMATE_S = 0.05
+
+DEFAULT_WEIGHTS = {MonkeyEvent.click: 55, MonkeyEvent.swipe: 25, MonkeyEvent.doubleClick: 5,
+                   MonkeyEvent.longClick: 5, MonkeyEvent.back: 10, MonkeyEvent.home: 0}
+
+
+def generate_events(seed, count, region, weights=None, swipe_speed=(2000, 8000)):
+    """
+    用seed生成count个随机事件，相同的参数总是生成相同的事件
+    :param region: (left, top, right, bottom)，事件坐标的范围
+    :param weights: 事件类型到权重的字典，默认DEFAULT_WEIGHTS
+    :return: 设备端monkey请求的events列表
+    """
+    weights = {name: weight for name, weight in (weights or DEFAULT_WEIGHTS).items() if weight > 0}
+    unknown = set(weights) - set(_CODES)
+    if unknown:
+        raise HDriverError(f"unknown monkey events: {sorted(unknown)}")
+    if not weights:
+        raise HDriverError("monkey weights are all zero")
+    names, cumulative = list(weights), []
+    total = 0
+    for name in names:
+        total += weights[name]
+        cumulative.append(total)
+    left, top, right, bottom = region
+    rng = random.Random(seed)
+    events = []
+    for name in rng.choices(names, cum_weights=cumulative, k=count):
+        code = _CODES[name]
+        if name == MonkeyEvent.swipe:
+            events.append([code, rng.randrange(left, right), rng.randrange(top, bottom),
+                           rng.randrange(left, right), rng.randrange(top, bottom), rng.randint(*swipe_speed)])
+        elif name in (MonkeyEvent.back, MonkeyEvent.home):
+            events.append([code])
+        else:
+            events.append([code, rng.randrange(left, right), rng.randrange(top, bottom)])
+    return events
+
+
+class MonkeyReport(object):
+    """
+    一次monkey测试的结果，seed_log中每一批事件的seed可以用replay重放
+    """
+
+    def __init__(self, seed):
+        self.seed = seed
+        self.events = 0
+        self.errors = 0
+        self.batches = 0
+        self.elapsed_s = 0.0
+        # 每批一条：{"batch", "seed", "count", "executed", "bundle"}
+        self.seed_log = []
+        # 新出现的崩溃日志文件名
+        self.crashes = []
+        # 离开白名单后重新拉起应用的次数
+        self.restarts = 0
+
+    @property
+    def events_per_second(self) -> float:
+        return self.events / self.elapsed_s if self.elapsed_s > 0 else 0.0
+
+    def __repr__(self):
+        return (f"<MonkeyReport(seed={self.seed}, events={self.events}, batches={self.batches}, "
+                f"events_per_second={self.events_per_second:.1f}, crashes={len(self.crashes)}, "
+                f"restarts={self.restarts})>")
+
+    def to_dict(self) -> dict:
+        return {"seed": self.seed, "events": self.events, "errors": self.errors, "batches": self.batches,
+                "elapsed_s": round(self.elapsed_s, 3), "events_per_second": round(self.events_per_second, 1),
+                "crashes": self.crashes, "restarts": self.restarts, "seed_log": self.seed_log}
+
+
+class Monkey(object):
+    """
+    随机压力测试：客户端用seed预先生成一批随机事件，一次请求发送到设备端连续注入，不等待界面空闲，
+    设备端每隔check_every个事件检查前台应用，离开白名单时提前结束这一批，客户端重新拉起应用
+    示例:
+    report = hdriver.monkey(600, seed=42, bundle_whitelist=["com.example.app"])
+    print(report.events_per_second, report.crashes)
+    """
+
+    def __init__(self, driver, seed=None, weights=None, bundle_whitelist=None, region=None, batch_size=200,
+                 throttle_ms=0, check_every=20, crash_check_interval_s=10.0, log_path=None):
+        """
+        :param driver: HMDriver
+        :param seed: 随机种子，为None时随机生成，记录在报告中
+        :param weights: 事件类型到权重的字典，见MonkeyEvent，默认DEFAULT_WEIGHTS
+        :param bundle_whitelist: 允许停留的应用包名，为空时使用driver.app_bundle，都为空时不检查前台应用
+        :param region: 事件坐标范围，(left, top, right, bottom)或bounds字典，默认全屏
+        :param batch_size: 每次请求的事件数
+        :param throttle_ms: 设备端相邻两个事件之间的间隔，单位毫秒
+        :param check_every: 设备端每隔多少个事件检查一次前台应用
+        :param crash_check_interval_s: 检查崩溃日志的间隔，离开白名单时也会检查
+        :param log_path: 不为空时每批事件的seed按json行追加写入该文件
+        """
+        self.driver = driver
+        self.seed = seed if seed is not None else random.getrandbits(32)
+        self.weights = weights
+        whitelist = bundle_whitelist or ([driver.app_bundle] if driver.app_bundle else [])
+        self.bundle_whitelist = list(whitelist)
+        self.region = as_region(region)
+        self.batch_size = batch_size
+        self.throttle_ms = throttle_ms
+        self.check_every = check_every
+        self.crash_check_interval_s = crash_check_interval_s
+        self.log_path = log_path
+        self._faultlogs = None
+        # 设备端实测的每个事件耗时（含throttle_ms），用于按剩余时间确定批次大小
+        self.event_s = EVENT_ESTIMATE_S + throttle_ms / 1000
+
+    def _screen_region(self):
+        if self.region is not None:
+            return self.region
+        size = self.driver.get_screen_size()
+        return 0, 0, size["width"], size["height"]
+
+    def list_faultlogs(self):
+        """
+        :return: 设备端崩溃日志中属于白名单应用的文件名集合，白名单为空时返回所有崩溃日志
+        """
+        out = self.driver.hdc.run_cmd(f"shell ls {FAULTLOG_DIR}")
+        names = set()
+        for name in out.split():
+            if not FAULTLOG_PATTERN.match(name):
+                continue
+            if not self.bundle_whitelist or any(bundle in name for bundle in self.bundle_whitelist):
+                names.add(name)
+        return names
+
+    def check_crashes(self, report: MonkeyReport):
+        """
+        与开始时的崩溃日志比较，新出现的文件记入报告
+        """
+        try:
+            current = self.list_faultlogs()
+        except Exception as e:
+            logging.warning(f"list faultlog failed: {e}")
+            return []
+        if self._faultlogs is None:
+            self._faultlogs = current
+            return []
+        new = sorted(current - self._faultlogs)
+        self._faultlogs |= current
+        for name in new:
+            logging.error(f"monkey found crash log: {name}")
+        report.crashes.extend(new)
+        return new
+
+    def pin(self, report: MonkeyReport, bundle):
+        """
+        前台应用不在白名单时重新拉起driver.app_bundle，没有配置启动信息时按返回键，
+        设备端取不到前台应用时bundle为空，不做处理
+        """
+        if not bundle or not self.bundle_whitelist or bundle in self.bundle_whitelist:
+            return
+        logging.warning(f"monkey left the whitelist at {bundle}, seed={report.seed} batch={report.batches}")
+        self.check_crashes(report)
+        report.restarts += 1
+        if self.driver.app_bundle in self.bundle_whitelist and self.driver.app_ability:
+            self.driver.start_app(self.driver.app_bundle, self.driver.app_ability)
+        else:
+            self.driver.back()
+
+    def _send(self, events, deadline_s=None):
+        """
+        :param deadline_s: 设备端注入的最长时间，到时后不再注入剩余事件，为None时不限制
+        """
+        # 超时按每个事件最多1秒加上间隔计算，长按和慢速滑动也不会误判超时，有deadline时最多再多一个事件
+        event_max_s = 1 + self.throttle_ms / 1000
+        time_s = len(events) * event_max_s
+        data = {"action": "monkey", "events": events, "throttle_ms": self.throttle_ms,
+                "check_every": self.check_every if self.bundle_whitelist else 0,
+                "whitelist": self.bundle_whitelist}
+        if deadline_s is not None:
+            data["deadline_ms"] = max(int(deadline_s * 1000), 1)
+            time_s = min(time_s, deadline_s + event_max_s)
+        data["time_s"] = time_s
+        resp = self.driver.req(data)
+        if not resp:
+            raise HDriverError("monkey request failed")
+        result = resp["data"]
+        if result["executed"] and result.get("elapsed_ms"):
+            self.event_s = result["elapsed_ms"] / 1000 / result["executed"]
+        return result
+
+    def _log(self, entry):
+        if self.log_path:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def run_events(self, report: MonkeyReport, batch_seed, region, count=None, limit=None, deadline_s=None):
+        """
+        生成并发送一批事件
+        :param limit: 只发送前limit个事件，重放提前结束的批次时使用
+        :param deadline_s: 设备端注入这一批的最长时间
+        """
+        count = count or self.batch_size
+        events = generate_events(batch_seed, count, region, self.weights)[:limit]
+        result = self._send(events, deadline_s)
+        entry = {"batch": report.batches, "seed": batch_seed, "count": count,
+                 "executed": result["executed"], "bundle": result.get("bundle")}
+        report.seed_log.append(entry)
+        report.events += result["executed"]
+        report.errors += result.get("errors", 0)
+        self._log(entry)
+        self.pin(report, result.get("bundle"))
+        report.batches += 1
+        return entry
+
+    def run(self, duration_s=None, events=None) -> MonkeyReport:
+        """
+        :param duration_s: 运行时长，单位秒
+        :param events: 事件总数，与duration_s同时指定时先到者结束
+        """
+        if duration_s is None and events is None:
+            raise HDriverError("monkey needs duration_s or events")
+        report = MonkeyReport(self.seed)
+        self._log({"seed": self.seed, "weights": self.weights or DEFAULT_WEIGHTS, "whitelist": self.bundle_whitelist})
+        rng = random.Random(self.seed)
+        region = self._screen_region()
+        self.check_crashes(report)
+        start = time.monotonic()
+        last_crash_check = start
+        try:
+            while True:
+                now = time.monotonic()
+                if duration_s is not None and now - start >= duration_s:
+                    break
+                if events is not None and report.events >= events:
+                    break
+                count = self.batch_size if events is None else min(self.batch_size, events - report.events)
+                deadline_s = None
+                if duration_s is not None:
+                    # 按剩余时间和实测的事件耗时确定批次大小，设备端到deadline时提前结束，不会超出运行时长
+                    deadline_s = duration_s - (now - start)
+                    count = max(min(count, int(deadline_s / self.event_s)), 1)
+                self.run_events(report, rng.getrandbits(32), region, count, deadline_s=deadline_s)
+                if time.monotonic() - last_crash_check >= self.crash_check_interval_s:
+                    self.check_crashes(report)
+                    last_crash_check = time.monotonic()
+        finally:
+            report.elapsed_s = time.monotonic() - start
+            self.check_crashes(report)
+            self._log({"report": {key: value for key, value in report.to_dict().items() if key != "seed_log"}})
+        return report
+
+    def replay(self, seed_log, region=None) -> MonkeyReport:
+        """
+        按seed_log重放，与原来的测试注入相同的事件序列，提前结束的批次只重放已执行的事件，
+        weights和region需要与原来的测试相同
+        :param seed_log: MonkeyReport.seed_log或log_path文件中的批次记录
+        """
+        report = MonkeyReport(self.seed)
+        region = as_region(region) or self._screen_region()
+        self.check_crashes(report)
+        start = time.monotonic()
+        try:
+            for entry in seed_log:
+                if "batch" in entry and entry["executed"]:
+                    self.run_events(report, entry["seed"], region, entry["count"], entry["executed"])
+        finally:
+            report.elapsed_s = time.monotonic() - start
+            self.check_crashes(report)
+        return report
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager
+
+from HMDriverClient.hdcstd import list_targets
+from HMDriverClient.hmdriver import HMDriver
+
+
+class DevicePool(object):
+    """
+    one HMDriver per connected device, each with its own test runner and an automatically
+    allocated local port. drivers are handed out to worker threads, one thread per device at a time
+    示例:
+    with DevicePool() as pool:
+        results = pool.map(lambda hdriver, case: case.run(hdriver), cases)
+    """
+
+    def __init__(self, device_ids=None, app_bundle: str = "", app_ability: str = "", driver_factory=None):
+        """
+        :param device_ids: 设备列表，为空时使用hdc list targets发现的所有设备
+        :param driver_factory: 创建driver的函数，参数为device_id，默认创建HMDriver
+        """
+        self.device_ids = list(device_ids) if device_ids else None
+        self.app_bundle = app_bundle
+        self.app_ability = app_ability
+        self.driver_factory = driver_factory or self._create_driver
+        self.drivers = {}
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def __len__(self):
+        return len(self.drivers)
+
+    def _create_driver(self, device_id):
+        return HMDriver(device_id, self.app_bundle, self.app_ability)
+
+    def start(self):
+        """
+        并行创建所有设备的driver，安装和启动runner失败的设备被跳过
+        """
+        device_ids = self.device_ids if self.device_ids is not None else list_targets()
+        device_ids = [device_id for device_id in device_ids if device_id not in self.drivers]
+        if not device_ids:
+            return self
+        with ThreadPoolExecutor(max_workers=len(device_ids)) as executor:
+            futures = {device_id: executor.submit(self.driver_factory, device_id) for device_id in device_ids}
+        for device_id, future in futures.items():
+            try:
+                driver = future.result()
+            except Exception as e:
+                logging.error(f"start driver for {device_id} failed: {e}")
+                continue
+            with self._lock:
+                self.drivers[device_id] = driver
+            self._idle.put(driver)
+        return self
+
+    def stop(self):
+        with self._lock:
+            drivers, self.drivers = list(self.drivers.values()), {}
+        self._idle = queue.Queue()
+        for driver in drivers:
+            try:
+                driver.stop()
+            except Exception as e:
+                logging.error(f"stop driver failed: {e}")
+
+    def acquire(self, timeout=None) -> HMDriver:
+        """
+        取出一个空闲的driver，用完后需要release
+        :param timeout: 等待空闲driver的超时时间，None表示一直等待
+        """
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"no idle device after {timeout} seconds")
+
+    def release(self, driver: HMDriver):
+        if driver.device_id in self.drivers:
+            self._idle.put(driver)
+
+    @contextmanager
+    def driver(self, timeout=None):
+        """
+        with pool.driver() as hdriver:
+            hdriver.click(100, 200)
+        """
+        driver = self.acquire(timeout)
+        try:
+            yield driver
+        finally:
+            self.release(driver)
+
+    def map(self, func, items=None):
+        """
+        每台设备一个工作线程，并行执行func
+        :param func: items为空时调用func(driver)，每台设备执行一次；否则调用func(driver, item)，item被分配给空闲的设备
+        :param items: 任务列表
+        :return: 结果列表，与items顺序一致（items为空时与drivers顺序一致），失败的任务对应异常对象
+        """
+        if items is None:
+            drivers = list(self.drivers.values())
+            with ThreadPoolExecutor(max_workers=max(len(drivers), 1)) as executor:
+                futures = [executor.submit(func, driver) for driver in drivers]
+            return [self._result(future) for future in futures]
+        items = list(items)
+
+        def run(item):
+            with self.driver() as driver:
+                return func(driver, item)
+
+        with ThreadPoolExecutor(max_workers=max(len(self.drivers), 1)) as executor:
+            futures = [executor.submit(run, item) for item in items]
+        return [self._result(future) for future in futures]
+
+    @staticmethod
+    def _result(future):
+        try:
+            return future.result()
+        except Exception as e:
+            logging.error(f"device task failed: {e}")
+            return e
+
+
+def _process_worker(device_id, app_bundle, app_ability, func):
+    driver = HMDriver(device_id, app_bundle, app_ability)
+    try:
+        return func(driver)
+    finally:
+        driver.stop()
+
+
+def process_map(func, device_ids=None, app_bundle: str = "", app_ability: str = ""):
+    """
+    每台设备一个子进程，子进程内创建自己的HMDriver并调用func(driver)，适合CPU密集的用例
+    :param func: 可被pickle的模块级函数
+    :param device_ids: 设备列表，为空时使用hdc list targets发现的所有设备
+    :return: 结果列表，与device_ids顺序一致，失败的设备对应异常对象
+    """
+    device_ids = list(device_ids) if device_ids else list_targets()
+    if not device_ids:
+        return []
+    with ProcessPoolExecutor(max_workers=len(device_ids)) as executor:
+        futures = [executor.submit(_process_worker, device_id, app_bundle, app_ability, func)
+                   for device_id in device_ids]
+    return [DevicePool._result(future) for future in futures]
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import re
+import socket
+import struct
+import time
+import zipfile
+
+from HMDriverClient.exception import *
+
+# 可选的更快的json解析库和msgpack编码，未安装时使用标准库json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+if orjson is not None:
+    loads = orjson.loads
+elif msgspec is not None:
+    loads = msgspec.json.decode
+else:
+    loads = json.loads
+
+
+def _json_dumps(msg) -> bytes:
+    return json.dumps(msg).encode("utf8")
+
+
+# 编码名 -> (序列化, 反序列化)
+CODECS = {"json": (_json_dumps, loads)}
+if msgpack is not None:
+    CODECS["msgpack"] = (lambda msg: msgpack.packb(msg, use_bin_type=True),
+                         lambda payload: msgpack.unpackb(payload, raw=False))
+elif msgspec is not None:
+    CODECS["msgpack"] = (msgspec.msgpack.encode, msgspec.msgpack.decode)
+# hello握手时按顺序提供给设备端选择
+ENCODINGS = [name for name in ("msgpack", "json") if name in CODECS]
+
+# 帧格式: 4字节大端序payload长度 + payload(utf8编码的json)
+FRAME_HEADER = struct.Struct(">I")
+FRAME_HEADER_SIZE = FRAME_HEADER.size
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+# 客户端要求的设备端协议版本，设备端在hello回复中返回自己的版本，修改消息格式或新增action时加1
+PROTOCOL_VERSION = 1
+# hello回复的最大长度，超过时说明设备端没有按帧格式回复
+MAX_HELLO_SIZE = 4096
+UPGRADE_HINT = "the UiTestAPP installed on the device is older than this client, " \
+               "rebuild the haps with `python UiTestAPP/build_haps.py`"
+# 设备端编译进modules.abc的协议标记，"HMDriverProtocol/<版本>"
+PROTOCOL_MARKER = re.compile(rb"HMDriverProtocol/(\d+)")
+
+
+def pack_frame(payload: bytes) -> bytes:
+    """
+    add the length header to a payload
+    :param payload: encoded message
+    :return: bytes ready to be sent on the socket
+    """
+    if len(payload) > MAX_FRAME_SIZE:
+        raise HDriverError(f"frame too large: {len(payload)} bytes")
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+class FrameReader(object):
+    """
+    buffered reader of length-prefixed frames.
+    bytes received after the end of a frame are kept for the next read_frame call,
+    so several replies landing in one recv are split correctly.
+    """
+
+    def __init__(self, sock, chunk_size=65536):
+        self.sock = sock
+        self.chunk_size = chunk_size
+        self._buffer = bytearray()
+        # 正在接收的大帧，recv超时后下次调用继续接收
+        self._payload = None
+        self._got = 0
+        # 当前帧第一个字节到达的时间(time.perf_counter)，用于请求追踪
+        self.frame_start = 0.0
+        self._fill_time = 0.0
+
+    def _fill(self):
+        chunk = self.sock.recv(self.chunk_size)
+        if not chunk:
+            raise SocketError("socket closed by peer")
+        self._fill_time = time.perf_counter()
+        self._buffer += chunk
+
+    def read_frame(self) -> bytes:
+        """
+        block until a whole frame is received
+        :return: payload of the frame
+        """
+        if self._payload is None:
+            if not self._buffer:
+                self._fill()
+            self.frame_start = self._fill_time
+            while len(self._buffer) < FRAME_HEADER_SIZE:
+                self._fill()
+            size = FRAME_HEADER.unpack_from(self._buffer)[0]
+            if size > MAX_FRAME_SIZE:
+                raise SocketError(f"frame too large: {size} bytes")
+            end = FRAME_HEADER_SIZE + size
+            if len(self._buffer) >= end:
+                payload = bytes(self._buffer[FRAME_HEADER_SIZE:end])
+                del self._buffer[:end]
+                return payload
+            # 大帧直接recv_into到预分配的缓冲区，避免反复拼接
+            self._payload = bytearray(size)
+            self._got = len(self._buffer) - FRAME_HEADER_SIZE
+            self._payload[:self._got] = self._buffer[FRAME_HEADER_SIZE:]
+            self._buffer.clear()
+        view = memoryview(self._payload)
+        size = len(self._payload)
+        while self._got < size:
+            n = self.sock.recv_into(view[self._got:], size - self._got)
+            if n == 0:
+                raise SocketError("socket closed by peer")
+            self._got += n
+        view.release()
+        payload, self._payload = bytes(self._payload), None
+        return payload
+
+
+def hello_frame(encodings) -> bytes:
+    """
+    hello handshake offering the encodings in order of preference, always json
+    """
+    return pack_frame(_json_dumps({"action": "hello", "encodings": list(encodings), "protocol": PROTOCOL_VERSION}))
+
+
+def check_hello_header(header: bytes):
+    """
+    :param header: first FRAME_HEADER_SIZE bytes of the hello reply
+    :raise ProtocolVersionError: the device did not answer with a frame
+    """
+    if FRAME_HEADER.unpack_from(header)[0] > MAX_HELLO_SIZE:
+        raise ProtocolVersionError(f"unframed hello reply {bytes(header)!r}, {UPGRADE_HINT}")
+
+
+def hello_encoding(payload: bytes) -> str:
+    """
+    check the protocol version in the hello reply
+    :return: encoding chosen by the device
+    :raise ProtocolVersionError: the device runner is older than PROTOCOL_VERSION
+    """
+    try:
+        reply = json.loads(payload.decode("utf8"))
+    except ValueError:
+        reply = None
+    version = reply.get("protocol", 0) if isinstance(reply, dict) else 0
+    if not isinstance(version, int) or version < PROTOCOL_VERSION:
+        raise ProtocolVersionError(f"device protocol {version!r} < {PROTOCOL_VERSION}, {UPGRADE_HINT}")
+    encoding = reply.get("encoding")
+    return encoding if encoding in CODECS else "json"
+
+
+def read_hello(reader) -> str:
+    """
+    read the hello reply from a FrameReader
+    :return: encoding chosen by the device
+    :raise ProtocolVersionError: the device runner does not speak this protocol
+    """
+    while len(reader._buffer) < FRAME_HEADER_SIZE:
+        reader._fill()
+    check_hello_header(reader._buffer[:FRAME_HEADER_SIZE])
+    payload = reader.read_frame()
+    logging.info(f"got hello message: {payload!r}")
+    return hello_encoding(payload)
+
+
+def hap_protocol(path) -> int:
+    """
+    protocol version compiled into a hap, read from the PROTOCOL_MARKER string in its ets/modules.abc
+    :return: the highest marked version, 0 for haps built before the marker existed
+    """
+    with zipfile.ZipFile(path) as hap:
+        try:
+            abc = hap.read("ets/modules.abc")
+        except KeyError:
+            return 0
+    return max((int(version) for version in PROTOCOL_MARKER.findall(abc)), default=0)
+
+
+def _nested(value):
+    """
+    older UiTestAPP builds send nested objects as json strings, parse them once
+    """
+    if isinstance(value, str) and value[:1] in ("{", "["):
+        try:
+            return loads(value)
+        except ValueError:
+            return value
+    return value
+
+
+def decode_reply(re_dict: dict) -> dict:
+    """
+    normalize a decoded reply in one pass. the device sends property and data as nested json,
+    only the known nested slots are checked for the legacy string form, no other value is re-parsed
+    :param re_dict: reply decoded by loads
+    :return: the same dict
+    """
+    if "property" in re_dict:
+        re_dict["property"] = _nested(re_dict["property"])
+    data = re_dict.get("data")
+    if isinstance(data, str):
+        data = re_dict["data"] = _nested(data)
+    if isinstance(data, list):
+        # finds、gets的结果列表，每一项的property
+        for item in data:
+            if isinstance(item, dict) and isinstance(item.get("property"), str):
+                item["property"] = _nested(item["property"])
+    return re_dict
+
+
+def benchmark(sizes=(1024, 16 * 1024, 128 * 1024, 1024 * 1024), total_bytes=64 * 1024 * 1024):
+    """
+    measure FrameReader throughput over a local socket pair
+    :param sizes: payload sizes to test
+    :param total_bytes: bytes transferred for each size
+    :return: {size: MB/s}
+    """
+    import threading
+
+    result = {}
+    for size in sizes:
+        count = max(total_bytes // size, 10)
+        frame = pack_frame(b"x" * size)
+        left, right = socket.socketpair()
+
+        def send():
+            for _ in range(count):
+                left.sendall(frame)
+
+        sender = threading.Thread(target=send, daemon=True)
+        reader = FrameReader(right)
+        st = time.perf_counter()
+        sender.start()
+        for _ in range(count):
+            reader.read_frame()
+        used = time.perf_counter() - st
+        sender.join()
+        left.close()
+        right.close()
+        result[size] = size * count / used / 1024 / 1024
+    return result
+
+
+def benchmark_decode(count=500, rounds=50):
+    """
+    compare json_to_dict on the legacy finds reply (json strings inside json)
+    with decode_reply on the nested reply, both holding count elements
+    :return: {"legacy": seconds per reply, "nested": seconds per reply}
+    """
+    from HMDriverClient.client import json_to_dict
+
+    def element(index):
+        return {"id": f"id_{index}", "text": f"text {index}", "type": "Button", "description": "",
+                "bounds": {"left": 0, "top": index, "right": 100, "bottom": index + 50},
+                "boundsCenter": {"x": 50, "y": index + 25}, "isClickable": True, "isLongClickable": False,
+                "isScrollable": False, "isEnabled": True, "isFocused": False, "isSelected": False,
+                "isChecked": False, "isCheckable": False}
+
+    items = [{"euid": f"euid{index}", "property": element(index)} for index in range(count)]
+    legacy_items = [{"euid": item["euid"], "property": json.dumps(item["property"])} for item in items]
+    legacy = json.dumps({"uuid": "u", "data": json.dumps(legacy_items)}).encode("utf8")
+    nested = json.dumps({"uuid": "u", "data": items}).encode("utf8")
+
+    result = {}
+    for name, payload, decode in (("legacy", legacy, lambda raw: json_to_dict(json.loads(raw))),
+                                  ("nested", nested, lambda raw: decode_reply(loads(raw)))):
+        st = time.perf_counter()
+        for _ in range(rounds):
+            decode(payload)
+        result[name] = (time.perf_counter() - st) / rounds
+    return result
+
+
+if __name__ == "__main__":
+    for frame_size, speed in benchmark().items():
+        print(f"{frame_size // 1024:>6} KB frames: {speed:8.1f} MB/s")
+    decode_time = benchmark_decode()
+    print(f"500-element finds reply: json_to_dict {decode_time['legacy'] * 1000:.2f} ms, "
+          f"decode_reply ({loads.__module__}) {decode_time['nested'] * 1000:.2f} ms, "
+          f"{decode_time['legacy'] / decode_time['nested']:.1f}x faster")
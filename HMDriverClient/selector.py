@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+selector grammar for compound element queries, compiled once on the client and sent as a structured query
+that the device turns into a chained On in order:
+
+    selector  := compound
+    compound  := [type] (id | attribute | relation)*
+    type      := NAME                                   Button
+    id        := '#' value                              #btn_ok  #"a.b"
+    attribute := '[' name op value ']'                  [text*="设置"]  [description^=more]
+               | '[' flag ']' | '[' flag '=' bool ']'   [clickable]  [enabled=false]
+    relation  := ':before(' compound ')'                the element is before the inner one
+               | ':after(' compound ')'                 the element is after the inner one
+    op        := '=' equals | '*=' contains | '^=' starts with | '$=' ends with
+    value     := NAME | "quoted" | 'quoted'
+
+text and description accept every op, id and type only '='.
+example: Button[text^="确定"][enabled]:after(Text[text="用户名"])
+"""
+import re
+from functools import lru_cache
+
+from HMDriverClient.element import ElementBy, MatchPattern
+from HMDriverClient.exception import *
+
+_TOKEN = re.compile(r"""\s*(?:
+    (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+  | (?P<op>\*=|\^=|\$=|=)
+  | (?P<punct>[\[\]():#])
+  | (?P<name>[^\s\[\]():#=*^$"']+)
+)""", re.X)
+
+_OPS = {"=": MatchPattern.EQUALS, "*=": MatchPattern.CONTAINS, "^=": MatchPattern.STARTS_WITH,
+        "$=": MatchPattern.ENDS_WITH}
+_PATTERN_ATTRIBUTES = {ElementBy.text, ElementBy.description}
+_STRING_ATTRIBUTES = {ElementBy.id, ElementBy.type} | _PATTERN_ATTRIBUTES
+_FLAG_ATTRIBUTES = {ElementBy.clickable, ElementBy.longClickable, ElementBy.scrollable, ElementBy.enabled,
+                    ElementBy.focused, ElementBy.selected, ElementBy.checked, ElementBy.checkable}
+_RELATIONS = {"before": ElementBy.isBefore, "after": ElementBy.isAfter,
+              ElementBy.isBefore: ElementBy.isBefore, ElementBy.isAfter: ElementBy.isAfter}
+
+
+class Selector(object):
+    """
+    compiled selector, query is sent with find/finds as is and must not be modified
+    """
+    __slots__ = ("text", "query")
+
+    def __init__(self, text, query):
+        self.text = text
+        self.query = query
+
+    def __repr__(self):
+        return f"<Selector({self.text})>"
+
+
+def _tokenize(text):
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None or match.end() == position:
+            raise SelectorSyntaxError(f"unexpected character at {position}: {text!r}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "string":
+            value = re.sub(r"\\(.)", r"\1", value[1:-1])
+        tokens.append((kind, value, match.start(kind)))
+        position = match.end()
+    return tokens
+
+
+class _Parser(object):
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.index = 0
+
+    def error(self, message):
+        position = self.tokens[self.index][2] if self.index < len(self.tokens) else len(self.text)
+        return SelectorSyntaxError(f"{message} at {position}: {self.text!r}")
+
+    def peek(self, kind=None, value=None):
+        if self.index >= len(self.tokens):
+            return None
+        token = self.tokens[self.index]
+        if (kind is not None and token[0] != kind) or (value is not None and token[1] != value):
+            return None
+        return token
+
+    def take(self, kind=None, value=None, expected=None):
+        token = self.peek(kind, value)
+        if token is None:
+            raise self.error(f"expected {expected or value or kind}")
+        self.index += 1
+        return token[1]
+
+    def value(self):
+        token = self.peek("name") or self.peek("string")
+        if token is None:
+            raise self.error("expected a value")
+        self.index += 1
+        return token[1]
+
+    def attribute(self):
+        name = self.take("name", expected="attribute name")
+        if name in _FLAG_ATTRIBUTES:
+            flag = True
+            if self.peek("op", "="):
+                self.index += 1
+                flag = self.take("name", expected="true or false")
+                if flag not in ("true", "false"):
+                    raise self.error(f"expected true or false for {name}")
+                flag = flag == "true"
+            self.take("punct", "]")
+            return {"by": name, "value": flag}
+        if name not in _STRING_ATTRIBUTES:
+            raise self.error(f"unknown attribute {name!r}")
+        op = self.take("op", expected="operator")
+        if op != "=" and name not in _PATTERN_ATTRIBUTES:
+            raise self.error(f"{name} only supports '='")
+        value = self.value()
+        self.take("punct", "]")
+        return {"by": name, "value": value, "pattern": _OPS[op]}
+
+    def compound(self):
+        conditions = []
+        if self.peek("name"):
+            conditions.append({"by": ElementBy.type, "value": self.take("name"), "pattern": MatchPattern.EQUALS})
+        while True:
+            if self.peek("punct", "#"):
+                self.index += 1
+                conditions.append({"by": ElementBy.id, "value": self.value(), "pattern": MatchPattern.EQUALS})
+            elif self.peek("punct", "["):
+                self.index += 1
+                conditions.append(self.attribute())
+            elif self.peek("punct", ":"):
+                self.index += 1
+                name = self.take("name", expected="before or after")
+                if name not in _RELATIONS:
+                    raise self.error(f"unknown relation {name!r}")
+                self.take("punct", "(")
+                inner = self.compound()
+                self.take("punct", ")")
+                conditions.append({"by": _RELATIONS[name], "value": inner})
+            else:
+                break
+        if not conditions:
+            raise self.error("expected a selector")
+        return {"conditions": conditions}
+
+    def parse(self):
+        query = self.compound()
+        if self.index < len(self.tokens):
+            raise self.error("unexpected token")
+        return query
+
+
+@lru_cache(maxsize=1024)
+def compile_selector(text: str) -> Selector:
+    """
+    parse and validate a selector, results are cached by text
+    :raise SelectorSyntaxError: invalid selector
+    """
+    return Selector(text, _Parser(text).parse())
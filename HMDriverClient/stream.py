@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from HMDriverClient.hdcstd import HdcShell, decode_screen_cap, screen_cap_command
+from HMDriverClient.vision import as_region, changed_tiles, sample_gray
+
+
+class Frame(object):
+    """
+    one captured frame. data is a memoryview on a ring buffer slot, it stays valid until
+    the buffer wraps around and reuses the slot, copy it with bytes(frame.data) to keep it longer
+    """
+    __slots__ = ("frame_id", "timestamp", "data")
+
+    def __init__(self, frame_id, timestamp, data):
+        self.frame_id = frame_id
+        self.timestamp = timestamp
+        self.data = data
+
+    def __repr__(self):
+        return f"<Frame(frame_id={self.frame_id}, timestamp={self.timestamp:.3f}, size={len(self.data)})>"
+
+
+class FrameRingBuffer(object):
+    """
+    fixed number of preallocated slots holding the latest frames.
+    when full the oldest frame is overwritten and counted in dropped
+    """
+
+    def __init__(self, capacity=8, slot_size=4 * 1024 * 1024):
+        self.capacity = capacity
+        self._slots = [bytearray(slot_size) for _ in range(capacity)]
+        self._sizes = [0] * capacity
+        self._ids = [-1] * capacity
+        self._times = [0.0] * capacity
+        self._next_id = 0
+        self._cond = threading.Condition()
+        self.dropped = 0
+
+    def put(self, data, timestamp=None) -> int:
+        """
+        copy a frame into the next slot
+        :return: frame id
+        """
+        with self._cond:
+            frame_id = self._next_id
+            index = frame_id % self.capacity
+            if self._ids[index] != -1:
+                self.dropped += 1
+            if len(data) > len(self._slots[index]):
+                # 槽位不够时换一块更大的，旧的memoryview仍引用原来的内存
+                self._slots[index] = bytearray(len(data))
+            self._slots[index][:len(data)] = data
+            self._sizes[index] = len(data)
+            self._ids[index] = frame_id
+            self._times[index] = time.time() if timestamp is None else timestamp
+            self._next_id += 1
+            self._cond.notify_all()
+        return frame_id
+
+    def _frame(self, index) -> Frame:
+        view = memoryview(self._slots[index])[:self._sizes[index]]
+        return Frame(self._ids[index], self._times[index], view)
+
+    def get(self, frame_id):
+        """
+        :return: the frame, or None if it was overwritten or not produced yet
+        """
+        with self._cond:
+            index = frame_id % self.capacity
+            if frame_id < 0 or self._ids[index] != frame_id:
+                return None
+            return self._frame(index)
+
+    def is_valid(self, frame: Frame) -> bool:
+        """
+        check that the slot of a frame has not been reused since it was returned
+        """
+        return self._ids[frame.frame_id % self.capacity] == frame.frame_id
+
+    def latest(self):
+        with self._cond:
+            if self._next_id == 0:
+                return None
+            return self._frame((self._next_id - 1) % self.capacity)
+
+    def frames(self):
+        """
+        :return: buffered frames, oldest first
+        """
+        with self._cond:
+            first = max(0, self._next_id - self.capacity)
+            return [self._frame(frame_id % self.capacity) for frame_id in range(first, self._next_id)]
+
+    def wait_for_frame(self, after_id=-1, timeout=None):
+        """
+        wait for a frame newer than after_id
+        :return: the latest frame, or None on timeout
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._next_id - 1 > after_id, timeout):
+                return None
+            return self._frame((self._next_id - 1) % self.capacity)
+
+
+class ScreenStream(object):
+    """
+    background producer capturing the screen at a fixed rate into a FrameRingBuffer.
+    it uses its own hdc shell channel, so it never blocks the UiTest socket or other hdc commands
+    """
+
+    # 比较帧时先按该倍数缩小
+    sample_factor = 4
+
+    def __init__(self, serial, fps=2.0, capacity=8, slot_size=4 * 1024 * 1024, capture=None, region=None):
+        """
+        :param capture: function returning png bytes, defaults to a full screen uitest screenCap
+        :param region: the screen region a custom capture returns, frames start at its top left corner
+        """
+        self.serial = serial
+        self.fps = fps
+        self.buffer = FrameRingBuffer(capacity, slot_size)
+        self.errors = 0
+        self._shell = None
+        self._capture = capture or self._capture_png
+        self.region = as_region(region)
+        # frame_id -> 缩小后的灰度图，帧被覆盖后随之淘汰
+        self._samples = OrderedDict()
+        self._samples_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _capture_png(self):
+        if self._shell is None:
+            self._shell = HdcShell(self.serial)
+        return decode_screen_cap(self._shell.run(screen_cap_command()))
+
+    def start(self):
+        if self._thread is None:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name=f"screen-stream-{self.serial}", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._shell is not None:
+            self._shell.close()
+            self._shell = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def _run(self):
+        interval = 1.0 / self.fps
+        next_time = time.perf_counter()
+        while not self._stop_event.is_set():
+            try:
+                timestamp = time.time()
+                self.buffer.put(self._capture(), timestamp)
+            except Exception as e:
+                self.errors += 1
+                logging.warning(f"screen stream capture failed: {e}")
+            next_time += interval
+            delay = next_time - time.perf_counter()
+            if delay < 0:
+                # 截图慢于设定帧率，不补帧
+                next_time = time.perf_counter()
+            else:
+                self._stop_event.wait(delay)
+
+    def latest(self):
+        return self.buffer.latest()
+
+    def frames(self):
+        return self.buffer.frames()
+
+    def wait_for_frame(self, after_id=-1, timeout=None):
+        return self.buffer.wait_for_frame(after_id, timeout)
+
+    def _sample(self, frame: Frame):
+        with self._samples_lock:
+            sample = self._samples.get(frame.frame_id)
+        if sample is not None:
+            return sample
+        data = bytes(frame.data)
+        if not self.buffer.is_valid(frame):
+            return None
+        sample = sample_gray(data, self.sample_factor)
+        with self._samples_lock:
+            self._samples[frame.frame_id] = sample
+            while len(self._samples) > self.buffer.capacity:
+                self._samples.popitem(last=False)
+        return sample
+
+    def diff(self, before: Frame, after: Frame, region=None, tile_size=32, tolerance=8.0):
+        """
+        compare two frames on downsampled tiles, each frame is decoded at most once
+        :param region: (left, top, right, bottom) or bounds dict in screen coordinates, None for the whole frame
+        :param tile_size: tile side in screen pixels
+        :param tolerance: largest gray difference (0~255) of a downsampled pixel that counts as unchanged
+        :return: bounds of the changed tiles in screen coordinates, empty if nothing changed,
+            None if one of the frames was already overwritten
+        """
+        first, second = self._sample(before), self._sample(after)
+        if first is None or second is None:
+            return None
+        factor = self.sample_factor
+        offset_x, offset_y = self.region[:2] if self.region else (0, 0)
+        x0 = y0 = 0
+        clip = None
+        if region is not None:
+            clip = as_region(region)
+            left, top, right, bottom = clip
+            x0, y0 = max((left - offset_x) // factor, 0), max((top - offset_y) // factor, 0)
+            x1, y1 = -(-(right - offset_x) // factor), -(-(bottom - offset_y) // factor)
+            first, second = first[y0:max(y1, y0), x0:max(x1, x0)], second[y0:max(y1, y0), x0:max(x1, x0)]
+        tile = max(tile_size // factor, 1)
+        tiles = []
+        for row, col in changed_tiles(first, second, tile, tolerance):
+            bounds = {"left": offset_x + (x0 + col * tile) * factor, "top": offset_y + (y0 + row * tile) * factor,
+                      "right": offset_x + (x0 + (col + 1) * tile) * factor,
+                      "bottom": offset_y + (y0 + (row + 1) * tile) * factor}
+            if clip is not None:
+                bounds["left"], bounds["top"] = max(bounds["left"], clip[0]), max(bounds["top"], clip[1])
+                bounds["right"], bounds["bottom"] = min(bounds["right"], clip[2]), min(bounds["bottom"], clip[3])
+            tiles.append(bounds)
+        return tiles
+
+    def screen_changed_since(self, frame_id, region=None, tile_size=32, tolerance=8.0):
+        """
+        compare the latest frame with frame_id, see diff
+        :return: bounds of the changed tiles, None if frame_id is no longer buffered
+        """
+        before = self.buffer.get(frame_id)
+        after = self.latest()
+        if before is None or after is None:
+            return None
+        return self.diff(before, after, region, tile_size, tolerance)
+
+    def wait_until_stable(self, stable_s=1.0, timeout=10.0, region=None, tolerance=8.0):
+        """
+        wait until the screen content stays the same for stable_s seconds
+        :param region: only watch this region, compared on downsampled tiles within tolerance,
+            for the whole screen frames are compared by hash
+        :return: the stable frame, or None on timeout
+        """
+        deadline = time.time() + timeout
+        frame = self.buffer.wait_for_frame(-1, timeout)
+        if frame is None:
+            return None
+        digest = hashlib.blake2b(frame.data).digest() if region is None else None
+        since = frame.timestamp
+        while time.time() < deadline:
+            previous = frame
+            frame = self.buffer.wait_for_frame(frame.frame_id, deadline - time.time())
+            if frame is None:
+                return None
+            if region is None:
+                cur = hashlib.blake2b(frame.data).digest()
+                changed = cur != digest
+                digest = cur
+            else:
+                changed = self.diff(previous, frame, region, tolerance=tolerance) != []
+            if changed:
+                since = frame.timestamp
+            elif frame.timestamp - since >= stable_s:
+                return frame
+        return None
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class RequestTrace(object):
+    """
+    timestamps (time.perf_counter) of one request, filled in by the client and the dispatcher
+    only when a tracer is installed
+    """
+    __slots__ = ("uuid", "action", "thread_id", "t_start", "t_serialized", "t_sent", "t_first_byte",
+                 "t_received", "t_decoded", "t_done", "error")
+
+    # (阶段名, 起始时间字段, 结束时间字段)
+    PHASES = (
+        ("serialize", "t_start", "t_serialized"),
+        ("send", "t_serialized", "t_sent"),
+        ("wait", "t_sent", "t_first_byte"),
+        ("receive", "t_first_byte", "t_received"),
+        ("deserialize", "t_received", "t_decoded"),
+        ("decode", "t_decoded", "t_done"),
+    )
+
+    def __init__(self, action):
+        self.uuid = None
+        self.action = action
+        self.thread_id = threading.get_ident()
+        self.t_start = time.perf_counter()
+        self.t_serialized = None
+        self.t_sent = None
+        self.t_first_byte = None
+        self.t_received = None
+        self.t_decoded = None
+        self.t_done = None
+        self.error = None
+
+    def phases(self):
+        """
+        :return: list of (phase, start, duration) for the phases that were reached
+        """
+        result = []
+        for name, start_field, end_field in self.PHASES:
+            start, end = getattr(self, start_field), getattr(self, end_field)
+            if start is not None and end is not None:
+                result.append((name, start, max(end - start, 0.0)))
+        return result
+
+    @property
+    def duration(self):
+        end = self.t_done or self.t_decoded or self.t_received or self.t_sent
+        return end - self.t_start if end else 0.0
+
+
+class Tracer(object):
+    """
+    keeps the latest finished request traces in a ring buffer and accumulates counters per action.
+    install on a client with client.tracer = Tracer(), any object with a record(trace) method can be used instead
+    """
+
+    def __init__(self, capacity=10000):
+        self.traces = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        # action -> {"count", "errors", "seconds", phase: seconds}
+        self._counters = {}
+
+    def record(self, trace: RequestTrace):
+        phases = trace.phases()
+        with self._lock:
+            self.traces.append(trace)
+            counter = self._counters.get(trace.action)
+            if counter is None:
+                counter = self._counters[trace.action] = {"count": 0, "errors": 0, "seconds": 0.0}
+            counter["count"] += 1
+            counter["seconds"] += trace.duration
+            if trace.error is not None:
+                counter["errors"] += 1
+            for name, start, duration in phases:
+                counter[name] = counter.get(name, 0.0) + duration
+
+    def clear(self):
+        with self._lock:
+            self.traces.clear()
+            self._counters = {}
+
+    def counters(self):
+        with self._lock:
+            return {action: dict(counter) for action, counter in self._counters.items()}
+
+    def chrome_trace(self):
+        """
+        :return: trace in the Chrome trace event format, open it in chrome://tracing or Perfetto
+        """
+        with self._lock:
+            traces = list(self.traces)
+        pid = os.getpid()
+        events = []
+        for trace in traces:
+            args = {"uuid": trace.uuid}
+            if trace.error is not None:
+                args["error"] = trace.error
+            events.append({"name": trace.action, "cat": "request", "ph": "X", "pid": pid, "tid": trace.thread_id,
+                           "ts": trace.t_start * 1000000, "dur": trace.duration * 1000000, "args": args})
+            for name, start, duration in trace.phases():
+                events.append({"name": name, "cat": trace.action, "ph": "X", "pid": pid, "tid": trace.thread_id,
+                               "ts": start * 1000000, "dur": duration * 1000000, "args": {"uuid": trace.uuid}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path):
+        with open(path, "w") as ff:
+            json.dump(self.chrome_trace(), ff)
+        return path
+
+    def prometheus(self, prefix="hdriver"):
+        """
+        :return: counters per action in the Prometheus text exposition format
+        """
+        counters = self.counters()
+        actions = sorted(counters)
+        # 同一个指标的所有样本必须连续，紧跟在它的TYPE行之后
+        lines = [f"# TYPE {prefix}_requests_total counter"]
+        lines += [f'{prefix}_requests_total{{action="{action}"}} {counters[action]["count"]}' for action in actions]
+        lines.append(f"# TYPE {prefix}_request_errors_total counter")
+        lines += [f'{prefix}_request_errors_total{{action="{action}"}} {counters[action]["errors"]}'
+                  for action in actions]
+        lines.append(f"# TYPE {prefix}_request_seconds_total counter")
+        lines += [f'{prefix}_request_seconds_total{{action="{action}"}} {counters[action]["seconds"]:.6f}'
+                  for action in actions]
+        lines.append(f"# TYPE {prefix}_request_phase_seconds_total counter")
+        for action in actions:
+            for name, _, _ in RequestTrace.PHASES:
+                if name in counters[action]:
+                    lines.append(f'{prefix}_request_phase_seconds_total{{action="{action}",phase="{name}"}} '
+                                 f'{counters[action][name]:.6f}')
+        return "\n".join(lines) + "\n"
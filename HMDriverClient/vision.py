@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+from HMDriverClient.exception import *
+
+# 图像匹配依赖numpy和Pillow，未安装时只有find_image不可用
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def require_vision():
+    if np is None or Image is None:
+        raise HDriverError("image matching requires numpy and Pillow: pip install numpy pillow")
+
+
+def frame_hash(data) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def as_region(region):
+    """
+    :param region: (left, top, right, bottom) or a bounds dict such as Element.bounds
+    :return: (left, top, right, bottom) as ints, None for None
+    """
+    if region is None:
+        return None
+    if isinstance(region, dict):
+        region = (region["left"], region["top"], region["right"], region["bottom"])
+    left, top, right, bottom = region
+    return int(left), int(top), int(right), int(bottom)
+
+
+def to_gray(image):
+    """
+    :param image: png/jpg bytes, file path, PIL image or numpy array (HxW gray or HxWx3/4 RGB)
+    :return: float32 gray array
+    """
+    require_vision()
+    if isinstance(image, np.ndarray):
+        if image.ndim == 3:
+            image = image[..., :3].astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+        return np.ascontiguousarray(image, dtype=np.float32)
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = Image.open(io.BytesIO(image))
+    elif isinstance(image, str):
+        image = Image.open(image)
+    return np.asarray(image.convert("L"), dtype=np.float32)
+
+
+def downscale(array):
+    """
+    halve both sides by averaging 2x2 blocks
+    """
+    h, w = array.shape[0] // 2 * 2, array.shape[1] // 2 * 2
+    return array[:h, :w].reshape(h // 2, 2, w // 2, 2).mean(axis=(1, 3))
+
+
+def sample_gray(image, factor=4):
+    """
+    gray image averaged over factor x factor blocks, edges padded by repeating the last pixels
+    """
+    gray = to_gray(image)
+    rows, cols = gray.shape
+    gray = np.pad(gray, ((0, -rows % factor), (0, -cols % factor)), mode="edge")
+    return gray.reshape(gray.shape[0] // factor, factor, gray.shape[1] // factor, factor).mean(axis=(1, 3))
+
+
+def changed_tiles(before, after, tile, tolerance):
+    """
+    compare two sampled images tile by tile
+    :param tile: tile side in sampled pixels
+    :param tolerance: largest per-pixel gray difference of a tile that still counts as unchanged
+    :return: (row, col) of every changed tile
+    """
+    rows, cols = min(before.shape[0], after.shape[0]), min(before.shape[1], after.shape[1])
+    diff = np.abs(before[:rows, :cols] - after[:rows, :cols])
+    diff = np.pad(diff, ((0, -rows % tile), (0, -cols % tile)))
+    peaks = diff.reshape(diff.shape[0] // tile, tile, diff.shape[1] // tile, tile).max(axis=(1, 3))
+    return [(int(row), int(col)) for row, col in zip(*np.nonzero(peaks > tolerance))]
+
+
+def integral(array):
+    out = np.zeros((array.shape[0] + 1, array.shape[1] + 1), dtype=np.float64)
+    out[1:, 1:] = array.cumsum(axis=0, dtype=np.float64).cumsum(axis=1)
+    return out
+
+
+def window_sums(table, h, w):
+    """
+    sum of every h x w window from an integral image, shape (H - h + 1, W - w + 1)
+    """
+    return table[h:, w:] - table[:-h, w:] - table[h:, :-w] + table[:-h, :-w]
+
+
+class _Level(object):
+    """
+    one pyramid level of a frame with the parts of the correlation that do not depend on the template
+    """
+    __slots__ = ("gray", "sums", "squares", "_spectrum")
+
+    def __init__(self, gray):
+        self.gray = gray
+        self.sums = integral(gray)
+        self.squares = integral(gray * gray)
+        self._spectrum = None
+
+    @property
+    def spectrum(self):
+        if self._spectrum is None:
+            self._spectrum = np.fft.rfft2(self.gray)
+        return self._spectrum
+
+
+def ncc(level: _Level, template):
+    """
+    normalized cross-correlation of template at every position of the level, computed with FFT
+    :return: score map of shape (H - h + 1, W - w + 1), 1.0 is a perfect match
+    """
+    rows, cols = level.gray.shape
+    h, w = template.shape
+    zero_mean = template - template.mean()
+    template_norm = np.sqrt((zero_mean * zero_mean).sum())
+    # 模板均值为0，sum(I * t) 等于 sum((I - mean_I) * t)
+    corr = np.fft.irfft2(level.spectrum * np.conj(np.fft.rfft2(zero_mean, s=(rows, cols))), s=(rows, cols))
+    corr = corr[:rows - h + 1, :cols - w + 1]
+    sums = window_sums(level.sums, h, w)
+    variance = np.maximum(window_sums(level.squares, h, w) - sums * sums / (h * w), 0.0)
+    denominator = np.sqrt(variance) * template_norm
+    scores = np.zeros_like(corr)
+    np.divide(corr, denominator, out=scores, where=denominator > 1e-6)
+    return scores
+
+
+class ImageMatch(object):
+    __slots__ = ("score", "bounds", "center")
+
+    def __init__(self, score, left, top, width, height):
+        self.score = score
+        self.bounds = {"left": left, "top": top, "right": left + width, "bottom": top + height}
+        self.center = (left + width // 2, top + height // 2)
+
+    def __repr__(self):
+        return f"<ImageMatch(score={self.score:.3f}, center={self.center}, bounds={self.bounds})>"
+
+
+class ImageMatcher(object):
+    """
+    finds templates in screenshots. decoded frames and their image pyramids are cached by the hash of
+    the png bytes, so several templates checked against one screen decode and transform it only once,
+    match results are cached per (frame, template, region)
+    """
+
+    def __init__(self, cache_size=4, min_template_size=24, max_levels=3, candidates=3):
+        """
+        :param cache_size: number of frames kept decoded
+        :param min_template_size: the coarse search uses the smallest pyramid level where
+            the shorter template side is still at least this many pixels
+        :param candidates: number of coarse peaks refined at full resolution
+        """
+        self.cache_size = cache_size
+        self.min_template_size = min_template_size
+        self.max_levels = max_levels
+        self.candidates = candidates
+        self._frames = OrderedDict()
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, cache, key):
+        with self._lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+            return value
+
+    def _store(self, cache, key, value, limit):
+        with self._lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > limit:
+                cache.popitem(last=False)
+
+    def pyramid(self, png_bytes, key=None):
+        """
+        :return: list of _Level, level i is 2**i times smaller than the frame
+        """
+        key = key or frame_hash(png_bytes)
+        levels = self._cached(self._frames, key)
+        if levels is None:
+            levels = [_Level(to_gray(png_bytes))]
+            for _ in range(self.max_levels):
+                gray = levels[-1].gray
+                if min(gray.shape) < 2 * self.min_template_size:
+                    break
+                levels.append(_Level(downscale(gray)))
+            self._store(self._frames, key, levels, self.cache_size)
+        return levels
+
+    def _level_for(self, levels, template):
+        index = 0
+        while index + 1 < len(levels) and min(template.shape) >> (index + 1) >= self.min_template_size:
+            index += 1
+        return index
+
+    @staticmethod
+    def _peaks(scores, count, radius):
+        """
+        top positions of a score map, at least radius apart
+        """
+        flat = scores.ravel()
+        top = min(count * 64, flat.size)
+        order = np.argpartition(flat, flat.size - top)[flat.size - top:]
+        order = order[np.argsort(flat[order])[::-1]]
+        peaks = []
+        for position in order:
+            y, x = divmod(int(position), scores.shape[1])
+            if all(abs(y - py) > radius or abs(x - px) > radius for py, px in peaks):
+                peaks.append((y, x))
+                if len(peaks) >= count:
+                    break
+        return peaks
+
+    def match(self, png_bytes, template, region=None):
+        """
+        best match of template in the frame regardless of threshold
+        :param region: (left, top, right, bottom) or bounds dict in screen coordinates, None for the whole frame
+        :return: (score, left, top, width, height), None if the template does not fit in the region
+        """
+        template = to_gray(template)
+        frame_key = frame_hash(png_bytes)
+        result_key = (frame_key, frame_hash(template.tobytes()), template.shape, as_region(region))
+        result = self._cached(self._results, result_key)
+        if result is not None:
+            return result
+        levels = self.pyramid(png_bytes, frame_key)
+        rows, cols = levels[0].gray.shape
+        h, w = template.shape
+        left, top, right, bottom = as_region(region) or (0, 0, cols, rows)
+        left, top = max(left, 0), max(top, 0)
+        right, bottom = min(right, cols), min(bottom, rows)
+        if right - left < w or bottom - top < h:
+            return None
+        # 在金字塔上层粗略搜索，再在原图候选位置附近精确匹配
+        index = self._level_for(levels, template)
+        scale = 1 << index
+        coarse_template = template
+        for _ in range(index):
+            coarse_template = downscale(coarse_template)
+        coarse = ncc(levels[index], coarse_template)
+        ch, cw = coarse_template.shape
+        y0, x0 = (top + scale - 1) // scale, (left + scale - 1) // scale
+        y1, x1 = (bottom // scale) - ch + 1, (right // scale) - cw + 1
+        candidates = [(y0, x0)]
+        if y1 > y0 and x1 > x0:
+            peaks = self._peaks(coarse[y0:y1, x0:x1], self.candidates if index else 1, max(ch, cw) // 2)
+            candidates = [(y0 + y, x0 + x) for y, x in peaks]
+        best = None
+        margin = scale + 1
+        for cy, cx in candidates:
+            py0, px0 = max(cy * scale - margin, top), max(cx * scale - margin, left)
+            py1, px1 = min(cy * scale + h + margin, bottom), min(cx * scale + w + margin, right)
+            if py1 - py0 < h or px1 - px0 < w:
+                continue
+            scores = ncc(_Level(levels[0].gray[py0:py1, px0:px1]), template)
+            y, x = np.unravel_index(int(np.argmax(scores)), scores.shape)
+            score = float(scores[y, x])
+            if best is None or score > best[0]:
+                best = (score, int(px0 + x), int(py0 + y), w, h)
+        if best is not None:
+            self._store(self._results, result_key, best, self.cache_size * 64)
+        return best
+
+    def find(self, png_bytes, template, threshold=0.9, region=None):
+        """
+        :return: ImageMatch if the best score reaches threshold, otherwise None
+        """
+        result = self.match(png_bytes, template, region)
+        if result is None or result[0] < threshold:
+            return None
+        return ImageMatch(*result)
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self._results.clear()
@@ -33,12 +33,35 @@ class UiWindow(object):
         self._client = client
         self.wuid = wuid
         self._property = property
+        self._released = False
+
+    def __del__(self):
+        self.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def release(self):
+        """
+        释放设备端的窗口句柄，释放请求会批量发送，释放后不能再操作该窗口
+        """
+        # __init__未完成或解释器退出时__del__也会调用，属性可能不存在
+        if getattr(self, "_released", True):
+            return
+        self._released = True
+        try:
+            self._client.release_later(wuid=self.wuid)
+        except Exception:
+            pass
 
     def __repr__(self):
-        return f'<UiWindow(wuid={self.wuid}, title={self._property["title"]}, ' \
-               f'bundleName={self._property["bundleName"]}, windowMode={self._property["windowMode"]}, ' \
-               f'bounds={self._property["bounds"]}, isFocused={self._property["isFocused"]},' \
-               f'isActive={self._property["isActive"]})>'
+        return f'<UiWindow(wuid={self.wuid}, title={self._property.get("title")}, ' \
+               f'bundleName={self._property.get("bundleName")}, windowMode={self._property.get("windowMode")}, ' \
+               f'bounds={self._property.get("bounds")}, isFocused={self._property.get("isFocused")},' \
+               f'isActive={self._property.get("isActive")})>'
 
     def __get(self, attribute):
         self._property = self.properties
@@ -64,6 +87,26 @@ class UiWindow(object):
             self._property = self._client.request(data)["data"]
         return self._property
 
+    def get_properties(self, fields=None):
+        """
+        从设备获取窗口属性，只执行fields中属性对应的getter
+        :param fields: 属性列表(WindowAttribute)，为None时获取全部属性
+        :return: 属性字典
+        """
+        data = {
+            "action": "window",
+            "operate": "get",
+            "property": 'info',
+            "wuid": self.wuid
+        }
+        if fields:
+            data["fields"] = list(fields)
+        property = self._client.request(data)["data"]
+        if self._property is None:
+            self._property = {}
+        self._property.update(property)
+        return property
+
     @property
     def title(self):
         """
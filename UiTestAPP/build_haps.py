@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+编译UiTestAPP并替换HMDriverClient/hap中的hap，修改了UiTestAPP的ets代码后运行：
+    python UiTestAPP/build_haps.py
+需要安装鸿蒙SDK并配置好ohpm和npmrc（与鸿蒙IDE编译的环境相同），hvigorw按hvigor-config.json5自动下载依赖。
+复制之前检查ohosTest hap中的协议标记，与HMDriverClient/protocol.py的PROTOCOL_VERSION不一致时不替换
+"""
+import os
+import shutil
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(APP_DIR)
+sys.path.insert(0, ROOT)
+
+from HMDriverClient.protocol import PROTOCOL_VERSION, hap_protocol  # noqa: E402
+
+HAP_DIR = os.path.join(ROOT, "HMDriverClient", "hap")
+OUTPUTS = os.path.join(APP_DIR, "entry", "build", "default", "outputs")
+# hvigorw参数 -> 编译产物
+TARGETS = [
+    (["-p", "module=entry@default", "-p", "product=default"],
+     os.path.join(OUTPUTS, "default", "entry-default-unsigned.hap")),
+    (["-p", "module=entry@ohosTest", "-p", "product=default", "-p", "isOhosTest=true", "-p", "buildMode=test"],
+     os.path.join(OUTPUTS, "ohosTest", "entry-ohosTest-unsigned.hap")),
+]
+
+
+def hvigorw():
+    name = "hvigorw.bat" if os.name == "nt" else "hvigorw"
+    path = os.path.join(APP_DIR, name)
+    return [path] if os.name == "nt" else ["bash", path]
+
+
+def build():
+    for args, output in TARGETS:
+        if os.path.exists(output):
+            os.remove(output)
+        cmd = hvigorw() + ["--mode", "module"] + args + ["assembleHap", "--no-daemon"]
+        print(" ".join(cmd))
+        subprocess.run(cmd, cwd=APP_DIR, check=True)
+        if not os.path.exists(output):
+            raise SystemExit(f"hvigorw did not produce {output}")
+    version = hap_protocol(TARGETS[-1][1])
+    if version != PROTOCOL_VERSION:
+        raise SystemExit(f"built runner has protocol {version}, HMDriverClient expects {PROTOCOL_VERSION}, "
+                         f"update PROTOCOL_MARKER in Ability.test.ets")
+    for _, output in TARGETS:
+        shutil.copy2(output, os.path.join(HAP_DIR, os.path.basename(output)))
+        print(f"copied {os.path.basename(output)} to {HAP_DIR}")
+
+
+if __name__ == "__main__":
+    build()
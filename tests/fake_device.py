@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+localhost stand-in for the UiTestAPP socket server: speaks the framed hello and answers requests
+with a handler, so clients can be tested without a device
+"""
+import json
+import socket
+import threading
+
+from HMDriverClient.client import Client
+from HMDriverClient.protocol import PROTOCOL_VERSION, FrameReader, pack_frame
+
+
+def default_handler(msg):
+    action = msg.get("action")
+    if action == "ping":
+        return {"data": 0}
+    if action in ("find", "finds"):
+        element = {"euid": f"e_{msg['data']}", "property": {"id": msg["data"], "text": msg["data"]}}
+        return element if action == "find" else {"data": [element, dict(element, euid=f"e_{msg['data']}_1")]}
+    if action == "gets":
+        return {"data": [{"euid": euid, "property": {"bounds": {"left": index}}}
+                         for index, euid in enumerate(msg["euids"])]}
+    if action == "get":
+        return {"data": {field: field for field in msg.get("fields") or ["id"]}}
+    if action == "silent":
+        return None
+    if action == "fail":
+        return {"ret": "error", "description": "failed on purpose"}
+    return {"data": "ok"}
+
+
+class FakeDevice(object):
+    """
+    accepts connections on 127.0.0.1, replies to hello with PROTOCOL_VERSION and json encoding,
+    then answers every request with handler(msg), a dict merged with the request uuid.
+    handler may return None to leave a request unanswered, a reply with a 'delay_s' key is sent
+    from a timer after that delay while later requests are answered
+    """
+
+    def __init__(self, handler=default_handler, protocol=PROTOCOL_VERSION):
+        self.handler = handler
+        self.protocol = protocol
+        self.requests = []
+        # 按发送顺序记录的回复uuid
+        self.replied = []
+        self.connections = []
+        self._send_lock = threading.Lock()
+        self.accepted = 0
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(8)
+        self.port = self.server.getsockname()[1]
+        self._thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            self.accepted += 1
+            self.connections.append(conn)
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def send(self, conn, msg):
+        with self._send_lock:
+            conn.sendall(pack_frame(json.dumps(msg).encode("utf8")))
+            if "uuid" in msg:
+                self.replied.append(msg["uuid"])
+
+    def _send_later(self, conn, msg):
+        try:
+            self.send(conn, msg)
+        except OSError:
+            pass
+
+    def push_event(self, event, data):
+        for conn in self.connections:
+            self.send(conn, {"event": event, "timestamp": 0, "data": data})
+
+    def _serve(self, conn):
+        reader = FrameReader(conn)
+        try:
+            hello = json.loads(reader.read_frame())
+            assert hello["action"] == "hello"
+            self.send(conn, {"greeting": "Hello client!", "protocol": self.protocol, "encoding": "json"})
+            while True:
+                msg = json.loads(reader.read_frame())
+                self.requests.append(msg)
+                reply = self.handler(msg)
+                if reply is None:
+                    continue
+                reply = dict(reply, uuid=msg["uuid"])
+                delay_s = reply.pop("delay_s", 0)
+                if delay_s:
+                    timer = threading.Timer(delay_s, self._send_later, args=(conn, reply))
+                    timer.daemon = True
+                    timer.start()
+                else:
+                    self.send(conn, reply)
+        except Exception:
+            conn.close()
+
+    def drop_connections(self):
+        for conn in self.connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            conn.close()
+        self.connections = []
+
+    def close(self):
+        self.server.close()
+        self.drop_connections()
+
+
+class LocalRunnerMixin(object):
+    """
+    TestRunner without hdc: the runner is the FakeDevice already listening on local_port
+    """
+
+    def start_test_runner(self):
+        pass
+
+    def stop_test_runner(self):
+        pass
+
+    def forward_port(self):
+        pass
+
+    def refresh_forward(self):
+        pass
+
+    def runner_alive(self):
+        return True
+
+
+class LocalClient(LocalRunnerMixin, Client):
+    pass
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from HMDriverClient.aio import AsyncClient, AsyncHMDriver
+from HMDriverClient.element import ElementAttribute
+from HMDriverClient.exception import *
+from tests.fake_device import FakeDevice, LocalRunnerMixin
+
+
+class LocalAsyncClient(LocalRunnerMixin, AsyncClient):
+    pass
+
+
+def make_driver(device):
+    driver = AsyncHMDriver.__new__(AsyncHMDriver)
+    driver.device_id = "fake"
+    driver.client = LocalAsyncClient("fake", local_port=device.port)
+    return driver
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_concurrent_requests_on_one_connection():
+    with FakeDevice() as device:
+        async def main():
+            client = LocalAsyncClient("fake", local_port=device.port)
+            await client.connect_socket(timeout=5)
+            replies = await asyncio.gather(*[client.request({"action": "ping"}) for _ in range(20)])
+            await client.close()
+            return replies
+
+        replies = run(main())
+    assert len(replies) == 20
+    assert device.accepted == 1
+
+
+def test_error_reply_raises():
+    with FakeDevice() as device:
+        async def main():
+            client = LocalAsyncClient("fake", local_port=device.port)
+            await client.connect_socket(timeout=5)
+            try:
+                with pytest.raises(HDriverError):
+                    await client.request({"action": "fail"})
+            finally:
+                await client.close()
+
+        run(main())
+
+
+def test_old_runner_fails_with_protocol_error():
+    with FakeDevice(protocol=0) as device:
+        async def main():
+            client = LocalAsyncClient("fake", local_port=device.port)
+            with pytest.raises(ProtocolVersionError):
+                await client.connect_socket(timeout=5)
+
+        run(main())
+
+
+def test_driver_api_matches_sync_driver():
+    with FakeDevice() as device:
+        async def main():
+            driver = make_driver(device)
+            await driver.client.connect_socket(timeout=5)
+            try:
+                element = await driver.find_element_by_id("ok", fields=[ElementAttribute.text])
+                elements = await driver.find_elements_by_text("item", fields=[ElementAttribute.bounds])
+                properties = await driver.get_properties(elements, [ElementAttribute.bounds])
+                single = await element.get_properties([ElementAttribute.type])
+                return element, elements, properties, single
+            finally:
+                await driver.client.close()
+
+        element, elements, properties, single = run(main())
+    assert element.euid == "e_ok"
+    assert [ele.euid for ele in elements] == ["e_item", "e_item_1"]
+    assert properties == [{"bounds": {"left": 0}}, {"bounds": {"left": 1}}]
+    assert elements[1].properties["bounds"] == {"left": 1}
+    assert single == {"type": "type"}
+    find, finds = device.requests[0], device.requests[1]
+    assert find["fields"] == [ElementAttribute.text]
+    assert finds["action"] == "finds" and finds["fields"] == [ElementAttribute.bounds]
+
+
+def test_reconnects_after_connection_drop():
+    with FakeDevice() as device:
+        async def main():
+            client = LocalAsyncClient("fake", local_port=device.port)
+            await client.connect_socket(timeout=5)
+            await client.request({"action": "ping"})
+            device.drop_connections()
+            await asyncio.sleep(0.05)
+            reply = await client.request({"action": "ping"})
+            await client.close()
+            return reply
+
+        assert run(main()) == {"data": 0}
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from HMDriverClient.batch import IDLE_WAIT_S, Batch, StepRef
+from HMDriverClient.element import Element, ElementBy
+from HMDriverClient.exception import *
+from HMDriverClient.hmdriver import HMDriver
+from tests.fake_device import FakeDevice, LocalClient, default_handler
+
+
+def resolve_refs(value, results):
+    """
+    same as resolveRefs in UiTestProcess.ets
+    """
+    if isinstance(value, list):
+        return [resolve_refs(item, results) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if "$ref" in value:
+        ref = results[value["$ref"]]
+        for key in value.get("field", "").split("."):
+            if key and ref is not None:
+                ref = ref[int(key)] if isinstance(ref, list) else ref.get(key)
+        return ref
+    return {key: resolve_refs(item, results) for key, item in value.items()}
+
+
+def step_handler(msg):
+    if msg["action"] == "find" and msg["data"] == "missing":
+        return {"ret": "error", "description": "no ele: id missing"}
+    if msg["action"] == "operate":
+        return {"data": f"{msg['operate']} {msg['euid']}"}
+    return default_handler(msg)
+
+
+def batch_handler(msg):
+    if msg["action"] != "batch":
+        return default_handler(msg)
+    results = []
+    for step in msg["steps"]:
+        result = step_handler(resolve_refs(step, results))
+        results.append(result)
+        if msg["stop_on_error"] and result.get("ret") == "error":
+            break
+    return {"data": results}
+
+
+@pytest.fixture
+def device():
+    with FakeDevice(batch_handler) as fake:
+        yield fake
+
+
+@pytest.fixture
+def driver(device):
+    hdriver = HMDriver.__new__(HMDriver)
+    hdriver.screen_stream = None
+    hdriver.client = LocalClient("fake", local_port=device.port)
+    yield hdriver
+    hdriver.stop()
+
+
+def test_step_refs():
+    ref = StepRef(2)
+    assert ref.euid == {"$ref": 2, "field": "euid"}
+    assert ref.element(1) == {"$ref": 2, "field": "data.1.euid"}
+    assert ref["data"] == {"$ref": 2, "field": "data"}
+
+
+def test_timeout_includes_the_idle_wait_of_ui_changing_steps():
+    batch = Batch()
+    user = batch.find_element_by_id("user", timeout_s=3)
+    batch.input_text(user, "test")
+    batch.click(1, 2)
+    batch.swipe(0, 0, 0, 500, time_s=0.5)
+    batch.sleep(1)
+    message = batch.to_message()
+    assert message["timeout_s"] == pytest.approx(3 + 0.5 + 1 + 3 * IDLE_WAIT_S)
+    assert message["steps"][1]["euid"] == {"$ref": 0, "field": "euid"}
+    with pytest.raises(HDriverError):
+        batch.add(message)
+
+
+def test_refs_are_resolved_and_results_mapped(driver, device):
+    with driver.batch() as batch:
+        user = batch.find_element_by_id("user")
+        batch.input_text(user, "test")
+        rows = batch.find_elements(ElementBy.id, "row")
+        batch.click_element(rows.element(1))
+        batch.click(1, 2)
+    user_element, typed, row_elements, clicked, ok = batch.results
+    assert isinstance(user_element, Element) and user_element.euid == "e_user"
+    assert typed == "input e_user"
+    assert [element.euid for element in row_elements] == ["e_row", "e_row_1"]
+    assert clicked == "click e_row_1"
+    assert ok == "ok"
+    assert [msg["action"] for msg in device.requests] == ["batch"]
+
+
+def test_failed_middle_step_stops_the_batch(driver):
+    batch = driver.batch()
+    batch.click(1, 2)
+    missing = batch.find_element_by_id("missing")
+    batch.click_element(missing)
+    results = batch.run()
+    assert results[0] == "ok"
+    assert isinstance(results[1], ElementNotFoundError)
+    assert results[2] is None
+
+
+def test_failed_middle_step_without_stop_on_error(driver):
+    batch = driver.batch(stop_on_error=False)
+    batch.find_element_by_id("missing")
+    batch.add({"action": "fail"})
+    batch.find_element_by_id("after")
+    missing, failed, after = batch.run()
+    assert isinstance(missing, ElementNotFoundError)
+    assert type(failed) is HDriverError and str(failed) == "failed on purpose"
+    assert after.euid == "e_after"
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+import itertools
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+from HMDriverClient.client import TestRunner as Runner, backoff_delays
+from HMDriverClient.dispatcher import Dispatcher
+from HMDriverClient.exception import *
+from HMDriverClient.protocol import FrameReader, pack_frame
+from tests.fake_device import FakeDevice, LocalClient, default_handler
+
+
+@pytest.fixture
+def pair():
+    left, right = socket.socketpair()
+    yield left, right
+    left.close()
+    right.close()
+
+
+def send(sock, msg):
+    sock.sendall(pack_frame(json.dumps(msg).encode("utf8")))
+
+
+def test_dispatcher_routes_replies_by_uuid(pair):
+    client_sock, device_sock = pair
+    events = []
+    dispatcher = Dispatcher(client_sock, FrameReader(client_sock), on_event=events.append)
+    first = dispatcher.submit({"uuid": "a", "action": "x"})
+    second = dispatcher.submit({"uuid": "b", "action": "y"})
+    device = FrameReader(device_sock)
+    assert [json.loads(device.read_frame())["uuid"] for _ in range(2)] == ["a", "b"]
+    send(device_sock, {"event": "toastShow", "data": {}})
+    send(device_sock, {"uuid": "b", "data": 2})
+    send(device_sock, {"uuid": "a", "data": 1})
+    assert first.result(1) == {"uuid": "a", "data": 1}
+    assert second.result(1) == {"uuid": "b", "data": 2}
+    assert events == [{"event": "toastShow", "data": {}}]
+    assert dispatcher.pending_count == 0
+    dispatcher.close()
+
+
+def test_dispatcher_fails_pending_requests_when_closed(pair):
+    client_sock, device_sock = pair
+    dispatcher = Dispatcher(client_sock, FrameReader(client_sock))
+    future = dispatcher.submit({"uuid": "a"})
+    device_sock.close()
+    with pytest.raises(SocketError):
+        future.result(1)
+    with pytest.raises(SocketError):
+        dispatcher.submit({"uuid": "b"})
+
+
+@pytest.fixture
+def device():
+    with FakeDevice() as fake:
+        yield fake
+
+
+@pytest.fixture
+def client(device):
+    local = LocalClient("fake", local_port=device.port)
+    yield local
+    local.close()
+
+
+SLOW_S = 0.3
+
+
+def slow_handler(msg):
+    if msg["action"] == "slow":
+        return {"data": msg["data"], "delay_s": SLOW_S}
+    return default_handler(msg)
+
+
+@pytest.fixture
+def slow_device():
+    with FakeDevice(slow_handler) as fake:
+        yield fake
+
+
+@pytest.fixture
+def slow_client(slow_device):
+    local = LocalClient("fake", local_port=slow_device.port)
+    yield local
+    local.close()
+
+
+def test_request_many_pipelines_on_one_connection(slow_device, slow_client):
+    st = time.monotonic()
+    replies = slow_client.request_many([{"action": "slow", "data": 1}, {"action": "ping"}, {"action": "fail"},
+                                        {"action": "find", "data": "x"}])
+    elapsed = time.monotonic() - st
+    assert replies[0] == {"data": 1}
+    assert replies[1] == {"data": 0}
+    assert isinstance(replies[2], HDriverError)
+    assert replies[3]["euid"] == "e_x"
+    assert SLOW_S <= elapsed < SLOW_S + 0.15
+    # 慢请求最先发出，最后回复
+    uuids = [msg["uuid"] for msg in slow_device.requests]
+    assert slow_device.replied == uuids[1:] + uuids[:1]
+    assert slow_device.accepted == 1
+
+
+def test_concurrent_callers_get_their_own_replies(slow_device, slow_client):
+    slow_client.request({"action": "ping"})
+    results = {}
+
+    def call(name, msg):
+        started = time.monotonic()
+        results[name] = (slow_client.request(msg), time.monotonic() - started)
+
+    threads = [threading.Thread(target=call, args=("slow", {"action": "slow", "data": "slow"}))]
+    threads += [threading.Thread(target=call, args=(index, {"action": "find", "data": index})) for index in range(4)]
+    st = time.monotonic()
+    for thread in threads:
+        thread.start()
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join(2)
+    elapsed = time.monotonic() - st
+    assert results["slow"][0] == {"data": "slow"}
+    for index in range(4):
+        reply, seconds = results[index]
+        assert reply["euid"] == f"e_{index}"
+        assert seconds < SLOW_S / 2
+    # 所有请求的总耗时约等于慢请求的耗时
+    assert SLOW_S <= elapsed < SLOW_S + 0.15
+    assert slow_device.replied[-1] == slow_device.requests[1]["uuid"]
+    assert slow_device.accepted == 1
+
+
+def test_unanswered_request_times_out_and_is_cancelled(client):
+    client.find_timeout_s = 0.2
+    with pytest.raises(ElementFoundTimeout):
+        client.request({"action": "silent"})
+    assert client.dispatcher.pending_count == 0
+
+
+def test_reconnects_after_the_device_drops_the_connection(device, client):
+    assert client.request({"action": "ping"}) == {"data": 0}
+    device.drop_connections()
+    time.sleep(0.05)
+    assert client.request({"action": "ping"}) == {"data": 0}
+    assert device.accepted == 2
+
+
+def test_pushed_events_reach_the_bus(device, client):
+    since = client.events.seq
+    device.push_event("toastShow", {"text": "saved"})
+    event = client.events.wait_for(["toastShow"], timeout=1, since=since)
+    assert event.get("text") == "saved"
+
+
+def test_backoff_delays_double_with_jitter_up_to_the_cap():
+    delays = list(itertools.islice(backoff_delays(initial_ms=20, max_ms=160), 8))
+    caps = [0.02, 0.04, 0.08, 0.16, 0.16, 0.16, 0.16, 0.16]
+    for delay, cap in zip(delays, caps):
+        assert cap / 2 <= delay <= cap
+
+
+def test_redial_keeps_the_runner_when_the_device_answers(device, client):
+    restarts = []
+    client.start_test_runner = lambda: restarts.append(1)
+    device.drop_connections()
+    time.sleep(0.05)
+    client.reconnect_socket()
+    assert client.request({"action": "ping"}) == {"data": 0}
+    assert restarts == []
+
+
+def test_dropped_client_is_collected_and_closes(device):
+    import gc
+    import weakref
+
+    closed = []
+
+    class TrackedClient(LocalClient):
+        def stop_test_runner(self):
+            closed.append(self.local_port)
+
+    local = TrackedClient("fake", local_port=device.port)
+    local.start_heartbeat(0.01)
+    local.subscribe_events(["toastShow"])
+    time.sleep(0.05)
+    dispatcher, ref = local.dispatcher, weakref.ref(local)
+    del local
+    gc.collect()
+    assert ref() is None
+    assert closed == [device.port]
+    assert dispatcher.closed
+
+
+def test_close_is_idempotent(device):
+    local = LocalClient("fake", local_port=device.port)
+    local.start_heartbeat(0.01)
+    local.close()
+    local.close()
+    assert local.dispatcher.closed
+    assert local._heartbeat_thread is None
+
+
+def test_only_ui_changing_events_invalidate_locators(device, client):
+    generation = client.ui_generation
+    since = client.events.seq
+    device.push_event("toastShow", {"text": "saved"})
+    device.push_event("focusChange", {})
+    device.push_event("windowChange", {})
+    assert client.events.wait_for(["windowChange"], timeout=1, since=since) is not None
+    assert client.ui_generation == generation + 1
+
+
+class RecordingHDC(object):
+
+    def __init__(self):
+        self.commands = []
+
+    def run_cmd(self, cmd):
+        self.commands.append(cmd)
+        return ""
+
+
+def test_forwarding_starts_one_hdc_process():
+    runner = Runner("fake", local_port=20001)
+    runner.hdc = RecordingHDC()
+    runner.forward_port()
+    assert runner.hdc.commands == ["fport tcp:20001 tcp:29100"]
+    runner.refresh_forward()
+    assert runner.hdc.commands[1:] == ["fport rm tcp:20001 tcp:29100", "fport tcp:20001 tcp:29100"]
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from HMDriverClient.element import Element, ElementAttribute
+from HMDriverClient.exception import *
+from HMDriverClient.hmdriver import HMDriver
+from tests.fake_device import FakeDevice, LocalClient, default_handler
+
+# 设备端控件的全部属性，每个euid一份
+DEVICE = {
+    "e1": {ElementAttribute.id: "btn", ElementAttribute.text: "OK", ElementAttribute.type: "Button",
+           ElementAttribute.bounds: {"left": 0, "top": 0, "right": 10, "bottom": 10}},
+    "e2": {ElementAttribute.id: "title", ElementAttribute.text: "Title", ElementAttribute.type: "Text"},
+}
+# 设备端不支持的属性，模拟返回的属性比请求的少
+UNSUPPORTED = {ElementAttribute.type}
+
+
+def project(euid, fields):
+    properties = DEVICE[euid]
+    for name in fields or properties:
+        if name not in properties and name not in UNSUPPORTED:
+            return f"unknown property: {name}"
+    return {name: properties[name] for name in fields or properties if name in properties and
+            name not in UNSUPPORTED}
+
+
+def handler(msg):
+    if msg["action"] == "get":
+        if msg["property"] != "info":
+            return {"data": DEVICE[msg["euid"]][msg["property"]]}
+        info = project(msg["euid"], msg.get("fields"))
+        if isinstance(info, str):
+            return {"ret": "error", "description": info}
+        return {"data": info}
+    if msg["action"] == "gets":
+        items = []
+        for euid in msg["euids"]:
+            if euid not in DEVICE:
+                items.append({"euid": euid, "error": f"get ele failed by euid '{euid}'"})
+                continue
+            info = project(euid, msg.get("fields"))
+            items.append({"euid": euid, "error": info} if isinstance(info, str) else {"euid": euid, "property": info})
+        return {"data": items}
+    return default_handler(msg)
+
+
+@pytest.fixture
+def device():
+    with FakeDevice(handler) as fake:
+        yield fake
+
+
+@pytest.fixture
+def client(device):
+    local = LocalClient("fake", local_port=device.port)
+    yield local
+    local.close()
+
+
+def gets(device, action="get"):
+    return [msg for msg in device.requests if msg["action"] == action]
+
+
+def test_projection_merges_into_the_cache(device, client):
+    element = Element(client, "e1", {ElementAttribute.text: "stale", "custom": 1})
+    got = element.get_properties([ElementAttribute.text, ElementAttribute.bounds])
+    assert got == {ElementAttribute.text: "OK", ElementAttribute.bounds: DEVICE["e1"][ElementAttribute.bounds]}
+    assert element.text == "OK" and element.bounds["right"] == 10
+    assert element.properties["custom"] == 1
+    assert gets(device)[0]["fields"] == [ElementAttribute.text, ElementAttribute.bounds]
+
+
+def test_fewer_fields_than_requested(device, client):
+    element = Element(client, "e1", {})
+    got = element.get_properties([ElementAttribute.id, ElementAttribute.type])
+    assert got == {ElementAttribute.id: "btn"}
+    assert ElementAttribute.type not in element.properties
+    # 缺少的属性在访问时单独获取
+    assert element.type == "Button"
+    assert gets(device)[-1]["property"] == ElementAttribute.type
+
+
+def test_unknown_field_raises_and_keeps_the_cache(client):
+    element = Element(client, "e1", {ElementAttribute.id: "btn"})
+    with pytest.raises(HDriverError) as info:
+        element.get_properties([ElementAttribute.id, "size"])
+    assert "unknown property: size" in str(info.value)
+    assert element.properties == {ElementAttribute.id: "btn"}
+
+
+def test_update_properties_overrides_and_adds():
+    element = Element(None, "e1", None)
+    element.update_properties({ElementAttribute.id: "a"})
+    element.update_properties({ElementAttribute.id: "b", ElementAttribute.text: "t"})
+    assert element._property == {ElementAttribute.id: "b", ElementAttribute.text: "t"}
+
+
+def test_bulk_get_properties_with_partial_and_failed_items(device, client):
+    driver = HMDriver.__new__(HMDriver)
+    driver.screen_stream = None
+    driver.client = client
+    elements = [Element(client, euid, {}) for euid in ("e1", "gone", "e2")]
+    result = driver.get_properties(elements, [ElementAttribute.text, ElementAttribute.type])
+    assert result == [{ElementAttribute.text: "OK"}, None, {ElementAttribute.text: "Title"}]
+    assert elements[0].properties == {ElementAttribute.text: "OK"}
+    assert elements[1]._property == {}
+    assert len(gets(device, "gets")) == 1
+    driver.client = None
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import math
+
+import pytest
+
+from HMDriverClient.exception import HDriverError
+from HMDriverClient.gesture import MAX_FINGERS, MAX_STEPS, Gesture, path_length, resample
+
+
+def points(finger):
+    return list(zip(finger[::2], finger[1::2]))
+
+
+def test_resample_is_uniform_and_keeps_ends():
+    path = resample([(0, 0), (100, 0), (100, 100)], 5)
+    assert path == [(0, 0), (50, 0), (100, 0), (100, 50), (100, 100)]
+    assert resample([(3, 4)], 3) == [(3.0, 4.0)] * 3
+    assert resample([(3, 4), (3, 4)], 2) == [(3.0, 4.0)] * 2
+
+
+def test_shorter_paths_hold_their_last_point():
+    gesture = Gesture().add([[(0, 0), (10, 0), (20, 0)], [(5, 5)]])
+    first, second = gesture.segments[0]["fingers"]
+    assert points(first) == [(0, 0), (10, 0), (20, 0)]
+    assert points(second) == [(5, 5)] * 3
+
+
+def test_speed_is_clamped_and_time_accumulates():
+    gesture = Gesture().swipe((0, 0), (1000, 0), time_s=0.5).tap(10, 10, count=2, interval_s=0.25)
+    speeds = [segment["speed"] for segment in gesture.segments]
+    assert speeds == [2000, 40000, 40000]
+    assert [segment["pause_ms"] for segment in gesture.segments] == [0, 0, 250]
+    assert gesture.to_message()["time_s"] == pytest.approx(0.75, abs=0.001)
+    assert Gesture().swipe((0, 0), (10, 0), time_s=1).segments[0]["speed"] == 200
+
+
+def test_pinch_is_symmetric_around_center():
+    first, second = Gesture().pinch((500, 500), 400, 100, steps=4).segments[0]["fingers"]
+    assert points(first)[0] == (300, 500) and points(second)[0] == (700, 500)
+    assert points(first)[-1] == (450, 500) and points(second)[-1] == (550, 500)
+
+
+def test_curve_and_rotate_stay_on_their_paths():
+    curve = points(Gesture().curve((0, 0), (50, 100), (100, 0), steps=3).segments[0]["fingers"][0])
+    assert curve == [(0, 0), (50, 50), (100, 0)]
+    fingers = Gesture().rotate((500, 500), 100, 90, fingers=3).segments[0]["fingers"]
+    assert len(fingers) == 3
+    for finger in fingers:
+        for x, y in points(finger):
+            assert math.hypot(x - 500, y - 500) == pytest.approx(100, abs=1)
+    assert path_length(points(fingers[0])) == pytest.approx(math.pi * 50, rel=0.02)
+
+
+def test_invalid_gestures():
+    with pytest.raises(HDriverError):
+        Gesture().add([[(0, 0)]] * (MAX_FINGERS + 1))
+    with pytest.raises(HDriverError):
+        Gesture().add([[]])
+    with pytest.raises(HDriverError):
+        Gesture().add([[(0, 0)] * (MAX_STEPS + 1)])
+    with pytest.raises(HDriverError):
+        Gesture().swipe((0, 0))
+    with pytest.raises(HDriverError):
+        Gesture().to_message()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import re
+import zipfile
+
+import pytest
+
+from HMDriverClient.exception import ProtocolVersionError
+from HMDriverClient.hmdriver import HAP_MARKER_PATH, hap_digest, install_test_haps
+from HMDriverClient.protocol import PROTOCOL_VERSION
+
+
+def write_haps(hap_dir, version=PROTOCOL_VERSION):
+    """
+    minimal entry and runner haps, the runner's modules.abc carries the protocol marker
+    """
+    for name, abc in (("entry-default-unsigned.hap", b"entry"),
+                      ("entry-ohosTest-unsigned.hap", b"\x00HMDriverProtocol/%d\x00" % version)):
+        with zipfile.ZipFile(hap_dir / name, "w") as hap:
+            hap.writestr("ets/modules.abc", abc)
+    return str(hap_dir)
+
+
+@pytest.fixture
+def haps(tmp_path):
+    return write_haps(tmp_path)
+
+
+class FakeHDC(object):
+    """
+    device state for install_test_haps: the installed bundle's updateTime and the marker file
+    """
+
+    def __init__(self, install_ok=True):
+        self.install_ok = install_ok
+        self.update_time = None
+        self.marker = None
+        self.installed = []
+
+    def install_app(self, path):
+        self.installed.append(path)
+        if self.install_ok:
+            self.update_time = str(1000 + len(self.installed))
+        return self.install_ok
+
+    def run_cmd(self, cmd):
+        if cmd.startswith("shell bm dump -n "):
+            bundle = cmd.split()[-1]
+            if self.update_time is None:
+                return "error: failed to get information and the parameters may be wrong."
+            return f'{{"bundleName": "{bundle}", "updateTime": {self.update_time}}}'
+        if cmd == f"shell cat {HAP_MARKER_PATH}":
+            return self.marker if self.marker is not None else "cat: No such file or directory"
+        if cmd == f"shell rm -f {HAP_MARKER_PATH}":
+            self.marker = None
+            return ""
+        m = re.match(r'shell "echo (.*) > (\S+)"$', cmd)
+        if m and m.group(2) == HAP_MARKER_PATH:
+            self.marker = m.group(1)
+            return ""
+        raise AssertionError(f"unexpected command {cmd}")
+
+
+def test_hap_digest_is_stable_and_content_based(tmp_path):
+    first, second = tmp_path / "a.hap", tmp_path / "b.hap"
+    first.write_bytes(b"a" * 10)
+    second.write_bytes(b"b" * 10)
+    digest = hap_digest([str(first), str(second)])
+    assert digest == hap_digest([str(first), str(second)])
+    assert digest != hap_digest([str(second), str(first)])
+    second.write_bytes(b"c" * 11)
+    assert digest != hap_digest([str(first), str(second)])
+
+
+def test_installs_once_and_writes_the_marker(haps):
+    hdc = FakeHDC()
+    install_test_haps(hdc, hap_dir=haps)
+    assert len(hdc.installed) == 2
+    digest, update_time = hdc.marker.split()
+    assert len(digest) == 64 and update_time == hdc.update_time
+    install_test_haps(hdc, hap_dir=haps)
+    assert len(hdc.installed) == 2
+
+
+def test_reinstalls_when_the_app_was_reinstalled_elsewhere(haps):
+    hdc = FakeHDC()
+    install_test_haps(hdc, hap_dir=haps)
+    hdc.update_time = "99"
+    install_test_haps(hdc, hap_dir=haps)
+    assert len(hdc.installed) == 4
+
+
+def test_reinstalls_when_the_app_was_uninstalled(haps):
+    hdc = FakeHDC()
+    install_test_haps(hdc, hap_dir=haps)
+    hdc.update_time = None
+    install_test_haps(hdc, hap_dir=haps)
+    assert len(hdc.installed) == 4
+
+
+def test_failed_install_removes_the_marker(haps):
+    hdc = FakeHDC()
+    install_test_haps(hdc, hap_dir=haps)
+    hdc.install_ok = False
+    install_test_haps(hdc, force=True, hap_dir=haps)
+    assert hdc.marker is None
+
+
+@pytest.mark.parametrize("version", [0, PROTOCOL_VERSION - 1])
+def test_stale_bundled_runner_is_not_installed(tmp_path, version):
+    hdc = FakeHDC()
+    with pytest.raises(ProtocolVersionError):
+        install_test_haps(hdc, hap_dir=write_haps(tmp_path, version))
+    assert hdc.installed == [] and hdc.marker is None
+
+
+def test_stale_runner_fails_even_when_its_marker_matches(tmp_path):
+    hap_dir = write_haps(tmp_path, 0)
+    hdc = FakeHDC()
+    hdc.update_time = "1000"
+    hap_list = [str(tmp_path / "entry-default-unsigned.hap"), str(tmp_path / "entry-ohosTest-unsigned.hap")]
+    hdc.marker = f"{hap_digest(hap_list)} 1000"
+    with pytest.raises(ProtocolVersionError):
+        install_test_haps(hdc, hap_dir=hap_dir)
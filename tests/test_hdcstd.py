@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import time
+
+import pytest
+
+from HMDriverClient.exception import *
+from HMDriverClient.hdcstd import HdcShell, split_cmd
+
+pytestmark = pytest.mark.skipif(shutil.which("sh") is None, reason="needs a posix shell")
+
+
+class LocalShell(HdcShell):
+    """
+    the same session protocol on a local sh instead of the device shell
+    """
+
+    def command(self):
+        return ["sh"]
+
+
+@pytest.fixture
+def shell():
+    session = LocalShell("local")
+    yield session
+    session.close()
+
+
+def test_split_cmd_posix(monkeypatch):
+    monkeypatch.setattr(os, "name", "posix")
+    assert split_cmd('shell "ps -ef | grep app"') == ["shell", "ps -ef | grep app"]
+
+
+def test_split_cmd_keeps_windows_paths(monkeypatch):
+    monkeypatch.setattr(os, "name", "nt")
+    assert split_cmd(r"install C:\haps\entry.hap") == ["install", r"C:\haps\entry.hap"]
+    assert split_cmd(r'file send "C:\My Dir\a.txt" /data/a.txt') == ["file", "send", r"C:\My Dir\a.txt", "/data/a.txt"]
+    assert split_cmd('shell "ps -ef | grep app"') == ["shell", "ps -ef | grep app"]
+
+
+def test_session_runs_commands_in_order(shell):
+    assert shell.run("echo one; echo two") == "one\ntwo\n"
+    assert shell.run("printf 'a|b'") == "a|b\n"
+    assert shell.run("true") == ""
+    proc = shell.proc
+    shell.run("echo again")
+    assert shell.proc is proc
+
+
+def test_session_does_not_read_stdin(shell):
+    # 命令读取stdin时不能吞掉后面的标记
+    assert shell.run("cat") == ""
+    assert shell.run("echo next") == "next\n"
+
+
+def test_timeout_covers_the_whole_command(shell):
+    st = time.monotonic()
+    with pytest.raises(HDCException):
+        shell.run("for i in 1 2 3 4 5 6; do echo $i; sleep 0.2; done", timeout=0.5)
+    assert time.monotonic() - st < 1.0
+    # 超时后会话被关闭，下一条命令重新建立
+    assert shell.run("echo recovered") == "recovered\n"
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from HMDriverClient.element import ElementBy, MatchPattern
+from HMDriverClient.hierarchy import Hierarchy, parse_bounds
+
+
+def component(bounds, children=(), **attributes):
+    attributes["bounds"] = bounds
+    return {"attributes": attributes, "children": list(children)}
+
+
+# root 0..400x0..600
+#   list 0..400x100..500
+#     row1 0..400x100..200: title, ok button at 300..400
+#     row2 0..400x200..300: id "" text "second"
+#   footer 0..400x500..600
+LAYOUT = component("[0,0][400,600]", [
+    component("[0,100][400,500]", [
+        component("[0,100][400,200]", [
+            component("[10,110][200,190]", id="title", text="设置", type="Text"),
+            component("[300,100][400,200]", id="btn_ok", text="确定", type="Button", clickable="true"),
+        ], id="row1", type="Row"),
+        component("[0,200][400,300]", [], text="second", type="Text"),
+    ], id="list", type="List", scrollable="true"),
+    component("[0,500][400,600]", id="footer", type="Row", description="more items"),
+], id="root", type="Column")
+
+
+@pytest.fixture
+def tree():
+    return Hierarchy.from_json(json.dumps(LAYOUT), grid_size=100)
+
+
+def ids(nodes):
+    return [node.id for node in nodes]
+
+
+def test_parse_bounds():
+    assert parse_bounds("[-5,10][20,30]") == {"left": -5, "top": 10, "right": 20, "bottom": 30}
+    assert parse_bounds("") == {"left": 0, "top": 0, "right": 0, "bottom": 0}
+    assert parse_bounds(None) == {"left": 0, "top": 0, "right": 0, "bottom": 0}
+
+
+def test_nodes_are_in_preorder_with_depth(tree):
+    assert ids(tree) == ["root", "list", "row1", "title", "btn_ok", "", "footer"]
+    assert [node.depth for node in tree] == [0, 1, 2, 3, 3, 2, 1]
+    assert tree.find(ElementBy.id, "btn_ok").parent.id == "row1"
+    assert tree.find(ElementBy.id, "btn_ok").center == (350, 150)
+
+
+def test_index_lookups(tree):
+    assert ids(tree.find_all(ElementBy.type, "Text")) == ["title", ""]
+    assert ids(tree.find_all(ElementBy.type, "Row", {ElementBy.description: "more items"})) == ["footer"]
+    assert ids(tree.find_all(ElementBy.text, "确", pattern=MatchPattern.STARTS_WITH)) == ["btn_ok"]
+    assert ids(tree.find_all(ElementBy.description, "items", pattern=MatchPattern.ENDS_WITH)) == ["footer"]
+    assert ids(tree.find_all(ElementBy.id, "o", pattern=MatchPattern.CONTAINS)) == ["root", "row1", "btn_ok",
+                                                                                    "footer"]
+    assert tree.find_all(ElementBy.id, "missing") == []
+    assert tree.find(ElementBy.id, "missing") is None
+
+
+def test_empty_values_are_indexed(tree):
+    assert [node.text for node in tree.find_all(ElementBy.id, "")] == ["second"]
+    assert ids(tree.find_all(ElementBy.text, "", {ElementBy.type: "Row"})) == ["row1", "footer"]
+
+
+def test_bool_and_relation_conditions(tree):
+    assert ids(tree.find_all(ElementBy.clickable, True)) == ["btn_ok"]
+    assert ids(tree.find_all(ElementBy.scrollable, "true")) == ["list"]
+    after_title = {"by": ElementBy.id, "data": "title"}
+    assert ids(tree.find_all(ElementBy.type, "Text", {ElementBy.isAfter: after_title})) == [""]
+    before_ok = {"by": ElementBy.id, "data": "btn_ok"}
+    assert ids(tree.find_all(ElementBy.type, "Text", {ElementBy.isBefore: before_ok})) == ["title"]
+
+
+def test_at_returns_nested_nodes_shallow_first(tree):
+    assert ids(tree.at(350, 150)) == ["root", "list", "row1", "btn_ok"]
+    assert ids(tree.at(50, 150)) == ["root", "list", "row1", "title"]
+    # 右、下边界不属于控件
+    assert ids(tree.at(299, 199)) == ["root", "list", "row1"]
+    assert ids(tree.at(300, 200)) == ["root", "list", ""]
+    assert tree.at(400, 600) == []
+    assert tree.at(-1, 10) == []
+
+
+def test_within_includes_nodes_touching_the_region_edges(tree):
+    assert ids(tree.within((0, 100, 400, 200))) == ["row1", "title", "btn_ok"]
+    assert ids(tree.within({"left": 300, "top": 100, "right": 400, "bottom": 200})) == ["btn_ok"]
+    # 超出区域一个像素的控件不算在区域内
+    assert ids(tree.within((301, 100, 400, 200))) == []
+    assert ids(tree.within((300, 100, 400, 199))) == []
+    assert ids(tree.within((0, 0, 400, 600))) == ids(tree)
+
+
+def test_empty_layout():
+    tree = Hierarchy({})
+    assert len(tree) == 0 and tree.root is None
+    assert tree.at(0, 0) == [] and tree.find_all(ElementBy.id, "") == []
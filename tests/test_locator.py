@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from HMDriverClient.element import Element, ElementAttribute, ElementBy
+from HMDriverClient.locator import LocatorCache
+from tests.fake_device import FakeDevice, LocalClient, default_handler
+
+BOUNDS = {"left": 0, "top": 0, "right": 100, "bottom": 50}
+
+
+@pytest.fixture
+def device():
+    state = {"bounds": dict(BOUNDS)}
+
+    def handler(msg):
+        if msg.get("action") == "get":
+            return {"data": {ElementAttribute.bounds: state["bounds"]}}
+        return default_handler(msg)
+
+    with FakeDevice(handler) as fake:
+        fake.state = state
+        yield fake
+
+
+@pytest.fixture
+def client(device):
+    local = LocalClient("fake", local_port=device.port)
+    yield local
+    local.close()
+
+
+def element(client, euid="e1"):
+    return Element(client, euid, {ElementAttribute.bounds: dict(BOUNDS)})
+
+
+def gets(device):
+    return sum(1 for msg in device.requests if msg["action"] == "get")
+
+
+def test_key_is_independent_of_params_order():
+    first = LocatorCache.key(ElementBy.id, "ok", {ElementBy.text: "a", ElementBy.type: "Button"})
+    second = LocatorCache.key(ElementBy.id, "ok", {ElementBy.type: "Button", ElementBy.text: "a"})
+    assert first == second
+    assert first != LocatorCache.key(ElementBy.id, "ok", None, [ElementAttribute.bounds])
+
+
+def test_hit_is_revalidated_with_a_bounds_get(device, client):
+    cache = LocatorCache(client)
+    key = cache.key(ElementBy.id, "ok")
+    assert cache.lookup(key) is None
+    ele = element(client)
+    cache.store(key, ele, cache.generation())
+    assert cache.lookup(key) is ele
+    assert gets(device) == 1
+    assert device.requests[-1]["fields"] == [ElementAttribute.bounds]
+    assert cache.stats() == {"size": 1, "hits": 0, "revalidated": 1, "misses": 1, "stale": 0}
+
+
+def test_trusted_hits_skip_the_device(device, client):
+    cache = LocatorCache(client, trust_s=60)
+    key = cache.key(ElementBy.id, "ok")
+    ele = element(client)
+    cache.store(key, ele, cache.generation())
+    assert cache.lookup(key) is ele
+    assert gets(device) == 0
+
+
+def test_ui_change_and_moved_bounds_drop_the_entry(device, client):
+    cache = LocatorCache(client)
+    key = cache.key(ElementBy.id, "ok")
+    cache.store(key, element(client), cache.generation())
+    client.ui_changed()
+    assert cache.lookup(key) is None
+    cache.store(key, element(client), cache.generation())
+    device.state["bounds"] = dict(BOUNDS, top=10)
+    assert cache.lookup(key) is None
+    assert cache.stats()["stale"] == 2
+
+
+def test_store_ignores_results_from_an_older_generation(client):
+    cache = LocatorCache(client)
+    key = cache.key(ElementBy.id, "ok")
+    generation = cache.generation()
+    client.ui_changed()
+    cache.store(key, element(client), generation)
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entries_are_evicted(client):
+    cache = LocatorCache(client, trust_s=60, max_size=2)
+    keys = [cache.key(ElementBy.id, name) for name in "abc"]
+    cache.store(keys[0], element(client, "a"), cache.generation())
+    cache.store(keys[1], element(client, "b"), cache.generation())
+    cache.lookup(keys[0])
+    cache.store(keys[2], element(client, "c"), cache.generation())
+    assert cache.lookup(keys[1]) is None
+    assert cache.lookup(keys[0]) is not None and cache.lookup(keys[2]) is not None
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import random
+
+import pytest
+
+from HMDriverClient.metrics import LatencyHistogram
+
+
+def test_empty_histogram():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(50) is None
+    assert histogram.mean() is None
+    assert histogram.summary() == {"count": 0, "p50_ms": None, "p90_ms": None, "p99_ms": None, "max_ms": None}
+
+
+def test_small_values_are_exact():
+    histogram = LatencyHistogram()
+    for us in range(1, 101):
+        histogram.record(us / 1000000)
+    assert histogram.percentile(50) == pytest.approx(50e-6)
+    assert histogram.percentile(99) == pytest.approx(99e-6)
+    assert histogram.percentile(100) == pytest.approx(100e-6)
+
+
+def test_large_values_keep_relative_precision():
+    rng = random.Random(1)
+    values = sorted(rng.uniform(0.001, 2.0) for _ in range(5000))
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    for percent in (50, 90, 99):
+        exact = values[int(round(len(values) * percent / 100.0)) - 1]
+        assert histogram.percentile(percent) == pytest.approx(exact, rel=0.01)
+    assert histogram.mean() == pytest.approx(sum(values) / len(values), rel=1e-6)
+    assert histogram.summary()["max_ms"] == pytest.approx(values[-1] * 1000, abs=0.001)
+
+
+def test_values_are_clamped_and_reset():
+    histogram = LatencyHistogram(max_value_s=1.0)
+    histogram.record(-1)
+    histogram.record(5)
+    assert histogram.percentile(0) == 0
+    assert histogram.percentile(100) == 1.0
+    histogram.reset()
+    assert histogram.count == 0 and histogram.percentile(50) is None
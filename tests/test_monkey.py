@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+
+from HMDriverClient.exception import HDriverError
+from HMDriverClient.monkey import Monkey, MonkeyEvent, generate_events
+
+REGION = (0, 0, 100, 200)
+
+
+class FakeHdc(object):
+
+    def __init__(self):
+        self.faultlogs = []
+
+    def run_cmd(self, cmd):
+        return "\n".join(self.faultlogs)
+
+
+class FakeDriver(object):
+    """
+    answers monkey requests like the device: executes events until the foreground bundle, taken from
+    bundles in turn, leaves the whitelist
+    """
+
+    def __init__(self, bundles=None):
+        self.app_bundle = "com.example.app"
+        self.app_ability = "EntryAbility"
+        self.hdc = FakeHdc()
+        self.bundles = list(bundles or [])
+        self.requests = []
+        self.started = 0
+        # 每个事件在设备端的耗时，为0时不计时
+        self.event_ms = 0
+
+    def get_screen_size(self):
+        return {"width": REGION[2], "height": REGION[3]}
+
+    def req(self, data):
+        self.requests.append(data)
+        bundle = self.bundles.pop(0) if self.bundles else self.app_bundle
+        executed = len(data["events"]) if bundle in ("", self.app_bundle) else len(data["events"]) // 2
+        elapsed_ms = 0
+        if self.event_ms:
+            if "deadline_ms" in data:
+                executed = min(executed, -(-data["deadline_ms"] // self.event_ms))
+            elapsed_ms = executed * self.event_ms
+            time.sleep(elapsed_ms / 1000)
+        return {"data": {"executed": executed, "errors": 1, "bundle": bundle, "elapsed_ms": elapsed_ms}}
+
+    def start_app(self, bundle, ability):
+        self.started += 1
+
+    def back(self):
+        pass
+
+
+def test_generate_events_is_deterministic_and_in_region():
+    events = generate_events(42, 300, REGION)
+    assert events == generate_events(42, 300, REGION)
+    assert events != generate_events(43, 300, REGION)
+    for event in events:
+        for x, y in zip(event[1:5:2], event[2:5:2]):
+            assert 0 <= x < 100 and 0 <= y < 200
+
+
+def test_generate_events_weights():
+    events = generate_events(1, 50, REGION, {MonkeyEvent.back: 1})
+    assert events == [["b"]] * 50
+    with pytest.raises(HDriverError):
+        generate_events(1, 10, REGION, {"shake": 1})
+    with pytest.raises(HDriverError):
+        generate_events(1, 10, REGION, {MonkeyEvent.click: 0})
+
+
+def test_run_counts_partial_batches_and_restarts():
+    driver = FakeDriver(["com.example.app", "com.other", "com.example.app"])
+    report = Monkey(driver, seed=5, batch_size=10).run(events=25)
+    assert [entry["executed"] for entry in report.seed_log] == [10, 5, 10]
+    assert report.events == 25 and report.errors == 3
+    assert report.restarts == 1 and driver.started == 1
+
+
+def test_unknown_foreground_is_not_a_restart():
+    driver = FakeDriver(["", ""])
+    report = Monkey(driver, seed=5, batch_size=10).run(events=20)
+    assert report.events == 20
+    assert report.restarts == 0 and driver.started == 0
+
+
+def test_duration_sizes_batches_from_the_remaining_time():
+    driver = FakeDriver()
+    driver.event_ms = 10
+    st = time.monotonic()
+    report = Monkey(driver, seed=3).run(duration_s=0.3)
+    assert time.monotonic() - st < 0.45
+    first = driver.requests[0]
+    assert len(first["events"]) <= 6 and first["deadline_ms"] == pytest.approx(300, abs=5)
+    assert first["time_s"] <= 0.3 + 1
+    # 实测每个事件10ms之后按剩余时间确定批次大小
+    assert all(len(request["events"]) <= request["deadline_ms"] // 10 + 1 for request in driver.requests[1:])
+    assert report.events == pytest.approx(30, abs=4)
+
+
+def test_replay_sends_the_same_events():
+    driver = FakeDriver(["com.other"])
+    monkey = Monkey(driver, seed=9, batch_size=10)
+    report = monkey.run(events=15)
+    sent = [request["events"] for request in driver.requests]
+    driver.requests = []
+    monkey.replay(report.seed_log)
+    assert [request["events"] for request in driver.requests] == [sent[0][:5]] + sent[1:]
+
+
+def test_new_crash_logs_are_reported():
+    driver = FakeDriver()
+    driver.hdc.faultlogs = ["jscrash-com.other-1"]
+    monkey = Monkey(driver, seed=1, batch_size=10, crash_check_interval_s=0)
+    monkey.run_events = _crashing(monkey.run_events, driver)
+    report = monkey.run(events=10)
+    assert report.crashes == ["cppcrash-com.example.app-2"]
+
+
+def _crashing(run_events, driver):
+    def wrapper(*args, **kwargs):
+        entry = run_events(*args, **kwargs)
+        driver.hdc.faultlogs.append("cppcrash-com.example.app-2")
+        return entry
+    return wrapper
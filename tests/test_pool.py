@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import socket
+import threading
+import time
+
+import pytest
+
+from HMDriverClient import client as client_module
+from HMDriverClient.client import allocate_port, port_is_free, release_port
+from HMDriverClient.exception import HDriverError
+from HMDriverClient.pool import DevicePool
+from tests.fake_device import FakeDevice, LocalClient
+
+
+class FakeDriver(object):
+
+    def __init__(self, device_id):
+        if device_id == "broken":
+            raise RuntimeError("runner did not start")
+        self.device_id = device_id
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+
+@pytest.fixture
+def pool():
+    with DevicePool(["a", "b", "broken"], driver_factory=FakeDriver) as devices:
+        yield devices
+
+
+def test_start_skips_devices_that_fail(pool):
+    assert sorted(pool.drivers) == ["a", "b"]
+    assert len(pool) == 2
+
+
+def test_acquire_release(pool):
+    first, second = pool.acquire(), pool.acquire()
+    assert {first.device_id, second.device_id} == {"a", "b"}
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.05)
+    pool.release(first)
+    assert pool.acquire(timeout=0.05) is first
+
+
+def test_driver_context_releases_on_error(pool):
+    with pytest.raises(ValueError):
+        with pool.driver() as driver:
+            raise ValueError(driver.device_id)
+    assert len({pool.acquire(0.05).device_id, pool.acquire(0.05).device_id}) == 2
+
+
+def test_map_runs_items_one_device_at_a_time(pool):
+    busy, lock = set(), threading.Lock()
+
+    def task(driver, item):
+        with lock:
+            assert driver.device_id not in busy
+            busy.add(driver.device_id)
+        time.sleep(0.01)
+        with lock:
+            busy.discard(driver.device_id)
+        if item == 3:
+            raise ValueError("task failed")
+        return item * 10, driver.device_id
+
+    results = pool.map(task, range(6))
+    assert isinstance(results[3], ValueError)
+    del results[3]
+    assert [value for value, _ in results] == [0, 10, 20, 40, 50]
+    assert {device_id for _, device_id in results} <= {"a", "b"}
+
+
+def test_map_without_items_runs_once_per_device(pool):
+    assert sorted(pool.map(lambda driver: driver.device_id)) == ["a", "b"]
+
+
+def test_stop_stops_every_driver():
+    pool = DevicePool(["a", "b"], driver_factory=FakeDriver).start()
+    drivers = list(pool.drivers.values())
+    pool.stop()
+    assert all(driver.stopped for driver in drivers) and len(pool) == 0
+    pool.release(drivers[0])
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.05)
+
+
+def test_allocated_ports_are_free_unique_and_released():
+    ports = [allocate_port() for _ in range(20)]
+    assert len(set(ports)) == 20
+    assert all(port in client_module._used_ports for port in ports)
+    for port in ports:
+        release_port(port)
+    assert not set(ports) & client_module._used_ports
+
+
+def test_allocation_skips_ports_bound_by_another_process():
+    taken = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    taken.bind(("127.0.0.1", 0))
+    taken.listen(1)
+    port = taken.getsockname()[1]
+    try:
+        assert not port_is_free(port)
+        with pytest.raises(HDriverError):
+            allocate_port((port, port + 1), attempts=5)
+    finally:
+        taken.close()
+
+
+def test_runner_releases_only_an_allocated_port():
+    runner = client_module.TestRunner("fake")
+    port = runner.local_port
+    assert port in client_module._used_ports
+    client_module.TestRunner("fake", local_port=port).release_port()
+    assert port in client_module._used_ports
+    runner.release_port()
+    runner.release_port()
+    assert port not in client_module._used_ports
+
+
+def test_client_close_releases_its_port():
+    with FakeDevice() as device:
+        class AllocatingClient(LocalClient):
+            # 分配到的端口就是FakeDevice监听的端口
+            def get_random_port(self):
+                client_module._used_ports.add(device.port)
+                return device.port
+
+        local = AllocatingClient("fake")
+        assert device.port in client_module._used_ports
+        local.close()
+        assert device.port not in client_module._used_ports
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import json
+import socket
+import threading
+import zipfile
+
+import pytest
+
+from HMDriverClient.client import parse_reply
+from HMDriverClient.exception import *
+from HMDriverClient.protocol import CODECS, FRAME_HEADER, PROTOCOL_VERSION, FrameReader, decode_reply, \
+    hap_protocol, hello_encoding, hello_frame, pack_frame, read_hello
+
+
+@pytest.fixture
+def pair():
+    left, right = socket.socketpair()
+    yield left, right
+    left.close()
+    right.close()
+
+
+def test_frames_in_one_send_are_split(pair):
+    left, right = pair
+    left.sendall(pack_frame(b"one") + pack_frame(b"") + pack_frame(b"three"))
+    reader = FrameReader(right)
+    assert [reader.read_frame() for _ in range(3)] == [b"one", b"", b"three"]
+
+
+def test_frame_split_across_sends(pair):
+    left, right = pair
+    frame = pack_frame(b"x" * 1000)
+    reader = FrameReader(right, chunk_size=7)
+
+    def send():
+        for index in range(0, len(frame), 3):
+            left.sendall(frame[index:index + 3])
+
+    sender = threading.Thread(target=send)
+    sender.start()
+    assert reader.read_frame() == b"x" * 1000
+    sender.join()
+
+
+def test_large_frame(pair):
+    left, right = pair
+    payload = bytes(range(256)) * 8192
+    sender = threading.Thread(target=left.sendall, args=(pack_frame(payload) + pack_frame(b"next"),))
+    sender.start()
+    reader = FrameReader(right)
+    assert reader.read_frame() == payload
+    assert reader.read_frame() == b"next"
+    sender.join()
+
+
+def test_closed_socket_raises(pair):
+    left, right = pair
+    left.sendall(FRAME_HEADER.pack(10) + b"abc")
+    left.close()
+    with pytest.raises(SocketError):
+        FrameReader(right).read_frame()
+
+
+def test_hello_frame_offers_encodings_and_version(pair):
+    left, right = pair
+    left.sendall(hello_frame(["msgpack", "json"]))
+    hello = json.loads(FrameReader(right).read_frame())
+    assert hello == {"action": "hello", "encodings": ["msgpack", "json"], "protocol": PROTOCOL_VERSION}
+
+
+def reply(msg):
+    return pack_frame(json.dumps(msg).encode("utf8"))
+
+
+def test_hello_negotiation(pair):
+    left, right = pair
+    left.sendall(reply({"protocol": PROTOCOL_VERSION, "encoding": "json"}))
+    assert read_hello(FrameReader(right)) == "json"
+    assert hello_encoding(json.dumps({"protocol": PROTOCOL_VERSION, "encoding": "unknown"}).encode()) == "json"
+    if "msgpack" in CODECS:
+        assert hello_encoding(json.dumps({"protocol": PROTOCOL_VERSION, "encoding": "msgpack"}).encode()) == "msgpack"
+
+
+@pytest.mark.parametrize("raw", [b"Hello client!", pack_frame(b"Hello client!"), reply({"encoding": "json"}),
+                                 reply({"protocol": PROTOCOL_VERSION - 1, "encoding": "json"})])
+def test_old_runner_is_rejected(pair, raw):
+    left, right = pair
+    left.sendall(raw)
+    with pytest.raises(ProtocolVersionError):
+        read_hello(FrameReader(right))
+
+
+def test_decode_reply_parses_only_legacy_nested_slots():
+    legacy = {"uuid": "u", "property": json.dumps({"id": "a"}),
+              "data": json.dumps([{"euid": "e", "property": json.dumps({"id": "b"})}])}
+    assert decode_reply(legacy) == {"uuid": "u", "property": {"id": "a"},
+                                    "data": [{"euid": "e", "property": {"id": "b"}}]}
+    text = {"uuid": "u", "data": "[not json"}
+    assert decode_reply(text)["data"] == "[not json"
+    assert decode_reply({"uuid": "u", "data": {"text": "{kept}"}})["data"] == {"text": "{kept}"}
+
+
+def element_info(index):
+    return {"id": f"id_{index}", "text": "{not json}", "bounds": {"left": index, "top": 0, "right": 10, "bottom": 10},
+            "isClickable": True}
+
+
+def test_decode_reply_legacy_string_replies():
+    # 旧版本runner用JSON.stringify把property和data作为字符串嵌套在回复里
+    find = {"uuid": "u", "euid": "e1", "property": json.dumps(element_info(1))}
+    assert decode_reply(find)["property"] == element_info(1)
+    size = {"uuid": "u", "data": json.dumps({"width": 1260, "height": 2720})}
+    assert decode_reply(size)["data"] == {"width": 1260, "height": 2720}
+    finds = {"uuid": "u", "data": json.dumps([{"euid": "e1", "property": json.dumps(element_info(1))},
+                                              {"euid": "e2", "property": element_info(2)}])}
+    assert decode_reply(finds)["data"] == [{"euid": "e1", "property": element_info(1)},
+                                           {"euid": "e2", "property": element_info(2)}]
+    # 不是json的字符串原样保留，不会用eval解析python的str(dict)
+    for text in ("{'width': 1260}", "ok", "[1, 2"):
+        assert decode_reply({"uuid": "u", "data": text})["data"] == text
+
+
+@pytest.mark.parametrize("encoding", sorted(CODECS))
+def test_decode_reply_is_the_same_for_every_encoding(encoding):
+    dumps, loads = CODECS[encoding]
+    message = {"uuid": "u", "data": [{"euid": "e1", "property": element_info(1)}, {"ret": "error", "description": "x"}],
+               "property": element_info(0)}
+    decoded = decode_reply(loads(dumps(message)))
+    assert decoded == message
+    assert decoded["data"][0]["property"]["isClickable"] is True
+
+
+def test_parse_reply_raises_the_matching_error():
+    with pytest.raises(ElementNotFoundError):
+        parse_reply({"uuid": "u", "ret": "error", "description": "no ele: id btn"})
+    with pytest.raises(HDriverError) as info:
+        parse_reply({"uuid": "u", "ret": "error", "description": "inject gesture segment 0 failed"})
+    assert type(info.value) is HDriverError and str(info.value) == "inject gesture segment 0 failed"
+    # batch步骤里的错误不在顶层，由run_batch逐个处理
+    nested = parse_reply({"uuid": "u", "data": [{"ret": "error", "description": "no ele: id btn"}]})
+    assert nested == {"data": [{"ret": "error", "description": "no ele: id btn"}]}
+    assert parse_reply({"uuid": "u", "data": json.dumps({"width": 1})}) == {"data": {"width": 1}}
+
+
+def make_hap(path, abc=None):
+    with zipfile.ZipFile(path, "w") as hap:
+        hap.writestr("module.json", "{}")
+        if abc is not None:
+            hap.writestr("ets/modules.abc", abc)
+    return str(path)
+
+
+def test_hap_protocol_reads_the_compiled_marker(tmp_path):
+    assert hap_protocol(make_hap(tmp_path / "new.hap", b"\x00HMDriverProtocol/3\x00Hello client!")) == 3
+    assert hap_protocol(make_hap(tmp_path / "old.hap", b"\x00Hello client!\x00")) == 0
+    assert hap_protocol(make_hap(tmp_path / "empty.hap")) == 0
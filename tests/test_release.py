@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import gc
+import os
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+from HMDriverClient.element import Element
+from HMDriverClient.window import UiWindow
+from tests.fake_device import FakeDevice, LocalClient
+
+
+@pytest.fixture
+def device():
+    with FakeDevice() as fake:
+        yield fake
+
+
+@pytest.fixture
+def client(device):
+    local = LocalClient("fake", local_port=device.port)
+    local.release_batch_size = 4
+    yield local
+    local.close()
+
+
+def releases(device, timeout=1.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        found = [msg for msg in device.requests if msg["action"] == "release"]
+        if found or time.monotonic() > deadline:
+            return found
+        time.sleep(0.01)
+
+
+def test_queued_handles_go_out_in_one_release_with_the_next_request(device, client):
+    elements = [Element(client, f"e{index}", {}) for index in range(3)]
+    window = UiWindow(client, "w0", {})
+    elements[0].release()
+    elements[0].release()
+    del elements[1:]
+    del window
+    gc.collect()
+    assert releases(device, timeout=0.1) == []
+    client.request({"action": "ping"})
+    sent = releases(device)
+    assert len(sent) == 1
+    assert sorted(sent[0]["euids"]) == ["e0", "e1", "e2"] and sent[0]["wuids"] == ["w0"]
+    assert [msg["action"] for msg in device.requests] == ["release", "ping"]
+
+
+def test_below_the_batch_size_nothing_is_sent(device, client):
+    Element(client, "e0", {}).release()
+    client.request({"action": "ping"})
+    assert releases(device, timeout=0.1) == []
+    client.flush_releases()
+    assert releases(device)[0]["euids"] == ["e0"]
+
+
+def test_close_flushes_queued_releases(device):
+    local = LocalClient("fake", local_port=device.port)
+    for index in range(2):
+        Element(local, f"e{index}", {}).release()
+    local.close()
+    sent = releases(device)
+    assert len(sent) == 1 and sent[0]["euids"] == ["e0", "e1"]
+    # 关闭之后释放的句柄被丢弃
+    Element(local, "late", {}).release()
+    assert local._release_euids == []
+
+
+def test_release_after_the_socket_died_does_not_raise(device, client):
+    element = Element(client, "e0", {})
+    device.drop_connections()
+    client.dispatcher.close()
+    element.release()
+    del element
+    gc.collect()
+    # 下一个请求重连后带上释放请求
+    for index in range(1, 4):
+        Element(client, f"e{index}", {}).release()
+    client.request({"action": "ping"})
+    assert releases(device)[0]["euids"] == ["e0", "e1", "e2", "e3"]
+
+
+def test_half_built_handles_do_not_fail_in_del():
+    element = Element.__new__(Element)
+    window = UiWindow.__new__(UiWindow)
+    element.release()
+    window.release()
+
+
+def test_no_errors_from_del_at_interpreter_exit(device):
+    script = textwrap.dedent(f"""
+        from HMDriverClient.element import Element
+        from tests.fake_device import LocalClient
+        client = LocalClient("fake", local_port={device.port})
+        elements = [Element(client, "e%d" % index, {{}}) for index in range(100)]
+    """)
+    proc = subprocess.run([sys.executable, "-c", script], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                          timeout=30, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    out = proc.stdout.decode("utf8", "ignore")
+    assert proc.returncode == 0, out
+    assert "Exception ignored" not in out and "Traceback" not in out, out
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from HMDriverClient.element import ElementBy, MatchPattern
+from HMDriverClient.exception import SelectorSyntaxError
+from HMDriverClient.selector import compile_selector
+
+
+def conditions(text):
+    return compile_selector(text).query["conditions"]
+
+
+def test_type_id_and_attributes():
+    assert conditions('Button#btn_ok[text^="确定"][enabled]') == [
+        {"by": ElementBy.type, "value": "Button", "pattern": MatchPattern.EQUALS},
+        {"by": ElementBy.id, "value": "btn_ok", "pattern": MatchPattern.EQUALS},
+        {"by": ElementBy.text, "value": "确定", "pattern": MatchPattern.STARTS_WITH},
+        {"by": ElementBy.enabled, "value": True},
+    ]
+
+
+@pytest.mark.parametrize("op, pattern", [("=", MatchPattern.EQUALS), ("*=", MatchPattern.CONTAINS),
+                                         ("^=", MatchPattern.STARTS_WITH), ("$=", MatchPattern.ENDS_WITH)])
+def test_operators(op, pattern):
+    assert conditions(f"[description{op}more]") == [{"by": ElementBy.description, "value": "more",
+                                                      "pattern": pattern}]
+
+
+def test_quoted_values_and_flags():
+    assert conditions(r'#"a.b"[text="it\'s [x]"][checked=false]') == [
+        {"by": ElementBy.id, "value": "a.b", "pattern": MatchPattern.EQUALS},
+        {"by": ElementBy.text, "value": "it's [x]", "pattern": MatchPattern.EQUALS},
+        {"by": ElementBy.checked, "value": False},
+    ]
+
+
+def test_relations_nest():
+    query = conditions('Button:after(Text[text="用户名"]):before(#footer)')
+    assert query[1] == {"by": ElementBy.isAfter, "value": {"conditions": [
+        {"by": ElementBy.type, "value": "Text", "pattern": MatchPattern.EQUALS},
+        {"by": ElementBy.text, "value": "用户名", "pattern": MatchPattern.EQUALS}]}}
+    assert query[2]["by"] == ElementBy.isBefore
+
+
+def test_compiled_selectors_are_cached():
+    assert compile_selector("Button[clickable]") is compile_selector("Button[clickable]")
+
+
+@pytest.mark.parametrize("text", ["", "[", "[text]", "[id*=a]", "[size=1]", "[enabled=maybe]", ":inside(Text)",
+                                  "Button:after(Text", "Button Text", '[text="open]'])
+def test_syntax_errors(text):
+    with pytest.raises(SelectorSyntaxError):
+        compile_selector(text)
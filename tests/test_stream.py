@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from HMDriverClient.stream import FrameRingBuffer
+
+
+def frame_bytes(frame):
+    return bytes(frame.data)
+
+
+def test_frames_are_kept_until_the_buffer_is_full():
+    buffer = FrameRingBuffer(capacity=3, slot_size=8)
+    assert buffer.latest() is None and buffer.frames() == []
+    ids = [buffer.put(b"f%d" % index, timestamp=index) for index in range(3)]
+    assert ids == [0, 1, 2]
+    assert [frame_bytes(frame) for frame in buffer.frames()] == [b"f0", b"f1", b"f2"]
+    assert buffer.latest().frame_id == 2 and buffer.latest().timestamp == 2
+    assert buffer.dropped == 0
+
+
+def test_oldest_frame_is_overwritten_and_counted():
+    buffer = FrameRingBuffer(capacity=3, slot_size=8)
+    for index in range(5):
+        buffer.put(b"f%d" % index)
+    assert buffer.dropped == 2
+    assert [frame.frame_id for frame in buffer.frames()] == [2, 3, 4]
+    assert buffer.get(1) is None and buffer.get(-1) is None and buffer.get(5) is None
+    assert frame_bytes(buffer.get(4)) == b"f4"
+
+
+def test_view_on_a_reused_slot_is_invalid():
+    buffer = FrameRingBuffer(capacity=2, slot_size=8)
+    first = buffer.get(buffer.put(b"first"))
+    buffer.put(b"second")
+    assert buffer.is_valid(first) and frame_bytes(first) == b"first"
+    copied = bytes(first.data)
+    buffer.put(b"third")
+    # 槽位被重用，memoryview看到的是新数据，is_valid返回False，提前复制的数据不受影响
+    assert not buffer.is_valid(first)
+    assert frame_bytes(first) == b"third"
+    assert copied == b"first"
+
+
+def test_larger_frame_gets_a_new_slot_and_old_view_keeps_its_data():
+    buffer = FrameRingBuffer(capacity=1, slot_size=4)
+    small = buffer.get(buffer.put(b"abcd"))
+    large = buffer.get(buffer.put(b"0123456789"))
+    assert frame_bytes(large) == b"0123456789"
+    assert frame_bytes(small) == b"abcd" and not buffer.is_valid(small)
+    assert buffer.dropped == 1
+
+
+def test_wait_for_frame():
+    buffer = FrameRingBuffer(capacity=2, slot_size=8)
+    assert buffer.wait_for_frame(timeout=0.01) is None
+    buffer.put(b"f0")
+    assert buffer.wait_for_frame(timeout=0.01).frame_id == 0
+    assert buffer.wait_for_frame(after_id=0, timeout=0.01) is None
+    threading.Timer(0.05, buffer.put, args=(b"f1",)).start()
+    frame = buffer.wait_for_frame(after_id=0, timeout=2)
+    assert frame.frame_id == 1 and frame_bytes(frame) == b"f1"
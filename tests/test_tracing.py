@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import json
+import socket
+import threading
+import time
+
+from HMDriverClient.dispatcher import Dispatcher
+from HMDriverClient.protocol import FrameReader, pack_frame
+from HMDriverClient.tracing import RequestTrace, Tracer
+from tests.fake_device import FakeDevice, LocalClient
+
+
+def make_trace(action, start, error=None):
+    trace = RequestTrace(action)
+    trace.uuid = f"{action}_{start}"
+    trace.t_start = start
+    trace.t_serialized = start + 0.001
+    trace.t_sent = start + 0.002
+    trace.t_first_byte = start + 0.010
+    trace.t_received = start + 0.011
+    trace.t_decoded = start + 0.012
+    trace.t_done = start + 0.013
+    trace.error = error
+    return trace
+
+
+def test_counters_per_action():
+    tracer = Tracer()
+    tracer.record(make_trace("find", 1.0))
+    tracer.record(make_trace("find", 2.0, error="no ele"))
+    tracer.record(make_trace("click", 3.0))
+    counters = tracer.counters()
+    assert counters["find"]["count"] == 2 and counters["find"]["errors"] == 1
+    assert abs(counters["find"]["seconds"] - 0.026) < 1e-9
+    assert abs(counters["click"]["wait"] - 0.008) < 1e-9
+    assert [name for name, _, _ in make_trace("x", 0).phases()] == \
+           ["serialize", "send", "wait", "receive", "deserialize", "decode"]
+
+
+def test_prometheus_families_are_contiguous():
+    tracer = Tracer()
+    tracer.record(make_trace("find", 1.0))
+    tracer.record(make_trace("click", 2.0))
+    families = []
+    for line in tracer.prometheus().splitlines():
+        if line.startswith("# TYPE "):
+            families.append(line.split()[2])
+            continue
+        name = line.split("{")[0]
+        # 样本属于最近的TYPE行
+        assert name == families[-1]
+    assert families == ["hdriver_requests_total", "hdriver_request_errors_total", "hdriver_request_seconds_total",
+                        "hdriver_request_phase_seconds_total"]
+    assert 'hdriver_request_phase_seconds_total{action="click",phase="decode"} 0.001000' in tracer.prometheus()
+
+
+def test_chrome_trace_has_request_and_phase_events():
+    tracer = Tracer()
+    tracer.record(make_trace("find", 1.0, error="no ele"))
+    events = json.loads(json.dumps(tracer.chrome_trace()))["traceEvents"]
+    assert events[0]["name"] == "find" and events[0]["args"]["error"] == "no ele"
+    assert [event["name"] for event in events[1:]] == [name for name, _, _ in RequestTrace.PHASES]
+    assert all(event["ph"] == "X" for event in events)
+
+
+def test_client_fills_every_phase():
+    with FakeDevice() as device:
+        client = LocalClient("fake", local_port=device.port)
+        client.tracer = Tracer()
+        client.request({"action": "ping"})
+        client.close()
+    trace = client.tracer.traces[0]
+    assert trace.action == "ping" and trace.error is None
+    assert len(trace.phases()) == len(RequestTrace.PHASES)
+
+
+class SlowSendSocket(object):
+    """
+    socket whose sendall returns late, as if the sending thread was preempted right after the send
+    """
+
+    def __init__(self, sock, delay):
+        self.sock = sock
+        self.delay = delay
+
+    def sendall(self, data):
+        self.sock.sendall(data)
+        time.sleep(self.delay)
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+def check_order(trace):
+    assert trace.t_start <= trace.t_serialized <= trace.t_sent <= trace.t_first_byte <= trace.t_received \
+           <= trace.t_decoded
+
+
+def test_replies_read_from_one_recv_have_a_wait_phase():
+    client_sock, device_sock = socket.socketpair()
+    dispatcher = Dispatcher(client_sock, FrameReader(client_sock))
+    traces = [RequestTrace("x"), RequestTrace("y")]
+    futures = [dispatcher.submit({"uuid": uuid, "action": trace.action}, trace)
+               for uuid, trace in zip("ab", traces)]
+    device = FrameReader(device_sock)
+    assert [json.loads(device.read_frame())["uuid"] for _ in range(2)] == ["a", "b"]
+    time.sleep(0.05)
+    # 两个回复在一次send中发出，读线程一次recv读到
+    device_sock.sendall(b"".join(pack_frame(json.dumps({"uuid": uuid, "data": 0}).encode("utf8"))
+                                 for uuid in "ab"))
+    for future, trace in zip(futures, traces):
+        future.result(1)
+        check_order(trace)
+        assert trace.t_first_byte - trace.t_sent >= 0.04
+    dispatcher.close()
+    device_sock.close()
+
+
+def test_reply_before_the_send_timestamp_is_not_negative():
+    client_sock, device_sock = socket.socketpair()
+    dispatcher = Dispatcher(SlowSendSocket(client_sock, 0.1), FrameReader(client_sock))
+    device = FrameReader(device_sock)
+    replier = threading.Thread(target=lambda: device_sock.sendall(pack_frame(device.read_frame())))
+    replier.start()
+    trace = RequestTrace("x")
+    dispatcher.submit({"uuid": "a", "action": "x"}, trace).result(1)
+    replier.join()
+    check_order(trace)
+    # 读线程处理回复时发送线程还没有记录发送时间
+    assert trace.t_first_byte - trace.t_sent < 0.05
+    dispatcher.close()
+    device_sock.close()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import io
+
+import pytest
+
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+
+from HMDriverClient.hmdriver import HMDriver
+from HMDriverClient.stream import Frame
+from HMDriverClient.vision import ImageMatcher
+
+SCREEN = (0, 0, 400, 300)
+TEMPLATE_AT = (250, 180)
+
+
+def make_template():
+    rng = np.random.RandomState(7)
+    return (rng.rand(40, 40) * 255).astype(np.uint8)
+
+
+def make_screen():
+    screen = np.full((SCREEN[3], SCREEN[2]), 30, dtype=np.uint8)
+    left, top = TEMPLATE_AT
+    screen[top:top + 40, left:left + 40] = make_template()
+    return screen
+
+
+def png(array):
+    out = io.BytesIO()
+    Image.fromarray(array).save(out, format="PNG")
+    return out.getvalue()
+
+
+class FakeStream(object):
+
+    def __init__(self, region):
+        self.region = region
+        left, top, right, bottom = region
+        self.frame = Frame(1, 0.0, memoryview(png(make_screen()[top:bottom, left:right])))
+
+    def latest(self):
+        return self.frame
+
+    def stop(self):
+        pass
+
+
+class StreamDriver(HMDriver):
+
+    def __init__(self, stream_region):
+        self.client = None
+        self.image_matcher = ImageMatcher()
+        self.screen_stream = FakeStream(stream_region)
+        self.screenshots = 0
+
+    def get_screenshot_png(self):
+        self.screenshots += 1
+        return png(make_screen())
+
+
+def test_full_screen_screenshot():
+    match = ImageMatcher().find(png(make_screen()), make_template())
+    assert match.bounds == {"left": 250, "top": 180, "right": 290, "bottom": 220}
+
+
+def test_stream_region_match_is_in_screen_coordinates():
+    driver = StreamDriver((200, 100, 400, 300))
+    match = driver.find_image(make_template(), region=(220, 150, 400, 300))
+    assert driver.screenshots == 0
+    assert match.bounds == {"left": 250, "top": 180, "right": 290, "bottom": 220}
+    assert match.center == (270, 200)
+
+
+def test_stream_region_not_covering_search_falls_back_to_screenshot():
+    driver = StreamDriver((200, 100, 400, 300))
+    match = driver.find_image(make_template())
+    assert driver.screenshots == 1
+    assert match.bounds["left"] == 250 and match.bounds["top"] == 180
+    driver.find_image(make_template(), region=(100, 100, 400, 300))
+    assert driver.screenshots == 2